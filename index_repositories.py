@@ -0,0 +1,234 @@
+"""
+Index the repository revisions of the competition data into Zoekt shards, in parallel and incrementally.
+
+Every `repositories-{language}-{stage}` folder of the data root is indexed into
+`{index-root}/{stage}/{language}`, the folder the `zoekt-webserver` service of docker-compose.yml serves.
+Each `{owner}__{repository}-{revision}` directory is indexed by its own `zoekt-index` process
+(`zoekt-git-index` for git checkouts), at most --jobs at a time. A repository is skipped when its shards
+are newer than its contents, so that re-runs only index new or changed revisions.
+
+    python index_repositories.py --data-root data --language kotlin --stage public --jobs 8
+
+The indexer commands are templates, formatted with {index_dir}, {repository} (path) and {name}, so that
+another binary can stand in for Zoekt:
+
+    python index_repositories.py --index-command "./stub-index {index_dir} {repository}"
+"""
+import os
+import re
+import sys
+import glob
+import json
+import time
+import shlex
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+from urllib.parse import quote_plus
+
+REPOSITORIES_DIR_PATTERN = re.compile(r"repositories-(?P<language>[a-z]+)-(?P<stage>.+)")
+INDEX_COMMAND = "zoekt-index -index {index_dir} {repository}"
+GIT_INDEX_COMMAND = "zoekt-git-index -index {index_dir} {repository}"
+# repositories indexed by previous runs, for the shards that are not named after their directory
+MANIFEST_FILE_NAME = "index-manifest.json"
+
+
+@dataclass
+class Repository:
+    name: str  # {owner}__{repository}-{revision}
+    path: str
+    index_dir: str
+    is_git: bool
+
+
+@dataclass
+class IndexResult:
+    name: str
+    index_dir: str
+    status: str  # indexed, skipped or failed
+    seconds: float = 0.0
+    returncode: Optional[int] = None
+    error: str = ""
+
+
+def discover_repositories(data_root: str, index_root: str, languages: List[str], stages: List[str]) -> List[Repository]:
+    """
+    Repository revisions of every repositories-{language}-{stage} folder of data_root, filtered by language and stage.
+    """
+    repositories = []
+    for folder in sorted(os.listdir(data_root)):
+        match = REPOSITORIES_DIR_PATTERN.fullmatch(folder)
+        if match is None or not os.path.isdir(os.path.join(data_root, folder)):
+            continue
+        if languages and match["language"] not in languages or stages and match["stage"] not in stages:
+            continue
+        index_dir = os.path.join(index_root, match["stage"], match["language"])
+        for name in sorted(os.listdir(os.path.join(data_root, folder))):
+            path = os.path.join(data_root, folder, name)
+            # the per-repository archives sit next to their extracted directories
+            if os.path.isdir(path):
+                repositories.append(Repository(name, path, index_dir, os.path.isdir(os.path.join(path, ".git"))))
+    return repositories
+
+
+def newest_mtime(path: str) -> float:
+    """
+    Latest modification time of a directory tree, its directories included so that deletions count.
+    """
+    newest = os.stat(path).st_mtime
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                newest = max(newest, os.lstat(os.path.join(dirpath, name)).st_mtime)
+            except OSError:
+                pass
+    return newest
+
+
+def find_shards(index_dir: str, name: str) -> List[str]:
+    """
+    Shards Zoekt writes for a directory, {name}_v{format}.{n}.zoekt with the name escaped like a URL query.
+    """
+    return glob.glob(os.path.join(glob.escape(index_dir), glob.escape(quote_plus(name)) + "_v*.zoekt"))
+
+
+def load_manifest(index_dir: str) -> Dict[str, Dict]:
+    path = os.path.join(index_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(index_dir: str, manifest: Dict[str, Dict]) -> None:
+    path = os.path.join(index_dir, MANIFEST_FILE_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def last_indexed(repository: Repository, manifest: Dict[str, Dict]) -> Optional[float]:
+    """
+    When the repository was last indexed: the oldest of its shards, or the start of the run that indexed it
+    if its shards are named differently (zoekt-git-index names them after the remote).
+    """
+    shards = find_shards(repository.index_dir, repository.name)
+    if shards:
+        return min(os.stat(shard).st_mtime for shard in shards)
+    entry = manifest.get(repository.name)
+    return entry["indexed_at"] if entry else None
+
+
+def is_up_to_date(repository: Repository, manifest: Dict[str, Dict]) -> bool:
+    indexed_at = last_indexed(repository, manifest)
+    return indexed_at is not None and newest_mtime(repository.path) < indexed_at
+
+
+def index_command(repository: Repository, index_template: str, git_index_template: str) -> List[str]:
+    template = git_index_template if repository.is_git else index_template
+    fields = dict(index_dir=repository.index_dir, repository=repository.path, name=repository.name)
+    # split before formatting, so that paths with spaces stay single arguments
+    return [argument.format(**fields) for argument in shlex.split(template)]
+
+
+def index_repository(repository: Repository, command: List[str], timeout: Optional[float]) -> IndexResult:
+    started = time.perf_counter()
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return IndexResult(repository.name, repository.index_dir, "failed", time.perf_counter() - started, error=str(e))
+    seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        return IndexResult(repository.name, repository.index_dir, "failed", seconds, completed.returncode,
+                           completed.stderr.strip()[-2000:])
+    return IndexResult(repository.name, repository.index_dir, "indexed", seconds, completed.returncode)
+
+
+def index_repositories(repositories: List[Repository],
+                       jobs: int,
+                       index_template: str = INDEX_COMMAND,
+                       git_index_template: str = GIT_INDEX_COMMAND,
+                       force: bool = False,
+                       timeout: Optional[float] = None) -> List[IndexResult]:
+    """
+    Index the repositories that are not up to date on a pool of jobs indexer processes.
+    The manifest of an index folder is updated as its repositories complete, so that an interrupted run
+    keeps what it indexed.
+    """
+    manifests: Dict[str, Dict[str, Dict]] = {}
+    for repository in repositories:
+        if repository.index_dir not in manifests:
+            os.makedirs(repository.index_dir, exist_ok=True)
+            manifests[repository.index_dir] = load_manifest(repository.index_dir)
+
+    results: List[IndexResult] = []
+    to_index = []
+    for repository in repositories:
+        if not force and is_up_to_date(repository, manifests[repository.index_dir]):
+            results.append(IndexResult(repository.name, repository.index_dir, "skipped"))
+        else:
+            to_index.append(repository)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {}
+        for repository in to_index:
+            # contents changed during the run are newer than this and get indexed again next time
+            started_at = time.time()
+            command = index_command(repository, index_template, git_index_template)
+            futures[executor.submit(index_repository, repository, command, timeout)] = (repository, started_at)
+        for future in as_completed(futures):
+            repository, started_at = futures[future]
+            result = future.result()
+            results.append(result)
+            print(f"{result.status:>8} {result.seconds:8.2f}s {repository.name}", flush=True)
+            if result.status == "indexed":
+                manifest = manifests[repository.index_dir]
+                manifest[repository.name] = {"indexed_at": started_at, "seconds": round(result.seconds, 3)}
+                save_manifest(repository.index_dir, manifest)
+            elif result.error:
+                print(result.error, file=sys.stderr)
+    return results
+
+
+def print_report(results: List[IndexResult], elapsed: float) -> None:
+    indexed = [result for result in results if result.status == "indexed"]
+    counts = {status: sum(result.status == status for result in results) for status in ("indexed", "skipped", "failed")}
+    print(", ".join(f"{count} {status}" for status, count in counts.items()) + f" in {elapsed:.1f}s")
+    if indexed:
+        seconds = sorted(result.seconds for result in indexed)
+        print(f"indexing time per repository: total {sum(seconds):.1f}s, median {seconds[len(seconds) // 2]:.2f}s, max {seconds[-1]:.2f}s")
+        for result in sorted(indexed, key=lambda result: -result.seconds)[:5]:
+            print(f"  {result.seconds:8.2f}s {result.name}")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Index the repositories of the competition data into Zoekt shards.")
+    argparser.add_argument("--data-root", type=str, default="data", help="Folder of the repositories-{language}-{stage} folders")
+    argparser.add_argument("--index-root", type=str, default=os.path.join("build", "volumes", "zoekt-index-data"),
+                           help="Shards are written to {index-root}/{stage}/{language}")
+    argparser.add_argument("--language", type=str, nargs="*", default=[], help="Only index these languages")
+    argparser.add_argument("--stage", type=str, nargs="*", default=[], help="Only index these stages")
+    argparser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Indexer processes run at once")
+    argparser.add_argument("--index-command", type=str, default=INDEX_COMMAND, help="Indexer of plain directories")
+    argparser.add_argument("--git-index-command", type=str, default=GIT_INDEX_COMMAND, help="Indexer of git checkouts")
+    argparser.add_argument("--timeout", type=float, default=None, help="Seconds after which an indexer is killed")
+    argparser.add_argument("--force", action="store_true", help="Index every repository, even up-to-date ones")
+    argparser.add_argument("--report", type=str, default=None, help="Write the result of every repository as JSON")
+    args = argparser.parse_args()
+
+    repositories = discover_repositories(args.data_root, args.index_root, args.language, args.stage)
+    print(f"Found {len(repositories)} repositories under {args.data_root}")
+    started = time.perf_counter()
+    results = index_repositories(repositories, args.jobs, args.index_command, args.git_index_command, args.force, args.timeout)
+    print_report(results, time.perf_counter() - started)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+    if any(result.status == "failed" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,11 @@ LANGUAGE=$2
 
 unzip data/$LANGUAGE-$STAGE -d data/repositories-$LANGUAGE-$STAGE
 
+# with REPOSITORY_SOURCE=zip, the pipeline reads the repository archives without extracting them
+if [ "${REPOSITORY_SOURCE:-directory}" = "zip" ]; then
+  exit 0
+fi
+
 for zipfile in data/repositories-$LANGUAGE-$STAGE/*.zip; do
   unzip -o "$zipfile" -d "${zipfile%.zip}"
 done
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark of the anchored diff against the plain line-mode diff of the whole file.
+
+Runs both on the completion points of {language}-{stage}.jsonl, checks that their outputs are identical
+and reports their latency distributions.
+
+    python benchmarks/bench_diff.py --data-root /data --language python --stage practice
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import jsonlines
+from configs.base import PreprocessorConfig
+from preprocessor import Preprocessor
+from utils import extract_diff
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def describe(name, timings):
+    return (f"{name:>10}: total {sum(timings):8.3f}s  mean {statistics.mean(timings) * 1000:8.2f}ms  "
+            f"p50 {percentile(timings, 0.5) * 1000:8.2f}ms  p95 {percentile(timings, 0.95) * 1000:8.2f}ms  "
+            f"max {max(timings) * 1000:8.2f}ms")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Compare the anchored diff with the whole-file diff.")
+    argparser.add_argument("--data-root", type=str, default=os.getenv('DATA_ROOT', '/data'))
+    argparser.add_argument("--language", type=str, default=os.getenv('LANGUAGE', 'python'))
+    argparser.add_argument("--stage", type=str, default=os.getenv('STAGE', 'practice'))
+    argparser.add_argument("--limit", type=int, default=None, help="Number of datapoints to benchmark")
+    argparser.add_argument("--repeat", type=int, default=3, help="Repetitions per datapoint, the fastest is kept")
+    args = argparser.parse_args()
+
+    config = PreprocessorConfig(data_root=args.data_root, language=args.language, stage=args.stage, use_tokenizer=False)
+    preprocessor = Preprocessor(config)
+    completion_points_file = os.path.join(args.data_root, f"{args.language}-{args.stage}.jsonl")
+
+    timings = {"whole": [], "anchored": []}
+    mismatches = []
+    with jsonlines.open(completion_points_file, 'r') as reader:
+        for index, datapoint in enumerate(reader):
+            if args.limit is not None and index >= args.limit:
+                break
+            original_code = preprocessor.get_original_code(datapoint)
+            incomplete_code = preprocessor.generate_incomplete_code(datapoint)
+            outputs = {}
+            for name, anchored in (("whole", False), ("anchored", True)):
+                best = float("inf")
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    outputs[name] = extract_diff(incomplete_code, original_code, anchored=anchored)
+                    best = min(best, time.perf_counter() - start)
+                timings[name].append(best)
+            if outputs["whole"] != outputs["anchored"]:
+                mismatches.append(datapoint.get("id", index))
+
+    if not timings["whole"]:
+        print(f"No datapoints found in {completion_points_file}")
+        return
+    print(f"{len(timings['whole'])} datapoints from {completion_points_file}")
+    for name in ("whole", "anchored"):
+        print(describe(name, timings[name]))
+    print(f"speedup: {sum(timings['whole']) / sum(timings['anchored']):.1f}x")
+    print(f"mismatching outputs: {len(mismatches)} {mismatches[:10]}")
+
+
+if __name__ == "__main__":
+    main()
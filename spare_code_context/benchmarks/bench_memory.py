@@ -0,0 +1,109 @@
+"""
+Peak-memory benchmark of loading the completion points eagerly versus streaming them through the runner.
+
+Generates synthetic datasets of increasing size, with large prefixes and suffixes, in a temporary data root,
+and reports the peak Python heap (tracemalloc) of:
+- eager: materializing every DataPoint of the file in a list, as the runner used to do;
+- streaming: preprocessing and generating the queries of each datapoint as it is read (Runner.iter_completion_points);
+- run_all (with --run-all): the whole pipeline, which needs a Zoekt webserver at ZOEKT_URL.
+The peak of the streaming modes should not grow with the number of datapoints.
+
+    python benchmarks/bench_memory.py --sizes 100 200 400 --prefix-kb 64
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from configs.base import PreprocessorConfig, PostProcessorConfig
+from configs.zoekt import QueryGeneratorConfig, SearchConfig
+from runner import Runner
+
+REPOSITORY = "bench/synthetic"
+REVISION = "0000000"
+FILE_PATH = "package/module.py"
+
+
+def synthetic_code(num_bytes: int, rng: random.Random) -> str:
+    lines = []
+    size = 0
+    while size < num_bytes:
+        name = "".join(rng.choices(string.ascii_lowercase, k=8))
+        line = f"def {name}(value):\n    return value + {rng.randint(0, 1000)}\n"
+        lines.append(line)
+        size += len(line)
+    return "".join(lines)
+
+
+def write_dataset(data_root: str, language: str, stage: str, num_datapoints: int, prefix_bytes: int) -> None:
+    """
+    Write num_datapoints completion points, all in the same file of a single repository.
+    """
+    rng = random.Random(0)
+    prefix = synthetic_code(prefix_bytes, rng)
+    suffix = synthetic_code(prefix_bytes, rng)
+    repository_dir = os.path.join(data_root, f"repositories-{language}-{stage}",
+                                  f"{REPOSITORY.replace('/', '__')}-{REVISION}", os.path.dirname(FILE_PATH))
+    os.makedirs(repository_dir, exist_ok=True)
+    with open(os.path.join(repository_dir, os.path.basename(FILE_PATH)), "w") as f:
+        f.write(prefix + "    result = compute(value)\n" + suffix)
+    with open(os.path.join(data_root, f"{language}-{stage}.jsonl"), "w") as f:
+        for index in range(num_datapoints):
+            f.write(json.dumps({"id": f"dp{index}", "repo": REPOSITORY, "revision": REVISION, "path": FILE_PATH,
+                                "modified": [], "prefix": prefix, "suffix": suffix, "archive": ""}) + "\n")
+
+
+def measure_peak(function) -> float:
+    """
+    Peak of the traced Python heap while running the function, in MiB.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Compare the peak memory of eager and streaming dataset loading.")
+    argparser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 400], help="Numbers of datapoints to generate")
+    argparser.add_argument("--prefix-kb", type=int, default=64, help="Size of the prefix and of the suffix of each datapoint")
+    argparser.add_argument("--language", type=str, default="python")
+    argparser.add_argument("--run-all", action="store_true", help="Also measure Runner.run_all, searching on ZOEKT_URL")
+    args = argparser.parse_args()
+
+    stage = "memory"
+    print(f"{'datapoints':>10} {'eager MiB':>10} {'streaming MiB':>14}" + (f" {'run_all MiB':>12}" if args.run_all else ""))
+    for num_datapoints in args.sizes:
+        with tempfile.TemporaryDirectory() as data_root:
+            write_dataset(data_root, args.language, stage, num_datapoints, args.prefix_kb * 1024)
+            paths = dict(language=args.language, stage=stage, data_root=data_root, predictions_root=data_root)
+            runner = Runner(PreprocessorConfig(use_tokenizer=False, **paths),
+                            QueryGeneratorConfig(queries_root=data_root, **paths),
+                            SearchConfig(**paths),
+                            PostProcessorConfig(use_tokenizer=False, **paths))
+
+            def stream():
+                for datapoint in runner.iter_completion_points():
+                    runner.prepare_query_point(datapoint)
+
+            # warm up the parsers and the file cache so that only the per-datapoint memory is measured
+            stream()
+            eager = measure_peak(runner.load_completion_points)
+            streaming = measure_peak(stream)
+            row = f"{num_datapoints:>10} {eager:>10.1f} {streaming:>14.1f}"
+            if args.run_all:
+                row += f" {measure_peak(runner.run_all):>12.1f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
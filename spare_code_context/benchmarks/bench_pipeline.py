@@ -0,0 +1,176 @@
+"""
+Offline throughput benchmark of the whole pipeline.
+
+Generates synthetic Python and Kotlin repositories and completion points (synthetic_repositories.py), serves
+them with a fake Zoekt webserver (fake_zoekt.py) and runs Runner.run_all on them in each execution mode.
+Every run happens in a fresh interpreter and reports the datapoints per second, the p50/p95 of each stage
+from the metrics report and the peak RSS of the runner and of its worker processes. Needs neither Docker,
+Zoekt, the competition data nor the network: without --tokenizer-path, token counts are estimated.
+
+    python benchmarks/bench_pipeline.py --datapoints 200 --latency-ms 5 --output bench.json
+    python benchmarks/bench_pipeline.py --baseline bench.json --max-regression 0.15
+
+With --baseline, the benchmark fails if the throughput of any run dropped by more than --max-regression.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BENCHMARKS_DIR)
+sys.path.append(os.path.join(BENCHMARKS_DIR, "..", "src"))
+
+from fake_zoekt import create_server
+from synthetic_repositories import write_dataset
+
+STAGE = "synthetic"
+MODES = ("batches", "async", "pool")
+STAGES = ("preprocess", "query_generation", "search", "postprocess")
+
+
+def run_once(language: str, mode: str, data_root: str, zoekt_url: str, workers: int, tokenizer_path: str) -> Dict[str, Any]:
+    """
+    Run the pipeline on the synthetic stage of a language, in this process.
+    """
+    from configs.base import PreprocessorConfig, PostProcessorConfig, RunnerConfig
+    from configs.zoekt import QueryGeneratorConfig, SearchConfig
+    from runner import Runner
+
+    paths = dict(language=language, stage=STAGE, data_root=data_root, predictions_root=os.path.join(data_root, "predictions", mode))
+    tokenizer = dict(use_tokenizer=bool(tokenizer_path), tokenizer_path=tokenizer_path or None)
+    runner_config = RunnerConfig(
+        num_workers=workers if mode == "pool" else 1,
+        use_async_pipeline=mode == "async",
+        metrics_enabled=True,
+        profile_ids="",
+        num_shards=1,
+        shard_index=0,
+    )
+    # the search cache would hide the latency of the webserver
+    search_config = SearchConfig(zoekt_url=zoekt_url, cache_max_entries=0, cache_dir=None, **paths)
+    started = time.perf_counter()
+    runner = Runner(PreprocessorConfig(**paths, **tokenizer),
+                    QueryGeneratorConfig(queries_root=os.path.join(data_root, "queries", mode), **paths),
+                    search_config,
+                    PostProcessorConfig(**paths, **tokenizer),
+                    runner_config)
+    built = time.perf_counter()
+    runner.run_all()
+    finished = time.perf_counter()
+    num_datapoints = runner.count_completion_points()
+    with open(runner.metrics_file, "r") as f:
+        report = json.load(f)
+    return {
+        "language": language,
+        "mode": mode,
+        "datapoints": num_datapoints,
+        "build_s": round(built - started, 3),
+        "run_s": round(finished - built, 3),
+        "datapoints_per_s": round(num_datapoints / (finished - built), 2),
+        "stages": {stage: {key: report["timers"][stage][key] for key in ("p50_ms", "p95_ms", "mean_ms")}
+                   for stage in STAGES if stage in report["timers"]},
+        # counted by the workers in pool mode
+        "search_found": sum(value for name, value in report["counters"].items() if name.startswith("search.found_at_candidate.")),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "workers_peak_rss_mib": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def run_in_subprocess(args: argparse.Namespace, language: str, mode: str, data_root: str, zoekt_url: str) -> Dict[str, Any]:
+    command = [sys.executable, os.path.abspath(__file__), "--run-one", language, mode,
+               "--data-root", data_root, "--zoekt-url", zoekt_url, "--workers", str(args.workers)]
+    if args.tokenizer_path:
+        command += ["--tokenizer-path", args.tokenizer_path]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise RuntimeError(f"The {mode} run on {language} failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline_file: str, max_regression: float) -> List[str]:
+    with open(baseline_file, "r") as f:
+        baseline = {(result["language"], result["mode"]): result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["language"], result["mode"]))
+        if previous is None:
+            continue
+        change = result["datapoints_per_s"] / previous["datapoints_per_s"] - 1
+        print(f"{result['language']:>8} {result['mode']:>8}: {previous['datapoints_per_s']:.1f} -> {result['datapoints_per_s']:.1f} dp/s ({change:+.1%})")
+        if change < -max_regression:
+            regressions.append(f"{result['language']} {result['mode']} throughput dropped by {-change:.1%}")
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark the pipeline offline on synthetic repositories and a fake Zoekt.")
+    argparser.add_argument("--languages", type=str, nargs="+", default=["python", "kotlin"])
+    argparser.add_argument("--modes", type=str, nargs="+", default=list(MODES), choices=MODES)
+    argparser.add_argument("--workers", type=int, default=2, help="Worker processes of the pool mode")
+    argparser.add_argument("--repositories", type=int, default=4)
+    argparser.add_argument("--files-per-repository", type=int, default=20)
+    argparser.add_argument("--functions-per-file", type=int, default=8)
+    argparser.add_argument("--datapoints", type=int, default=200)
+    argparser.add_argument("--latency-ms", type=float, default=5.0, help="Latency of every fake Zoekt search")
+    argparser.add_argument("--jitter-ms", type=float, default=0.0)
+    argparser.add_argument("--tokenizer-path", type=str, default=os.getenv("TOKENIZER_PATH"), help="Exported tokenizer, token counts are estimated without it")
+    argparser.add_argument("--data-root", type=str, default=None, help="Keep the synthetic data there instead of a temporary folder")
+    argparser.add_argument("--output", type=str, default=None, help="Write the results as JSON, to be used as a --baseline")
+    argparser.add_argument("--baseline", type=str, default=None, help="Results of a previous run to compare the throughput with")
+    argparser.add_argument("--max-regression", type=float, default=0.15)
+    argparser.add_argument("--run-one", type=str, nargs=2, metavar=("LANGUAGE", "MODE"), help=argparse.SUPPRESS)
+    argparser.add_argument("--zoekt-url", type=str, help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if args.run_one:
+        language, mode = args.run_one
+        print(json.dumps(run_once(language, mode, args.data_root, args.zoekt_url, args.workers, args.tokenizer_path)))
+        return
+
+    with tempfile.TemporaryDirectory() as temporary_root:
+        data_root = args.data_root or temporary_root
+        for language in args.languages:
+            write_dataset(data_root, language, STAGE, args.repositories, args.files_per_repository,
+                          args.functions_per_file, args.datapoints)
+        server = create_server([os.path.join(data_root, f"repositories-{language}-{STAGE}") for language in args.languages],
+                               latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        zoekt_url = f"http://127.0.0.1:{server.server_address[1]}/api/search"
+        results = []
+        try:
+            print(f"{'language':>8} {'mode':>8} {'dp/s':>8} {'found':>6}" + "".join(f" {stage + ' p50/p95 ms':>30}" for stage in STAGES)
+                  + f" {'RSS MiB':>8} {'workers':>8}")
+            for language in args.languages:
+                for mode in args.modes:
+                    result = run_in_subprocess(args, language, mode, data_root, zoekt_url)
+                    results.append(result)
+                    stages = "".join(f" {result['stages'][stage]['p50_ms']:>14.2f} /{result['stages'][stage]['p95_ms']:>13.2f}"
+                                     if stage in result["stages"] else f" {'-':>30}" for stage in STAGES)
+                    print(f"{language:>8} {mode:>8} {result['datapoints_per_s']:>8.1f} {result['search_found']:>6}{stages}"
+                          f" {result['peak_rss_mib']:>8.1f} {result['workers_peak_rss_mib']:>8.1f}")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"arguments": {key: value for key, value in vars(args).items() if key not in ("run_one", "zoekt_url")},
+                       "results": results}, f, indent=2)
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        if regressions:
+            print("\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Startup-time benchmark of the runner.
+
+Each repetition starts a fresh interpreter which imports runner.py and builds a Runner (tokenizer, parsers,
+symbol extractors, search requester), as a runner container or pool worker does, and reports the time of each step.
+
+    python benchmarks/bench_startup.py --repeat 5
+    TOKENIZER_PATH=/data/tokenizer python benchmarks/bench_startup.py --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Run in the child interpreter, the first timestamp is taken by the parent right before spawning it
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import runner
+imported = time.perf_counter()
+from configs.base import PreprocessorConfig, PostProcessorConfig
+from configs.zoekt import QueryGeneratorConfig, SearchConfig
+use_tokenizer = sys.argv[1] == "1"
+instance = runner.Runner(PreprocessorConfig(use_tokenizer=use_tokenizer), QueryGeneratorConfig(), SearchConfig(),
+                         PostProcessorConfig(use_tokenizer=use_tokenizer), preload=False)
+built = time.perf_counter()
+print(json.dumps({"import": imported - started, "build": built - imported, "interpreter_end": time.time()}))
+"""
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Measure the startup time of runner.py.")
+    argparser.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters to start")
+    argparser.add_argument("--no-tokenizer", action="store_true", help="Build the runner with use_tokenizer=False")
+    args = argparser.parse_args()
+
+    timings = {"interpreter": [], "import": [], "build": [], "total": []}
+    for _ in range(args.repeat):
+        spawned = time.time()
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, "0" if args.no_tokenizer else "1"],
+            cwd=SRC_DIR, capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            print(completed.stderr)
+            sys.exit(completed.returncode)
+        steps = json.loads(completed.stdout.strip().splitlines()[-1])
+        total = steps["interpreter_end"] - spawned
+        timings["import"].append(steps["import"])
+        timings["build"].append(steps["build"])
+        timings["total"].append(total)
+        timings["interpreter"].append(total - steps["import"] - steps["build"])
+
+    print(f"{args.repeat} runs, tokenizer {'disabled' if args.no_tokenizer else os.getenv('TOKENIZER_PATH') or 'resolved by name'}")
+    for name, values in timings.items():
+        print(f"{name:>12}: median {statistics.median(values):.3f}s  min {min(values):.3f}s  max {max(values):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Local stand-in for the Zoekt webserver's /api/search, over the repositories of a data root.
+
+Queries are evaluated like Zoekt does for the queries the pipeline generates: whitespace-separated terms
+are regular expressions that must all match a file (case-insensitive unless they contain an upper-case
+letter), `or` separates alternatives and `r:` filters the repositories. Responses carry the `Files` and
+`LineMatches` of a real response (base64 lines, fragments, context lines, scores and statistics), after
+a configurable latency.
+
+    python benchmarks/fake_zoekt.py --repositories-root /data/repositories-python-practice --port 6070 --latency-ms 5
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+SOURCE_EXTENSIONS = {".py": "Python", ".kt": "Kotlin", ".kts": "Kotlin"}
+
+
+class RepositoryFile:
+    __slots__ = ("repository", "name", "language", "content", "lines")
+
+    def __init__(self, repository: str, name: str, language: str, content: str) -> None:
+        self.repository = repository
+        self.name = name
+        self.language = language
+        self.content = content
+        self.lines = content.splitlines()
+
+
+def load_repositories(repositories_root: str) -> List[RepositoryFile]:
+    """
+    Source files of every repository directory under repositories_root, named like Zoekt names them.
+    """
+    files = []
+    for repository in sorted(os.listdir(repositories_root)):
+        repository_dir = os.path.join(repositories_root, repository)
+        if not os.path.isdir(repository_dir):
+            continue
+        for directory, _, file_names in sorted(os.walk(repository_dir)):
+            for file_name in sorted(file_names):
+                language = SOURCE_EXTENSIONS.get(os.path.splitext(file_name)[1])
+                if language is None:
+                    continue
+                path = os.path.join(directory, file_name)
+                with open(path, "r", errors="ignore") as f:
+                    files.append(RepositoryFile(repository, os.path.relpath(path, repository_dir), language, f.read()))
+    return files
+
+
+def compile_term(term: str) -> Pattern:
+    flags = 0 if any(character.isupper() for character in term) else re.IGNORECASE
+    try:
+        return re.compile(term, flags)
+    except re.error:
+        return re.compile(re.escape(term), flags)
+
+
+def parse_query(query: str) -> Tuple[List[Pattern], List[List[Pattern]]]:
+    """
+    Repository filters and alternatives of a query, each alternative being the terms that must all match.
+    """
+    repository_filters: List[Pattern] = []
+    alternatives: List[List[Pattern]] = [[]]
+    for token in query.split():
+        if token.startswith("r:"):
+            repository_filters.append(re.compile(re.escape(token[2:])))
+        elif token == "or":
+            alternatives.append([])
+        else:
+            alternatives[-1].append(compile_term(token))
+    return repository_filters, [terms for terms in alternatives if terms]
+
+
+def encode(text: str) -> str:
+    return base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+
+class FakeZoekt:
+    """
+    Search over the files loaded in memory, with an artificial latency of latency_ms +- jitter_ms per request.
+    """
+
+    def __init__(self, files: List[RepositoryFile], latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0) -> None:
+        self.files = files
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.num_requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        with self._lock:
+            self.num_requests += 1
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def line_matches(self, file: RepositoryFile, terms: List[Pattern], num_context_lines: int) -> List[Dict[str, Any]]:
+        matches = []
+        for number, line in enumerate(file.lines):
+            fragments = [{"LineOffset": match.start(), "Offset": 0, "MatchLength": match.end() - match.start()}
+                         for term in terms for match in term.finditer(line) if match.end() > match.start()]
+            if not fragments:
+                continue
+            matches.append({
+                "Line": encode(line),
+                "LineStart": 0,
+                "LineEnd": len(line),
+                "LineNumber": number + 1,
+                "Before": encode("\n".join(file.lines[max(0, number - num_context_lines):number])) if num_context_lines else None,
+                "After": encode("\n".join(file.lines[number + 1:number + 1 + num_context_lines])) if num_context_lines else None,
+                "FileName": False,
+                "Score": float(len(fragments)),
+                "LineFragments": fragments,
+            })
+        return matches
+
+    def search(self, query: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        repository_filters, alternatives = parse_query(query)
+        num_context_lines = int(options.get("NumContextLines") or 0)
+        max_results = int(options.get("MaxResults") or options.get("MaxDocDisplayCount") or 0)
+        files = []
+        files_considered = 0
+        for file in self.files:
+            if not all(repository_filter.search(file.repository) for repository_filter in repository_filters):
+                continue
+            files_considered += 1
+            terms: Optional[List[Pattern]] = next(
+                (terms for terms in alternatives if all(term.search(file.content) for term in terms)), None)
+            if terms is None:
+                continue
+            matches = self.line_matches(file, terms, num_context_lines)
+            files.append({
+                "FileName": file.name,
+                "Repository": file.repository,
+                "Branches": ["HEAD"],
+                "Language": file.language,
+                "Version": "",
+                "Checksum": "",
+                "Score": sum(match["Score"] for match in matches) + 10.0 * sum(term.pattern in file.name for term in terms),
+                "LineMatches": matches,
+            })
+        files.sort(key=lambda file: -file["Score"])
+        match_count = sum(len(file["LineMatches"]) for file in files)
+        file_count = len(files)
+        if max_results:
+            files = files[:max_results]
+        return {"Result": {
+            "Files": files or None,
+            "FileCount": file_count,
+            "MatchCount": match_count,
+            "Stats": {"FilesConsidered": files_considered, "FilesLoaded": files_considered, "MatchCount": match_count,
+                      "FileCount": file_count, "Duration": int((time.perf_counter() - started) * 1e9)},
+        }}
+
+
+class FakeZoektHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def send_json(self, status: int, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self) -> None:
+        if self.path != "/api/search":
+            self.send_json(404, {"Error": f"unknown path {self.path}"})
+            return
+        zoekt: FakeZoekt = self.server.zoekt
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+        deadline = time.perf_counter() + zoekt.delay()
+        result = zoekt.search(request.get("Q", ""), request.get("Opts") or {})
+        # the latency includes the search itself
+        remaining = deadline - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+        self.send_json(200, result)
+
+    def do_GET(self) -> None:
+        self.send_json(200, {"files": len(self.server.zoekt.files), "requests": self.server.zoekt.num_requests})
+
+
+def create_server(repositories_roots: List[str], host: str = "127.0.0.1", port: int = 0,
+                  latency_ms: float = 0.0, jitter_ms: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Server over the repositories of every root, on an ephemeral port by default (see server.server_address).
+    """
+    files = [file for repositories_root in repositories_roots for file in load_repositories(repositories_root)]
+    server = ThreadingHTTPServer((host, port), FakeZoektHandler)
+    server.daemon_threads = True
+    server.zoekt = FakeZoekt(files, latency_ms, jitter_ms)
+    return server
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Serve a fake Zoekt /api/search over local repositories.")
+    argparser.add_argument("--repositories-root", type=str, nargs="+", required=True, help="Folders of {owner}__{repository}-{revision} directories")
+    argparser.add_argument("--host", type=str, default="127.0.0.1")
+    argparser.add_argument("--port", type=int, default=6070)
+    argparser.add_argument("--latency-ms", type=float, default=0.0, help="Latency of every search")
+    argparser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform jitter added to the latency")
+    args = argparser.parse_args()
+    server = create_server(args.repositories_root, args.host, args.port, args.latency_ms, args.jitter_ms)
+    print(f"Serving {len(server.zoekt.files)} files on http://{args.host}:{server.server_address[1]}/api/search", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Load test of the resident context service (src/service.py).
+
+Replays the completion points of a stage against a running service from concurrent keep-alive clients
+and reports the throughput, the end-to-end latency percentiles seen by the clients and the p95 of each
+stage reported by the service. Exits with status 1 if the end-to-end p95 exceeds --target-p95-ms.
+
+    python src/service.py --port 8080 &
+    python benchmarks/load_test_service.py --url http://127.0.0.1:8080 --requests 500 --concurrency 4
+    python benchmarks/load_test_service.py --unix-socket /tmp/context.sock
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List
+from urllib.parse import urlparse
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str) -> None:
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile, q in [0, 100].
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def load_bodies(completion_points_file: str, limit: int) -> List[bytes]:
+    bodies = []
+    with open(completion_points_file, "rb") as f:
+        for line in f:
+            if line.strip():
+                bodies.append(line.strip())
+            if limit and len(bodies) >= limit:
+                break
+    return bodies
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Measure the latency of the context service under concurrent load.")
+    argparser.add_argument("--url", type=str, default=f"http://127.0.0.1:{os.getenv('SERVICE_PORT', 8080)}")
+    argparser.add_argument("--unix-socket", type=str, default=os.getenv("SERVICE_UNIX_SOCKET"), help="Connect to this Unix socket instead of --url")
+    argparser.add_argument("--completion-points", type=str,
+                           default=os.path.join(os.getenv("DATA_ROOT", "/data"), f"{os.getenv('LANGUAGE', 'python')}-{os.getenv('STAGE', 'practice')}.jsonl"))
+    argparser.add_argument("--limit", type=int, default=0, help="Number of distinct completion points to replay, 0 for all")
+    argparser.add_argument("--requests", type=int, default=500, help="Total number of requests")
+    argparser.add_argument("--concurrency", type=int, default=1, help="Number of concurrent clients")
+    argparser.add_argument("--warmup", type=int, default=20, help="Requests sent before measuring")
+    argparser.add_argument("--target-p95-ms", type=float, default=100.0)
+    args = argparser.parse_args()
+
+    bodies = load_bodies(args.completion_points, args.limit)
+    if not bodies:
+        sys.exit(f"No completion points in {args.completion_points}")
+    url = urlparse(args.url)
+
+    def connect() -> http.client.HTTPConnection:
+        if args.unix_socket:
+            return UnixHTTPConnection(args.unix_socket)
+        return http.client.HTTPConnection(url.hostname, url.port or 80)
+
+    def send(connection: http.client.HTTPConnection, body: bytes) -> dict:
+        connection.request("POST", "/complete", body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        payload = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}: {payload[:200]!r}")
+        return json.loads(payload)
+
+    warmup_connection = connect()
+    for index in range(args.warmup):
+        send(warmup_connection, bodies[index % len(bodies)])
+    warmup_connection.close()
+
+    latencies: List[float] = []
+    stage_timings: Dict[str, List[float]] = {}
+    errors: List[str] = []
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def client() -> None:
+        connection = connect()
+        try:
+            while True:
+                with lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    response = send(connection, bodies[index % len(bodies)])
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    connection.close()
+                    connection = connect()
+                    continue
+                latency = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(latency)
+                    if "error" in response:
+                        errors.append(response["error"])
+                    for stage, value in response.get("timings_ms", {}).items():
+                        stage_timings.setdefault(stage, []).append(value)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    p95 = percentile(latencies, 95)
+    print(f"{len(latencies)} requests in {elapsed:.2f}s from {args.concurrency} clients: {len(latencies) / elapsed:.1f} req/s, {len(errors)} errors")
+    print(f"end-to-end ms: p50 {percentile(latencies, 50):.1f}  p95 {p95:.1f}  p99 {percentile(latencies, 99):.1f}  max {max(latencies, default=float('nan')):.1f}")
+    for stage, values in stage_timings.items():
+        print(f"{stage:>17} ms: p50 {percentile(values, 50):.1f}  p95 {percentile(values, 95):.1f}")
+    for error in errors[:5]:
+        print(f"error: {error}")
+    if not p95 <= args.target_p95_ms:
+        print(f"p95 {p95:.1f} ms exceeds the target of {args.target_p95_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Synthetic repositories and completion points in the layout of the competition data:
+
+    {data_root}/{language}-{stage}.jsonl
+    {data_root}/repositories-{language}-{stage}/{owner}__{repository}-{revision}/...
+
+Each repository is a package of modules whose functions and classes call each other across files, so that
+the queries generated from a completion point find the files defining the symbols it uses. The completed
+file of a datapoint is a newer version of the file in the repository, with a function added right before the
+completion point, so that the preprocessor has a diff to extract.
+
+    python benchmarks/synthetic_repositories.py --data-root /tmp/synthetic --language kotlin --datapoints 200
+"""
+import argparse
+import json
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+SYLLABLES = ["ba", "co", "da", "fe", "gi", "ho", "ju", "ka", "lo", "mi", "nu", "pa", "qui", "ro", "si", "tu", "ve", "wo", "xa", "ze"]
+EXTENSIONS = {"python": ".py", "kotlin": ".kt"}
+
+
+def make_word(rng: random.Random, syllables: int = 3) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+@dataclass
+class Module:
+    name: str
+    functions: List[str]
+    classes: List[str]
+    # (class, method) pairs
+    methods: List[Tuple[str, str]] = field(default_factory=list)
+
+
+class CodeTemplate:
+    """
+    Renders the modules of a synthetic repository in a language.
+    """
+
+    def render_module(self, package: str, module: Module, others: List[Module], rng: random.Random) -> str:
+        raise NotImplementedError
+
+    def render_function(self, name: str, callees: List[str], rng: random.Random) -> str:
+        raise NotImplementedError
+
+
+class PythonTemplate(CodeTemplate):
+    def render_module(self, package: str, module: Module, others: List[Module], rng: random.Random) -> str:
+        imported = rng.sample(others, min(2, len(others)))
+        lines = [f"from {package}.{other.name} import {', '.join(other.functions[:2] + other.classes[:1])}" for other in imported]
+        callees = [name for other in imported for name in other.functions[:2]] or module.functions
+        lines.append("")
+        for class_name in module.classes:
+            attribute = make_word(rng, 2)
+            lines += ["", f"class {class_name}:",
+                      f"    def __init__(self, {attribute}):",
+                      f"        self.{attribute} = {attribute}", ""]
+            for owner, method in module.methods:
+                if owner == class_name:
+                    lines += [f"    def {method}(self, value):",
+                              f"        return {rng.choice(callees)}(self.{attribute}, value)", ""]
+        for function in module.functions:
+            lines += ["", self.render_function(function, callees, rng)]
+        return "\n".join(lines) + "\n"
+
+    def render_function(self, name: str, callees: List[str], rng: random.Random) -> str:
+        variable = make_word(rng, 2)
+        first, second = rng.choice(callees), rng.choice(callees)
+        return (f"def {name}(value, offset=0):\n"
+                f"    {variable} = {first}(value, offset)\n"
+                f"    if {variable} > {rng.randint(1, 100)}:\n"
+                f"        {variable} = {second}({variable}, value)\n"
+                f"    return {variable} + offset\n")
+
+
+class KotlinTemplate(CodeTemplate):
+    def render_module(self, package: str, module: Module, others: List[Module], rng: random.Random) -> str:
+        imported = rng.sample(others, min(2, len(others)))
+        lines = [f"package {package}", ""]
+        lines += [f"import {package}.{name}" for other in imported for name in other.functions[:2] + other.classes[:1]]
+        callees = [name for other in imported for name in other.functions[:2]] or module.functions
+        for class_name in module.classes:
+            attribute = make_word(rng, 2)
+            lines += ["", f"class {class_name}(private val {attribute}: Int) {{"]
+            for owner, method in module.methods:
+                if owner == class_name:
+                    lines += [f"    fun {method}(value: Int): Int {{",
+                              f"        return {rng.choice(callees)}(this.{attribute}, value)",
+                              "    }", ""]
+            lines.append("}")
+        for function in module.functions:
+            lines += ["", self.render_function(function, callees, rng)]
+        return "\n".join(lines) + "\n"
+
+    def render_function(self, name: str, callees: List[str], rng: random.Random) -> str:
+        variable = make_word(rng, 2)
+        first, second = rng.choice(callees), rng.choice(callees)
+        return (f"fun {name}(value: Int, offset: Int = 0): Int {{\n"
+                f"    var {variable} = {first}(value, offset)\n"
+                f"    if ({variable} > {rng.randint(1, 100)}) {{\n"
+                f"        {variable} = {second}({variable}, value)\n"
+                f"    }}\n"
+                f"    return {variable} + offset\n"
+                f"}}\n")
+
+
+TEMPLATES: Dict[str, CodeTemplate] = {"python": PythonTemplate(), "kotlin": KotlinTemplate()}
+
+
+def generate_modules(rng: random.Random, num_files: int, functions_per_file: int) -> List[Module]:
+    used = set()
+
+    def unique_word(syllables: int) -> str:
+        while True:
+            word = make_word(rng, syllables)
+            if word not in used:
+                used.add(word)
+                return word
+
+    modules = []
+    for _ in range(num_files):
+        functions = [unique_word(3) for _ in range(functions_per_file)]
+        classes = [unique_word(3).capitalize() for _ in range(max(1, functions_per_file // 4))]
+        methods = [(class_name, unique_word(3)) for class_name in classes for _ in range(2)]
+        modules.append(Module(unique_word(2), functions, classes, methods))
+    return modules
+
+
+def write_dataset(data_root: str,
+                  language: str,
+                  stage: str,
+                  num_repositories: int = 4,
+                  files_per_repository: int = 20,
+                  functions_per_file: int = 8,
+                  num_datapoints: int = 200,
+                  seed: int = 0) -> str:
+    """
+    Write the repositories and the completion points of a stage, returns the completion points file.
+    """
+    rng = random.Random(seed)
+    template = TEMPLATES[language]
+    extension = EXTENSIONS[language]
+    repositories_root = os.path.join(data_root, f"repositories-{language}-{stage}")
+    repositories = []
+    for index in range(num_repositories):
+        owner, name, revision = make_word(rng, 2), f"{make_word(rng, 2)}{index}", f"{rng.getrandbits(40):010x}"
+        package = name
+        modules = generate_modules(rng, files_per_repository, functions_per_file)
+        files = {}
+        for module in modules:
+            others = [other for other in modules if other is not module]
+            path = os.path.join("src", package, module.name + extension)
+            files[path] = (module, template.render_module(package, module, others, rng))
+        repository_dir = os.path.join(repositories_root, f"{owner}__{name}-{revision}")
+        for path, (_, content) in files.items():
+            os.makedirs(os.path.dirname(os.path.join(repository_dir, path)), exist_ok=True)
+            with open(os.path.join(repository_dir, path), "w") as f:
+                f.write(content)
+        repositories.append((f"{owner}/{name}", revision, modules, files))
+
+    completion_points_file = os.path.join(data_root, f"{language}-{stage}.jsonl")
+    with open(completion_points_file, "w") as f:
+        for index in range(num_datapoints):
+            repository, revision, modules, files = rng.choice(repositories)
+            path = rng.choice(sorted(files))
+            module, content = files[path]
+            lines = content.splitlines(keepends=True)
+            # complete the file at a top-level definition of its second half
+            definitions = [number for number, line in enumerate(lines) if line.startswith(("def ", "class ", "fun "))]
+            cut = rng.choice(definitions[len(definitions) // 2:])
+            # the completed file has a new function calling into other modules, right before the completion point
+            callees = [name for other in rng.sample(modules, min(3, len(modules))) for name in other.functions[:2]]
+            prefix = "".join(lines[:cut]) + template.render_function(make_word(rng, 4), callees, rng) + "\n"
+            suffix = "".join(lines[cut:])
+            modified = rng.sample(sorted(files), min(2, len(files)))
+            f.write(json.dumps({"id": f"{language}-{index}", "repo": repository, "revision": revision, "path": path,
+                                "modified": modified, "prefix": prefix, "suffix": suffix, "archive": ""}) + "\n")
+    return completion_points_file
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Generate synthetic repositories and completion points.")
+    argparser.add_argument("--data-root", type=str, required=True)
+    argparser.add_argument("--language", type=str, default="python", choices=sorted(TEMPLATES))
+    argparser.add_argument("--stage", type=str, default="synthetic")
+    argparser.add_argument("--repositories", type=int, default=4)
+    argparser.add_argument("--files-per-repository", type=int, default=20)
+    argparser.add_argument("--functions-per-file", type=int, default=8)
+    argparser.add_argument("--datapoints", type=int, default=200)
+    argparser.add_argument("--seed", type=int, default=0)
+    args = argparser.parse_args()
+    path = write_dataset(args.data_root, args.language, args.stage, args.repositories, args.files_per_repository,
+                         args.functions_per_file, args.datapoints, args.seed)
+    print(f"Wrote {args.datapoints} completion points to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datapoint import DataPoint, Prediction, QueryPoint
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Marker closing a queue between two stages
+_END_OF_STREAM = object()
+
+
+class AsyncPipeline:
+    """
+    Pipelined execution of the Runner stages.
+
+    Preprocessing and query generation run on the event loop thread, while the Zoekt searches are
+    handed to a thread pool, so the CPU stages of datapoint i+k overlap with the searches of datapoint i.
+    Stages are connected by bounded queues and results are emitted in input order.
+    """
+
+    def __init__(self, runner, search_concurrency: int = 8, queue_size: int = 16) -> None:
+        self.runner = runner
+        self.search_concurrency = max(1, search_concurrency)
+        self.queue_size = max(1, queue_size)
+        # Upper bound of datapoints between the producer and the ordered writer
+        self.max_in_flight = 2 * self.queue_size + self.search_concurrency
+
+    def run(self,
+            datapoints: Iterable[DataPoint],
+            on_result: Callable[[Prediction | dict, QueryPoint, str], None]) -> None:
+        """
+        Run the pipeline over the datapoints, calling on_result(prediction, query_point, datapoint_id) for each of them in input order.
+        """
+        asyncio.run(self._run(datapoints, on_result))
+
+    async def _run(self,
+                   datapoints: Iterable[DataPoint],
+                   on_result: Callable[[Prediction | dict, QueryPoint, str], None]) -> None:
+        search_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        postprocess_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        in_flight: asyncio.Semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        with ThreadPoolExecutor(max_workers=self.search_concurrency, thread_name_prefix="zoekt-search") as executor:
+            searchers = [
+                asyncio.create_task(self._search_stage(search_queue, postprocess_queue, executor))
+                for _ in range(self.search_concurrency)
+            ]
+            writer = asyncio.create_task(self._postprocess_stage(postprocess_queue, in_flight, on_result))
+
+            await self._produce_stage(datapoints, search_queue, in_flight)
+            for _ in searchers:
+                await search_queue.put(_END_OF_STREAM)
+            await asyncio.gather(*searchers)
+            await postprocess_queue.put(_END_OF_STREAM)
+            await writer
+
+    async def _produce_stage(self,
+                             datapoints: Iterable[DataPoint],
+                             search_queue: asyncio.Queue,
+                             in_flight: asyncio.Semaphore) -> None:
+        """
+        Preprocess datapoints and generate their queries.
+        """
+        for index, datapoint in enumerate(datapoints):
+            await in_flight.acquire()
+            logger.info(f"Processing datapoint {datapoint.id} ")
+            try:
+                with self.runner.profiler.profile(datapoint.id, "prepare"):
+                    processed_datapoint, query_point = self.runner.prepare_query_point(datapoint)
+            except Exception as e:
+                logger.error(f"Error processing datapoint {datapoint.id}: {e}")
+                processed_datapoint, query_point = datapoint, None
+            await search_queue.put((index, processed_datapoint, query_point))
+            # Give the search stage a chance to dispatch before the next CPU-bound step
+            await asyncio.sleep(0)
+
+    async def _search_stage(self,
+                            search_queue: asyncio.Queue,
+                            postprocess_queue: asyncio.Queue,
+                            executor: ThreadPoolExecutor) -> None:
+        """
+        Send the queries of each datapoint to Zoekt without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await search_queue.get()
+            if item is _END_OF_STREAM:
+                return
+            index, datapoint, query_point = item
+            search_results: Optional[Dict[str, Any]] = None
+            if query_point is not None:
+                try:
+                    search_results = await loop.run_in_executor(
+                        executor, self.runner.search_requester.zoekt_search_on_query_point, query_point)
+                except Exception as e:
+                    logger.error(f"Error processing datapoint {datapoint.id}: {e}")
+            await postprocess_queue.put((index, datapoint, query_point, search_results))
+
+    async def _postprocess_stage(self,
+                                 postprocess_queue: asyncio.Queue,
+                                 in_flight: asyncio.Semaphore,
+                                 on_result: Callable[[Prediction | dict, QueryPoint, str], None]) -> None:
+        """
+        Post-process search results and emit them in input order.
+        """
+        pending: Dict[int, Tuple[str, Tuple[QueryPoint, Prediction | dict]]] = {}
+        next_index = 0
+        while True:
+            item = await postprocess_queue.get()
+            if item is _END_OF_STREAM:
+                break
+            index, datapoint, query_point, search_results = item
+            pending[index] = (datapoint.id, self._postprocess(datapoint, query_point, search_results))
+            while next_index in pending:
+                datapoint_id, (query_point, prediction) = pending.pop(next_index)
+                on_result(prediction, query_point, datapoint_id)
+                in_flight.release()
+                next_index += 1
+        if pending:
+            logger.error(f"{len(pending)} datapoints left unwritten by the pipeline.")
+
+    def _postprocess(self,
+                     datapoint: DataPoint,
+                     query_point: Optional[QueryPoint],
+                     search_results: Optional[Dict[str, Any]]) -> Tuple[QueryPoint, Prediction | dict]:
+        if query_point is None or search_results is None:
+            return self.runner.fallback_result(datapoint)
+        try:
+            with self.runner.profiler.profile(datapoint.id, "postprocess"):
+                return query_point, self.runner.postprocess(datapoint, search_results)
+        except Exception as e:
+            logger.error(f"Error processing datapoint {datapoint.id}: {e}")
+            return self.runner.fallback_result(datapoint)
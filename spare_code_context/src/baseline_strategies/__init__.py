@@ -0,0 +1 @@
+from .engine import BaselineEngine, STRATEGIES, register_strategy
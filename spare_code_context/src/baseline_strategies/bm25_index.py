@@ -0,0 +1,259 @@
+"""
+On-disk BM25 index of a repository revision, used by the `bm25` baseline.
+
+The index of a `{owner}__{repository}-{revision}` directory holds the term frequencies of its files as a
+term-major sparse matrix (the postings of each term: document ids and term frequencies, in CSC layout),
+the IDF of each term and the length of each document. Scores are the ones of `rank_bm25.BM25Okapi`, but a
+query only touches the postings of its own terms instead of the whole corpus.
+
+Indexes are saved as `{index_dir}/{owner}__{repository}-{revision}.npz`. A revision never changes, so an
+index is only rebuilt when it was built with other parameters (extension, minimum number of lines). Nothing is
+saved for a missing revision, whose build fails.
+
+    python -m baseline_strategies.bm25_index --repositories-root /data/repositories-python-practice --extension .py
+"""
+import os
+import re
+import argparse
+from collections import Counter, OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from repository_access import DirectorySource, RepositorySource
+from .repo_catalog import count_lines, split_root_dir
+
+INDEX_VERSION = 1
+# separator of the terms and file names stored in an index, neither can contain it
+SEPARATOR = "\0"
+
+# same tokens as "".join(c if c.isalnum() else " " for c in s.lower()).split()
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+def prepare_bm25_str(s: str) -> list[str]:
+    return TOKEN_PATTERN.findall(s.lower())
+
+
+def list_source_files(root_dir: str, extension: str, min_lines: int, source: Optional[RepositorySource] = None) -> list[tuple[str, str]]:
+    """
+    Files with the given extension and at least min_lines lines, in the order source lists them, read from
+    the extracted directory by default. Raises FileNotFoundError if the revision is missing.
+
+    :return: (path relative to root_dir, content) of each file.
+    """
+    source = source or DirectorySource()
+    repositories_root, repository = split_root_dir(root_dir)
+    files = []
+    for file in source.list_files(repositories_root, repository):
+        if file.path.endswith(extension):
+            try:
+                content = source.read(repositories_root, repository, file.path)[0]
+            except Exception:
+                continue
+            if count_lines(content) >= min_lines:
+                files.append((file.path, content))
+    return files
+
+
+def encode_strings(strings: list[str]) -> np.ndarray:
+    return np.frombuffer(SEPARATOR.join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def decode_strings(array: np.ndarray) -> list[str]:
+    return array.tobytes().decode("utf-8").split(SEPARATOR) if array.size else []
+
+
+class BM25Index:
+    """
+    BM25 Okapi index of the files of a repository revision.
+    """
+
+    def __init__(self, file_names: list[str], terms: list[str], term_offsets: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_len: np.ndarray, idf: np.ndarray,
+                 k1: float = 1.5, b: float = 0.75) -> None:
+        self.file_names = file_names
+        self.terms = terms
+        self.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        # postings of term t: doc_ids/term_freqs[term_offsets[t]:term_offsets[t + 1]]
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_len = doc_len
+        self.idf = idf
+        self.k1 = k1
+        self.b = b
+        avgdl = doc_len.mean() if doc_len.size else 0.0
+        # k1 * (1 - b + b * |d| / avgdl), the only per-document part of the score
+        self.doc_norm = k1 * (1 - b + b * doc_len / avgdl) if avgdl else np.full(doc_len.shape, k1 * (1 - b))
+
+    @classmethod
+    def build(cls, documents: list[list[str]], file_names: list[str],
+              k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25) -> "BM25Index":
+        """
+        Index tokenized documents, with the IDF of rank_bm25.BM25Okapi.
+
+        :param documents: Tokens of each document.
+        :param file_names: Name of each document.
+        :param epsilon: Floor of the IDF, as a fraction of the average IDF.
+        """
+        frequencies = [Counter(document) for document in documents]
+        terms = sorted({term for document in frequencies for term in document})
+        term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        postings_per_term = np.zeros(len(terms) + 1, dtype=np.int64)
+        for document in frequencies:
+            for term in document:
+                postings_per_term[term_ids[term] + 1] += 1
+        term_offsets = np.cumsum(postings_per_term)
+        doc_ids = np.empty(term_offsets[-1], dtype=np.int32)
+        term_freqs = np.empty(term_offsets[-1], dtype=np.int32)
+        # documents are visited in order, so the postings of each term are sorted by document
+        positions = term_offsets[:-1].copy()
+        for doc_id, document in enumerate(frequencies):
+            for term, frequency in document.items():
+                term_id = term_ids[term]
+                doc_ids[positions[term_id]] = doc_id
+                term_freqs[positions[term_id]] = frequency
+                positions[term_id] += 1
+
+        num_docs = len(documents)
+        doc_freqs = np.diff(term_offsets)
+        idf = np.log(num_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        if idf.size:
+            # terms in more than half of the documents have a negative IDF
+            idf[idf < 0] = epsilon * idf.mean()
+        doc_len = np.array([len(document) for document in documents], dtype=np.float64)
+        return cls(file_names, terms, term_offsets, doc_ids, term_freqs, doc_len, idf, k1, b)
+
+    def get_scores(self, query: list[str]) -> np.ndarray:
+        """
+        BM25 score of every document, like BM25Okapi.get_scores.
+
+        :param query: Query tokens, repeated tokens count as many times as they appear.
+        """
+        query_terms = Counter(query)
+        term_ids = [self.term_ids[term] for term in query_terms if term in self.term_ids]
+        if not term_ids:
+            return np.zeros(len(self.file_names))
+        starts, ends = self.term_offsets[term_ids], self.term_offsets[np.array(term_ids) + 1]
+        postings = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        counts = np.array([query_terms[self.terms[term_id]] for term_id in term_ids], dtype=np.float64)
+        weights = np.repeat(self.idf[term_ids] * counts, ends - starts)
+        doc_ids = self.doc_ids[postings]
+        term_freqs = self.term_freqs[postings]
+        contributions = weights * term_freqs * (self.k1 + 1) / (term_freqs + self.doc_norm[doc_ids])
+        return np.bincount(doc_ids, weights=contributions, minlength=len(self.file_names))
+
+    def best_file(self, query: list[str]):
+        """
+        :return: Name of the document with the highest score, the first one on ties, or None for an empty index.
+        """
+        if not self.file_names:
+            return None
+        return self.file_names[int(self.get_scores(query).argmax())]
+
+    def save(self, path: str, **parameters) -> None:
+        """
+        Write the index to an .npz file, with the parameters it was built with.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # workers building the same repository write their own temporary file, the last replace wins
+        temporary_file = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temporary_file,
+                 version=INDEX_VERSION,
+                 parameters=encode_strings([f"{key}={value}" for key, value in sorted(parameters.items())]),
+                 file_names=encode_strings(self.file_names),
+                 terms=encode_strings(self.terms),
+                 term_offsets=self.term_offsets,
+                 doc_ids=self.doc_ids,
+                 term_freqs=self.term_freqs,
+                 doc_len=self.doc_len,
+                 idf=self.idf,
+                 bm25=np.array([self.k1, self.b]))
+        os.replace(temporary_file, path)
+
+    @classmethod
+    def load(cls, path: str, **parameters):
+        """
+        :return: The index saved at path, or None if it is missing or was built differently.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            if int(arrays["version"]) != INDEX_VERSION:
+                return None
+            if decode_strings(arrays["parameters"]) != [f"{key}={value}" for key, value in sorted(parameters.items())]:
+                return None
+            k1, b = arrays["bm25"]
+            return cls(decode_strings(arrays["file_names"]), decode_strings(arrays["terms"]), arrays["term_offsets"],
+                       arrays["doc_ids"], arrays["term_freqs"], arrays["doc_len"], arrays["idf"], float(k1), float(b))
+
+
+class BM25IndexCache:
+    """
+    Indexes of the repositories, loaded from index_dir or built on first use, the most recently used ones
+    kept in memory.
+    """
+
+    def __init__(self, index_dir: str, extension: str, min_lines: int, max_repositories: int = 16,
+                 source: Optional[RepositorySource] = None) -> None:
+        self.index_dir = index_dir
+        self.source = source
+        self.extension = extension
+        self.min_lines = min_lines
+        self.max_repositories = max_repositories
+        self.indexes: OrderedDict[str, BM25Index] = OrderedDict()
+        self.num_built = 0
+        self.num_loaded = 0
+
+    def index_path(self, root_dir: str) -> str:
+        return os.path.join(self.index_dir, os.path.basename(os.path.normpath(root_dir)) + ".npz")
+
+    def build(self, root_dir: str) -> BM25Index:
+        files = list_source_files(root_dir, self.extension, self.min_lines, self.source)
+        index = BM25Index.build([prepare_bm25_str(content) for _, content in files], [name for name, _ in files])
+        index.save(self.index_path(root_dir), extension=self.extension, min_lines=self.min_lines)
+        self.num_built += 1
+        return index
+
+    def get(self, root_dir: str) -> BM25Index:
+        index = self.indexes.get(root_dir)
+        if index is not None:
+            self.indexes.move_to_end(root_dir)
+            return index
+        index = BM25Index.load(self.index_path(root_dir), extension=self.extension, min_lines=self.min_lines)
+        if index is None:
+            index = self.build(root_dir)
+        else:
+            self.num_loaded += 1
+        self.indexes[root_dir] = index
+        if len(self.indexes) > self.max_repositories:
+            self.indexes.popitem(last=False)
+        return index
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Build the BM25 indexes of every repository revision of a folder.")
+    argparser.add_argument("--repositories-root", type=str, required=True, help="Folder of {owner}__{repository}-{revision} directories")
+    argparser.add_argument("--extension", type=str, required=True, help="Extension of the indexed files, e.g. .py")
+    argparser.add_argument("--index-dir", type=str, default=None, help="Defaults to {repositories-root}-bm25")
+    argparser.add_argument("--min-lines", type=int, default=10, help="Minimum number of lines of an indexed file")
+    argparser.add_argument("--rebuild", action="store_true", help="Rebuild the indexes that already exist")
+    args = argparser.parse_args()
+
+    index_dir = args.index_dir or os.path.normpath(args.repositories_root) + "-bm25"
+    cache = BM25IndexCache(index_dir, args.extension, args.min_lines, max_repositories=0)
+    for repository in sorted(os.listdir(args.repositories_root)):
+        root_dir = os.path.join(args.repositories_root, repository)
+        if not os.path.isdir(root_dir):
+            continue
+        if args.rebuild:
+            index = cache.build(root_dir)
+        else:
+            index = cache.get(root_dir)
+        print(f"{repository}: {len(index.file_names)} files, {len(index.terms)} terms")
+    print(f"Built {cache.num_built} indexes in {index_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import os
+import random
+import multiprocessing
+from collections import deque
+from itertools import islice
+from logging import getLogger
+from multiprocessing.pool import AsyncResult
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from configs.constants import PYTHON, KOTLIN, FILE_SEP
+from datapoint import DataPoint
+from file_cache import get_file_content_cache
+from repository_access import DIRECTORY
+from .bm25_index import BM25IndexCache, prepare_bm25_str
+from .repo_catalog import RepositoryCatalogCache
+
+logger = getLogger(__name__)
+
+EXTENSIONS = {PYTHON: ".py", KOTLIN: ".kt"}
+# format to compose context from a file
+FILE_COMPOSE_FORMAT = "{file_sep}{file_name}\n{file_content}"
+MIN_LINES = 10  # Minimum number of lines required in the file
+MAX_LINES = 10  # Maximum number of lines for prefix/suffix to be trimmed into
+
+# strategy name -> function of (engine, repository directory, datapoint) returning the selected file or None
+Strategy = Callable[["BaselineEngine", str, DataPoint | Dict], Optional[str]]
+STRATEGIES: Dict[str, Strategy] = {}
+
+_worker_engine: Optional["BaselineEngine"] = None
+
+
+def register_strategy(name: str) -> Callable[[Strategy], Strategy]:
+    """
+    Register a context collection strategy under a name, usable by BaselineEngine and FALLBACK_STRATEGY.
+    """
+    def register(strategy: Strategy) -> Strategy:
+        STRATEGIES[name] = strategy
+        return strategy
+    return register
+
+
+def get_field(datapoint: DataPoint | Dict, name: str) -> Any:
+    return datapoint[name] if isinstance(datapoint, dict) else getattr(datapoint, name)
+
+
+def trim_prefix(prefix: str, max_lines: int = MAX_LINES) -> str:
+    prefix_lines = prefix.split("\n")
+    if len(prefix_lines) > max_lines:
+        prefix = "\n".join(prefix_lines[-max_lines:])
+    return prefix
+
+
+def trim_suffix(suffix: str, max_lines: int = MAX_LINES) -> str:
+    suffix_lines = suffix.split("\n")
+    if len(suffix_lines) > max_lines:
+        suffix = "\n".join(suffix_lines[:max_lines])
+    return suffix
+
+
+class BaselineEngine:
+    """
+    Context collection baselines of the competition starter kit, each picking a single file of the repository
+    revision of a datapoint. BM25 indexes and file catalogs are persisted next to the repositories
+    (`repositories-{language}-{stage}-bm25` and `-catalog`) and the most recently used ones are kept in memory,
+    so that the datapoints of a repository share them.
+
+    Random choices are unseeded, unless seed is set: each datapoint then gets a generator seeded with seed and
+    its id, which makes the choices independent of the order and the process datapoints are run in.
+
+    Files are read through the file content cache of the process (file_cache.py), from extracted directories
+    or zip archives depending on repository_source.
+    """
+
+    def __init__(self,
+                 language: str,
+                 repositories_root: str,
+                 bm25_index_dir: Optional[str] = None,
+                 catalog_dir: Optional[str] = None,
+                 min_lines: int = MIN_LINES,
+                 file_separator: str = FILE_SEP,
+                 seed: Optional[int] = None,
+                 max_repositories: int = 16,
+                 repository_source: str = DIRECTORY,
+                 file_cache_max_bytes: int = 256 * 1024 * 1024,
+                 max_open_archives: int = 32) -> None:
+        if language not in EXTENSIONS:
+            raise ValueError(f"Unsupported language: {language}")
+        # arguments rebuilding this engine in pool workers
+        self.arguments: Dict[str, Any] = dict(language=language, repositories_root=repositories_root,
+                                              bm25_index_dir=bm25_index_dir, catalog_dir=catalog_dir,
+                                              min_lines=min_lines, file_separator=file_separator, seed=seed,
+                                              max_repositories=max_repositories, repository_source=repository_source,
+                                              file_cache_max_bytes=file_cache_max_bytes, max_open_archives=max_open_archives)
+        self.language = language
+        self.extension = EXTENSIONS[language]
+        self.repositories_root = repositories_root
+        self.min_lines = min_lines
+        self.file_separator = file_separator
+        self.seed = seed
+        self.random = random.Random()
+        self.file_cache = get_file_content_cache(file_cache_max_bytes, repository_source=repository_source,
+                                                 max_open_archives=max_open_archives)
+        repositories_dir = os.path.normpath(repositories_root)
+        self.bm25_indexes = BM25IndexCache(bm25_index_dir or repositories_dir + "-bm25", self.extension, min_lines,
+                                           max_repositories, self.file_cache.source)
+        self.repository_catalogs = RepositoryCatalogCache(catalog_dir or repositories_dir + "-catalog", max_repositories,
+                                                          self.file_cache.source)
+
+    @staticmethod
+    def repository_revision(datapoint: DataPoint | Dict) -> str:
+        repo_path = get_field(datapoint, "repo").replace("/", "__")
+        return f"{repo_path}-{get_field(datapoint, 'revision')}"
+
+    def repository_dir(self, datapoint: DataPoint | Dict) -> str:
+        return os.path.join(self.repositories_root, self.repository_revision(datapoint))
+
+    def random_generator(self, datapoint: DataPoint | Dict) -> random.Random:
+        if self.seed is None:
+            return self.random
+        return random.Random(f"{self.seed}:{get_field(datapoint, 'id')}")
+
+    def find_random_file(self, root_dir: str, rng: random.Random) -> Optional[str]:
+        """
+        Select a random file of the language with at least min_lines lines, from the catalog of the repository.
+        """
+        code_files = self.repository_catalogs.get(root_dir).files(self.extension, self.min_lines)
+        return os.path.join(root_dir, rng.choice(code_files)) if code_files else None
+
+    def find_bm25_file(self, root_dir: str, prefix: str, suffix: str) -> Optional[str]:
+        """
+        Select the file of the language with at least min_lines lines that has the highest BM25 score with the
+        completion file.
+        """
+        query = prepare_bm25_str(prefix + " " + suffix)
+        file_name = self.bm25_indexes.get(root_dir).best_file(query)
+        return os.path.join(root_dir, file_name) if file_name is not None else None
+
+    def find_random_recent_file(self, root_dir: str, recent_filenames: List[str], rng: random.Random) -> Optional[str]:
+        """
+        Select a random file of the language with at least min_lines lines among the recently modified ones.
+        """
+        catalog = self.repository_catalogs.get(root_dir)
+        code_files = []
+        for filename in recent_filenames:
+            if filename.endswith(self.extension):
+                entry = catalog.get(filename)
+                if entry is not None and entry.num_lines >= self.min_lines:
+                    code_files.append(os.path.join(root_dir, filename))
+        return rng.choice(code_files) if code_files else None
+
+    def select_file(self, datapoint: DataPoint | Dict, strategy: str) -> Optional[str]:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy: {strategy}")
+        return STRATEGIES[strategy](self, self.repository_dir(datapoint), datapoint)
+
+    def read_selected_file(self, datapoint: DataPoint | Dict, strategy: str) -> Optional[Tuple[str, str]]:
+        """
+        Name relative to the repository and content of the file selected by a strategy, None if it found none.
+        """
+        repository = self.repository_revision(datapoint)
+        try:
+            file_name = self.select_file(datapoint, strategy)
+        except FileNotFoundError as e:
+            logger.warning(f"The {strategy} strategy found no repository for datapoint {get_field(datapoint, 'id')}: {e}")
+            return None
+        if file_name is None:
+            logger.warning(f"The {strategy} strategy found no file for datapoint {get_field(datapoint, 'id')}")
+            return None
+        clean_file_name = file_name[len(self.repository_dir(datapoint)) + 1:]
+        archive = datapoint.get("archive") if isinstance(datapoint, dict) else getattr(datapoint, "archive", None)
+        return clean_file_name, self.file_cache.read(self.repositories_root, repository, clean_file_name, archive)
+
+    def collect_context(self, datapoint: DataPoint | Dict, strategy: str) -> str:
+        """
+        Context composed from the file selected by a strategy, empty if it found none.
+        """
+        selected = self.read_selected_file(datapoint, strategy)
+        if selected is None:
+            return ""
+        file_name, file_content = selected
+        return FILE_COMPOSE_FORMAT.format(file_sep=self.file_separator, file_name=file_name, file_content=file_content)
+
+    def predict(self,
+                datapoint: DataPoint | Dict,
+                strategy: str,
+                trim_prefix_lines: bool = False,
+                trim_suffix_lines: bool = False) -> Dict[str, str]:
+        """
+        Submission of a datapoint: the context and, when trimmed, its prefix and suffix.
+        """
+        submission = {"context": self.collect_context(datapoint, strategy)}
+        if trim_prefix_lines:
+            submission["prefix"] = trim_prefix(get_field(datapoint, "prefix"))
+        if trim_suffix_lines:
+            submission["suffix"] = trim_suffix(get_field(datapoint, "suffix"))
+        return submission
+
+    def predict_all(self,
+                    datapoints: Iterable[DataPoint | Dict],
+                    strategy: str,
+                    trim_prefix_lines: bool = False,
+                    trim_suffix_lines: bool = False,
+                    num_workers: int = 1,
+                    chunk_size: int = 16) -> Iterator[Dict[str, str]]:
+        """
+        Submissions of the datapoints, in input order.
+
+        With several workers, chunks of consecutive datapoints are run on a pool of processes, each holding its
+        own engine so that the indexes and catalogs it loaded are reused by the following chunks. At most
+        2 * num_workers chunks are in flight, so neither the datapoints read ahead nor the submissions waiting
+        to be yielded grow with the dataset.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy: {strategy}")
+        if num_workers <= 1:
+            for datapoint in datapoints:
+                yield self.predict(datapoint, strategy, trim_prefix_lines, trim_suffix_lines)
+            return
+
+        options = (strategy, trim_prefix_lines, trim_suffix_lines)
+        with multiprocessing.Pool(processes=num_workers, initializer=_init_worker, initargs=(self.arguments,)) as pool:
+            pending: Deque[AsyncResult] = deque()
+            iterator = iter(datapoints)
+            while chunk := list(islice(iterator, max(1, chunk_size))):
+                pending.append(pool.apply_async(_predict_chunk_in_worker, (chunk, options)))
+                if len(pending) >= 2 * num_workers:
+                    yield from pending.popleft().get()
+            while pending:
+                yield from pending.popleft().get()
+
+
+@register_strategy("random")
+def random_strategy(engine: BaselineEngine, root_dir: str, datapoint: DataPoint | Dict) -> Optional[str]:
+    return engine.find_random_file(root_dir, engine.random_generator(datapoint))
+
+
+@register_strategy("bm25")
+def bm25_strategy(engine: BaselineEngine, root_dir: str, datapoint: DataPoint | Dict) -> Optional[str]:
+    return engine.find_bm25_file(root_dir, get_field(datapoint, "prefix"), get_field(datapoint, "suffix"))
+
+
+@register_strategy("recent")
+def recent_strategy(engine: BaselineEngine, root_dir: str, datapoint: DataPoint | Dict) -> Optional[str]:
+    rng = engine.random_generator(datapoint)
+    file_name = engine.find_random_recent_file(root_dir, get_field(datapoint, "modified"), rng)
+    # If no recent files match our filtering criteria, select a random file instead
+    if file_name is None:
+        file_name = engine.find_random_file(root_dir, rng)
+    return file_name
+
+
+def _init_worker(arguments: Dict[str, Any]) -> None:
+    global _worker_engine
+    _worker_engine = BaselineEngine(**arguments)
+
+
+def _predict_chunk_in_worker(datapoints: List[DataPoint | Dict], options: Tuple[str, bool, bool]) -> List[Dict[str, str]]:
+    return [_worker_engine.predict(datapoint, *options) for datapoint in datapoints]
@@ -0,0 +1,170 @@
+"""
+Catalog of the files of a repository revision, used by the `random` and `recent` baselines.
+
+The catalog of a `{owner}__{repository}-{revision}` revision records the path, extension, size in bytes,
+number of lines and modification time of each of its files, in the order its repository source lists them
+(os.walk order for extracted directories, see repository_access.py). It is built with a single scan of the
+revision and saved as `{catalog_dir}/{owner}__{repository}-{revision}.json`, after which the baselines filter
+files by extension and length without touching the repository. A revision never changes, so a saved catalog
+is only rebuilt when its format changed. Nothing is saved for a missing revision, whose build fails.
+
+    python -m baseline_strategies.repo_catalog --repositories-root /data/repositories-python-practice
+"""
+import os
+import json
+import argparse
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from repository_access import DirectorySource, RepositorySource
+
+CATALOG_VERSION = 1
+
+
+class CatalogEntry(NamedTuple):
+    path: str  # relative to the repository directory
+    extension: str
+    size: int  # bytes
+    num_lines: int  # lines read by readlines(), -1 if the file is not UTF-8 text
+    mtime: float
+
+
+def count_lines(text: str) -> int:
+    """
+    Number of lines readlines() returns for a text decoded with universal newlines.
+    """
+    return text.count("\n") + (1 if text and not text.endswith("\n") else 0)
+
+
+def split_root_dir(root_dir: str) -> tuple[str, str]:
+    """
+    :return: The repositories root and the {owner}__{repository}-{revision} name of a repository directory.
+    """
+    return os.path.split(os.path.normpath(root_dir))
+
+
+class RepositoryCatalog:
+    """
+    Files of a repository revision.
+    """
+
+    def __init__(self, entries: list[CatalogEntry]) -> None:
+        self.entries = entries
+        self.by_path = {entry.path: entry for entry in entries}
+        # (extension, min_lines) -> paths, the baselines of a run all ask for the same filter
+        self._filtered: dict[tuple[str, int], list[str]] = {}
+
+    @classmethod
+    def build(cls, root_dir: str, source: Optional[RepositorySource] = None) -> "RepositoryCatalog":
+        """
+        Catalog the files of a repository revision read from source, its extracted directory by default.
+        Raises FileNotFoundError if the revision is missing.
+        """
+        source = source or DirectorySource()
+        repositories_root, repository = split_root_dir(root_dir)
+        entries = []
+        for file in source.list_files(repositories_root, repository):
+            try:
+                num_lines = count_lines(source.read(repositories_root, repository, file.path)[0])
+            except Exception:
+                num_lines = -1
+            entries.append(CatalogEntry(file.path, os.path.splitext(file.path)[1], file.size, num_lines, file.mtime))
+        return cls(entries)
+
+    def files(self, extension: str, min_lines: int = 0) -> list[str]:
+        """
+        :return: Paths of the files ending with extension and having at least min_lines lines, in os.walk order.
+        """
+        key = (extension, min_lines)
+        if key not in self._filtered:
+            self._filtered[key] = [entry.path for entry in self.entries
+                                   if entry.path.endswith(extension) and entry.num_lines >= max(min_lines, 0)]
+        return self._filtered[key]
+
+    def get(self, path: str):
+        """
+        :return: The entry of a path relative to the repository directory, or None if there is no such file.
+        """
+        return self.by_path.get(os.path.normpath(path))
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # one temporary file per process, pool workers may catalog the same repository at once
+        temporary_file = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump({"version": CATALOG_VERSION, "files": [list(entry) for entry in self.entries]}, f)
+        os.replace(temporary_file, path)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        :return: The catalog saved at path, or None if it is missing or has another format.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            catalog = json.load(f)
+        if catalog.get("version") != CATALOG_VERSION:
+            return None
+        return cls([CatalogEntry(*entry) for entry in catalog["files"]])
+
+
+class RepositoryCatalogCache:
+    """
+    Catalogs of the repositories, loaded from catalog_dir or built on first use, the most recently used ones
+    kept in memory.
+    """
+
+    def __init__(self, catalog_dir: str, max_repositories: int = 64, source: Optional[RepositorySource] = None) -> None:
+        self.catalog_dir = catalog_dir
+        self.source = source
+        self.max_repositories = max_repositories
+        self.catalogs: OrderedDict[str, RepositoryCatalog] = OrderedDict()
+        self.num_built = 0
+        self.num_loaded = 0
+
+    def catalog_path(self, root_dir: str) -> str:
+        return os.path.join(self.catalog_dir, os.path.basename(os.path.normpath(root_dir)) + ".json")
+
+    def build(self, root_dir: str) -> RepositoryCatalog:
+        catalog = RepositoryCatalog.build(root_dir, self.source)
+        catalog.save(self.catalog_path(root_dir))
+        self.num_built += 1
+        return catalog
+
+    def get(self, root_dir: str) -> RepositoryCatalog:
+        catalog = self.catalogs.get(root_dir)
+        if catalog is not None:
+            self.catalogs.move_to_end(root_dir)
+            return catalog
+        catalog = RepositoryCatalog.load(self.catalog_path(root_dir))
+        if catalog is None:
+            catalog = self.build(root_dir)
+        else:
+            self.num_loaded += 1
+        self.catalogs[root_dir] = catalog
+        if len(self.catalogs) > self.max_repositories:
+            self.catalogs.popitem(last=False)
+        return catalog
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Build the file catalogs of every repository revision of a folder.")
+    argparser.add_argument("--repositories-root", type=str, required=True, help="Folder of {owner}__{repository}-{revision} directories")
+    argparser.add_argument("--catalog-dir", type=str, default=None, help="Defaults to {repositories-root}-catalog")
+    argparser.add_argument("--rebuild", action="store_true", help="Rebuild the catalogs that already exist")
+    args = argparser.parse_args()
+
+    catalog_dir = args.catalog_dir or os.path.normpath(args.repositories_root) + "-catalog"
+    cache = RepositoryCatalogCache(catalog_dir, max_repositories=0)
+    for repository in sorted(os.listdir(args.repositories_root)):
+        root_dir = os.path.join(args.repositories_root, repository)
+        if not os.path.isdir(root_dir):
+            continue
+        catalog = cache.build(root_dir) if args.rebuild else cache.get(root_dir)
+        print(f"{repository}: {len(catalog.entries)} files")
+    print(f"Built {cache.num_built} catalogs in {catalog_dir}")
+
+
+if __name__ == "__main__":
+    main()
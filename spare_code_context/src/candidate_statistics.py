@@ -0,0 +1,134 @@
+import fcntl
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+FIXED = "fixed"
+ADAPTIVE = "adaptive"
+
+
+class CandidateStatistics:
+    """
+    Hit rate and latency of each query candidate type (`functions_classes_naive`, `navigation_regex`, ...).
+
+    Candidates are searched until one returns files, so with independent hit rates p the expected number
+    of round-trips is smallest when they are tried by decreasing p. `order` sorts the candidates of a query
+    point that way, from the hit rates smoothed with one hit in two requests so that rarely tried types are
+    not written off after a few misses. Types whose hit rate stays below `min_hit_rate` after `min_samples`
+    requests are skipped, keeping at least one candidate per query point.
+
+    Statistics are persisted per language in a JSON file shared by successive runs. Runs may save
+    concurrently (e.g. the shards of a dataset), so each adds only what it recorded since its last save
+    to the counts on disk, under a lock.
+    """
+
+    def __init__(self, language: str, path: Optional[str] = None, min_samples: int = 20, min_hit_rate: float = 0.0) -> None:
+        self.language = language
+        self.path = path
+        self.min_samples = min_samples
+        self.min_hit_rate = min_hit_rate
+        # candidate type -> {"requests", "hits", "latency"}, latency being the total in seconds
+        self.types: Dict[str, Dict[str, float]] = {}
+        # recorded since the last drain, sent by worker processes to their parent
+        self._delta: Dict[str, Dict[str, float]] = {}
+        # recorded or merged since the last save, added to the counts on disk by the next one
+        self._unsaved: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self) -> None:
+        with open(self.path, "r") as f:
+            self.types = json.load(f).get(self.language, {})
+        logger.info(f"Loaded the statistics of {len(self.types)} candidate types from {self.path}")
+
+    def save(self) -> None:
+        """
+        Add the statistics recorded since the last save to those of this language in the JSON file,
+        keeping those of the other languages.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+        if not unsaved:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            statistics = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    statistics = json.load(f)
+            types = statistics.setdefault(self.language, {})
+            for candidate_type, values in unsaved.items():
+                self._add(types, candidate_type, values["requests"], values["hits"], values["latency"])
+            statistics[self.language] = dict(sorted(types.items()))
+            temporary_file = self.path + ".tmp"
+            with open(temporary_file, "w") as f:
+                json.dump(statistics, f, indent=2)
+            os.replace(temporary_file, self.path)
+
+    @staticmethod
+    def _add(types: Dict[str, Dict[str, float]], candidate_type: str, requests: int, hits: int, latency: float) -> None:
+        values = types.setdefault(candidate_type, {"requests": 0, "hits": 0, "latency": 0.0})
+        values["requests"] += requests
+        values["hits"] += hits
+        values["latency"] += latency
+
+    def record(self, candidate_type: str, hit: bool, latency: float) -> None:
+        with self._lock:
+            self._add(self.types, candidate_type, 1, int(hit), latency)
+            self._add(self._delta, candidate_type, 1, int(hit), latency)
+            self._add(self._unsaved, candidate_type, 1, int(hit), latency)
+
+    def drain(self) -> Dict[str, Dict[str, float]]:
+        """
+        Statistics recorded since the previous drain.
+        """
+        with self._lock:
+            delta, self._delta = self._delta, {}
+        return delta
+
+    def merge(self, delta: Dict[str, Dict[str, float]]) -> None:
+        with self._lock:
+            for candidate_type, values in delta.items():
+                self._add(self.types, candidate_type, values["requests"], values["hits"], values["latency"])
+                self._add(self._unsaved, candidate_type, values["requests"], values["hits"], values["latency"])
+
+    def hit_rate(self, candidate_type: str) -> float:
+        values = self.types.get(candidate_type)
+        if values is None:
+            return 0.5
+        return (values["hits"] + 1) / (values["requests"] + 2)
+
+    def is_skipped(self, candidate_type: str) -> bool:
+        values = self.types.get(candidate_type)
+        return (values is not None and values["requests"] >= self.min_samples
+                and self.hit_rate(candidate_type) < self.min_hit_rate)
+
+    def order(self, candidates: Dict[str, str]) -> Dict[str, str]:
+        """
+        Candidates by decreasing hit rate, ties keeping the generation order, without the skipped types.
+        """
+        with self._lock:
+            ordered: List[str] = sorted(candidates, key=self.hit_rate, reverse=True)
+            kept = [candidate_type for candidate_type in ordered if not self.is_skipped(candidate_type)]
+        if not kept and ordered:
+            kept = ordered[:1]
+        return {candidate_type: candidates[candidate_type] for candidate_type in kept}
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                candidate_type: {
+                    "requests": values["requests"],
+                    "hit_rate": round(values["hits"] / values["requests"], 4) if values["requests"] else 0.0,
+                    "mean_latency_ms": round(values["latency"] / values["requests"] * 1000, 3) if values["requests"] else 0.0,
+                }
+                for candidate_type, values in sorted(self.types.items(), key=lambda item: -item[1]["requests"])
+            }
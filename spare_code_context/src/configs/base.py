@@ -1,11 +1,14 @@
-from pydantic import BaseModel
-from .constants import SUPPORTED_LANGUAGES, PYTHON, MELLUM, FILE_SEP, NUM_CONTEXT_LINES
-from typing import Literal
+from pydantic import BaseModel, ConfigDict
+from .constants import SUPPORTED_LANGUAGES, PYTHON, KOTLIN, MELLUM, FILE_SEP, NUM_CONTEXT_LINES
+from typing import Literal, Optional
 import os
 from enum import Enum
 
 class BaseConfig(BaseModel):
-    language: Literal[SUPPORTED_LANGUAGES] = os.getenv('LANGUAGE', PYTHON)
+    # defaults read from the environment are strings, validate them into the field types
+    model_config = ConfigDict(validate_default=True)
+
+    language: Literal[PYTHON, KOTLIN] = os.getenv('LANGUAGE', PYTHON)
     stage: str = os.getenv('STAGE', 'practice')
     data_root: str = os.getenv('DATA_ROOT', '/data')
     samples_root: str = os.getenv('SAMPLES_ROOT', '/samples')
@@ -18,6 +21,14 @@ class PreprocessorConfig(BaseConfig):
     """
     use_tokenizer: bool = True
     model_name: str = os.getenv('EVAL_MODEL_NAME', MELLUM)
+    tokenizer_path: Optional[str] = os.getenv('TOKENIZER_PATH') # tokenizer exported by tokenizer_loader.py, loaded without the hub
+    file_cache_max_bytes: int = os.getenv('FILE_CACHE_MAX_BYTES', 256 * 1024 * 1024) # repository files kept in memory, shared by every stage
+    file_mmap_threshold_bytes: int = os.getenv('FILE_MMAP_THRESHOLD_BYTES', 1024 * 1024) # files read through mmap from this size on, 0 disables it
+    repository_source: Literal['directory', 'zip'] = os.getenv('REPOSITORY_SOURCE', 'directory') # read repository files from extracted folders or straight from their zip archives
+    max_open_archives: int = os.getenv('MAX_OPEN_ARCHIVES', 32) # zip archives kept open with REPOSITORY_SOURCE=zip
+    token_count_cache_size: int = os.getenv('TOKEN_COUNT_CACHE_SIZE', 65536) # token counts kept, keyed by content hash
+    token_estimator: str = os.getenv('TOKEN_ESTIMATOR', 'byte_class') # estimates token counts when use_tokenizer is False, 'none' counts 0
+    token_estimator_path: Optional[str] = os.getenv('TOKEN_ESTIMATOR_PATH') # calibrated estimator models, per language
     
 
     def __repr__(self):
@@ -40,3 +51,37 @@ class PostProcessorConfig(PreprocessorConfig):
         return f"PostProcessorConfig(language={self.language}, model_name={self.model_name}, stage={self.stage}, use_tokenizer={self.use_tokenizer}, data_root={self.data_root}, samples_root={self.samples_root})"
 
 
+class RunnerConfig(BaseConfig):
+    """
+    Configuration class for the runner.
+    """
+    num_workers: int = os.getenv('NUM_WORKERS', 1) # number of worker processes, 1 runs in-process
+    worker_chunk_size: int = os.getenv('WORKER_CHUNK_SIZE', 4) # datapoints handed to a worker at once
+    use_async_pipeline: bool = os.getenv('USE_ASYNC_PIPELINE', False) # overlap CPU stages with Zoekt searches
+    search_concurrency: int = os.getenv('SEARCH_CONCURRENCY', 8) # concurrent searches in the async pipeline
+    pipeline_queue_size: int = os.getenv('PIPELINE_QUEUE_SIZE', 16) # bound of the queues between pipeline stages
+    token_batch_size: int = os.getenv('TOKEN_BATCH_SIZE', 64) # datapoints whose prefixes and suffixes are tokenized together
+    writer_flush_every: int = os.getenv('WRITER_FLUSH_EVERY', 64) # datapoints buffered before the outputs are flushed and checkpointed
+    writer_flush_interval: float = os.getenv('WRITER_FLUSH_INTERVAL', 5.0) # seconds after which buffered outputs are flushed anyway
+    num_shards: int = os.getenv('NUM_SHARDS', 1) # number of shards the completion points are split into
+    shard_index: int = os.getenv('SHARD_INDEX', 0) # shard processed by this runner
+    metrics_enabled: bool = os.getenv('METRICS_ENABLED', True) # record stage timers and counters, reported next to the predictions
+    profile_ids: str = os.getenv('PROFILE_IDS', '') # comma-separated ids of the datapoints profiled with cProfile and tracemalloc
+    profile_dir: Optional[str] = os.getenv('PROFILE_DIR') # profiles of PROFILE_IDS, defaults to {predictions_root}/profiles
+    fallback_strategy: Optional[str] = os.getenv('FALLBACK_STRATEGY') # baseline strategy (random, bm25, recent) filling the contexts the search left empty
+
+    def __repr__(self):
+        return f"RunnerConfig(language={self.language}, stage={self.stage}, num_workers={self.num_workers}, worker_chunk_size={self.worker_chunk_size}, use_async_pipeline={self.use_async_pipeline}, search_concurrency={self.search_concurrency})"
+
+
+class ServiceConfig(BaseConfig):
+    """
+    Configuration class for the resident context service.
+    """
+    host: str = os.getenv('SERVICE_HOST', '127.0.0.1') # address the HTTP service listens on
+    port: int = os.getenv('SERVICE_PORT', 8080) # port the HTTP service listens on
+    unix_socket: Optional[str] = os.getenv('SERVICE_UNIX_SOCKET') # listen on this Unix socket instead of host and port
+    max_request_bytes: int = os.getenv('SERVICE_MAX_REQUEST_BYTES', 16 * 1024 * 1024) # larger request bodies are rejected
+
+    def __repr__(self):
+        return f"ServiceConfig(host={self.host}, port={self.port}, unix_socket={self.unix_socket})"
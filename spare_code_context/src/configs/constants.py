@@ -6,4 +6,5 @@ MELLUM = "JetBrains/Mellum-4b-sft-"
 CODESTRAL ="mistralai/Codestral-22B-v0.1"
 QWEN_25_CODER = "Qwen/Qwen2.5-Coder-1.5B"
 FILE_SEP = "<|file_sep|>"
-NUM_CONTEXT_LINES = 5
\ No newline at end of file
+NUM_CONTEXT_LINES = 5
+DIFF_DEADLINE_SECONDS = 1.0 # same as the default Diff_Timeout of diff_match_patch
@@ -2,6 +2,7 @@ import sys; sys.path.append(".")
 from configs.base import BaseConfig
 from configs.constants import NUM_CONTEXT_LINES
 from enum import Enum
+from typing import Literal, Optional
 import os
 
 class IdentifiersExtractionStrategy(Enum):
@@ -36,6 +37,22 @@ class SearchConfig(BaseConfig):
     num_context_lines: int = os.getenv('NUM_CONTEXT_LINES', NUM_CONTEXT_LINES)
     max_results: int = os.getenv('MAX_RESULTS', 10)
     max_retries: int = os.getenv('MAX_RETRIES', 3)
-    retry_delay: float = os.getenv('RETRY_DELAY', 0.2)
+    retry_delay: float = os.getenv('RETRY_DELAY', 0.2) # base delay of the exponential backoff
+    max_retry_delay: float = os.getenv('MAX_RETRY_DELAY', 5.0) # cap of the exponential backoff
+    request_timeout: float = os.getenv('REQUEST_TIMEOUT', 30)
+    pool_size: int = os.getenv('ZOEKT_POOL_SIZE', 16) # keep-alive connections kept open to the webserver
+    circuit_breaker_threshold: int = os.getenv('CIRCUIT_BREAKER_THRESHOLD', 5) # consecutive failures before failing fast, 0 disables
+    circuit_breaker_reset_timeout: float = os.getenv('CIRCUIT_BREAKER_RESET_TIMEOUT', 10.0) # seconds before probing the webserver again
     zoekt_url: str = os.getenv('ZOEKT_URL', 'http://localhost:6070/api/search')
     max_candidates_used: int = os.getenv('MAX_CANDIDATES_USED', 10)
+    speculative_candidates: int = os.getenv('SPECULATIVE_CANDIDATES', 1) # candidates searched concurrently, 1 walks them in sequence
+    cache_max_entries: int = os.getenv('SEARCH_CACHE_SIZE', 4096) # in-memory LRU of search results, 0 disables it
+    cache_dir: Optional[str] = os.getenv('SEARCH_CACHE_DIR') # on-disk store of search results, disabled if not set
+    cache_max_age_days: float = os.getenv('SEARCH_CACHE_MAX_AGE_DAYS', 30.0) # on-disk results unused for this long are evicted, 0 keeps them
+    cache_max_disk_entries: int = os.getenv('SEARCH_CACHE_MAX_DISK_ENTRIES', 1000000) # least recently used on-disk results beyond this are evicted, 0 keeps them
+    index_dir: Optional[str] = os.getenv('ZOEKT_INDEX_DIR') # shards fingerprinted to invalidate the cache on re-indexing
+    index_version: Optional[str] = os.getenv('ZOEKT_INDEX_VERSION') # explicit index identity when the shards are not reachable
+    candidate_ordering: Literal['fixed', 'adaptive'] = os.getenv('CANDIDATE_ORDERING', 'fixed') # 'adaptive' tries the candidate types by decreasing hit rate, 'fixed' keeps the generated order
+    candidate_stats_path: Optional[str] = os.getenv('CANDIDATE_STATS_PATH') # hit rate and latency of each candidate type, persisted across runs
+    candidate_min_samples: int = os.getenv('CANDIDATE_MIN_SAMPLES', 20) # requests of a candidate type before it can be skipped
+    candidate_skip_hit_rate: float = os.getenv('CANDIDATE_SKIP_HIT_RATE', 0.0) # adaptive ordering skips the candidate types below this hit rate, 0 never skips
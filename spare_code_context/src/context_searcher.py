@@ -1,134 +1,408 @@
 from configs.zoekt import SearchConfig
 import requests
+from requests.adapters import HTTPAdapter
 from urllib3.exceptions import NewConnectionError
 from requests.exceptions import ConnectionError, Timeout , RequestException
 from datapoint import QueryPoint
+from search_cache import SearchResultCache, index_fingerprint
+from instrumentation import get_metrics, timed
+from candidate_statistics import ADAPTIVE, CandidateStatistics
+from typing import Deque, Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import  json
 import time
+import random
+import threading
 from logging import getLogger
 
 logger = getLogger(__name__)
+
+# how a search request was served
+ANSWERED = "answered"  # by the Zoekt webserver
+CACHED = "cached"  # from the search cache
+REJECTED = "rejected"  # not sent, the circuit breaker is open
+FAILED = "failed"  # not at all, the request failed after all retries
+EMPTY = "empty"  # nothing to search
+
+
+def empty_search_result() -> dict:
+    """
+    Search result returned when nothing was found or the search failed.
+    """
+    return {"Result": {"Files": [], "FileCount": 0}}
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the Zoekt webserver is down.
+
+    The breaker opens after `failure_threshold` consecutive failures. While it is open every request
+    is rejected, until `reset_timeout` seconds have passed; a single trial request is then let through
+    (half-open), which closes the breaker on success and re-opens it on failure. Any answer of the
+    webserver below HTTP 500 is a success, every other outcome of a request is a failure.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # let a single trial request through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Zoekt webserver is reachable again, closing circuit breaker.")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error(f"Opening circuit breaker for {self.reset_timeout} seconds after {self.consecutive_failures} consecutive failures.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
 class ZoektSearchRequester:
     """
     A class to handle search requests to Zoekt.
     """
-    
+
     def __init__(self, config: SearchConfig):
         self.config = config
         self.num_successful_searches = 0
         self.num_failed_searches = 0
+        # Searches may be issued from several threads (e.g. the async pipeline)
+        self._stats_lock = threading.Lock()
+        self.circuit_breaker = CircuitBreaker(config.circuit_breaker_threshold, config.circuit_breaker_reset_timeout)
+        self.session = self._create_session()
+        self.metrics = get_metrics()
+        self.candidate_statistics = CandidateStatistics(
+            config.language, config.candidate_stats_path, config.candidate_min_samples, config.candidate_skip_hit_rate)
+        self.cache: Optional[SearchResultCache] = self._create_cache()
+        # Executor sending speculative candidates, created on first use
+        self._speculative_executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # The search options are identical for every query, serialize them once
+        self._serialized_opts = json.dumps({
+            "NumContextLines": self.config.num_context_lines,
+            "MaxResults": self.config.max_results,
+        })
+
+    def _create_session(self) -> requests.Session:
+        """
+        Create a long-lived HTTP session keeping a pool of keep-alive connections to the webserver.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config.pool_size, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive',
+        })
+        return session
+
+    def _create_cache(self) -> Optional[SearchResultCache]:
+        """
+        Create the search result cache, namespaced by the identity of the index being searched.
+        """
+        cache_dir = self.config.cache_dir
+        if self.config.index_dir:
+            index_identity = index_fingerprint(self.config.index_dir)
+        else:
+            index_identity = self.config.index_version or ""
+        if cache_dir and not index_identity:
+            # results stored across runs would outlive a re-indexing
+            logger.warning("SEARCH_CACHE_DIR is set without ZOEKT_INDEX_DIR or ZOEKT_INDEX_VERSION to identify the index, "
+                           "disabling the on-disk search cache.")
+            cache_dir = None
+        if self.config.cache_max_entries <= 0 and not cache_dir:
+            return None
+        return SearchResultCache(
+            max_entries=self.config.cache_max_entries,
+            cache_dir=cache_dir,
+            namespace=f"{self.config.zoekt_url}#{index_identity}",
+            max_age_seconds=self.config.cache_max_age_days * 24 * 3600,
+            max_disk_entries=self.config.cache_max_disk_entries,
+        )
+
+    def close(self) -> None:
+        if self._speculative_executor is not None:
+            self._speculative_executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.close()
+        self.session.close()
+
+    def search_statistics(self) -> Dict[str, float]:
+        """
+        Counters of the searches done so far, including the cache hit rate.
+        """
+        statistics = {
+            "num_successful_searches": self.num_successful_searches,
+            "num_failed_searches": self.num_failed_searches,
+        }
+        if self.cache is not None:
+            statistics.update(self.cache.statistics())
+        return statistics
+
+    def _get_speculative_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._speculative_executor is None:
+                self._speculative_executor = ThreadPoolExecutor(
+                    max_workers=max(self.config.pool_size, self.config.speculative_candidates),
+                    thread_name_prefix="zoekt-speculative",
+                )
+            return self._speculative_executor
+
+    @staticmethod
+    def _has_files(result: Optional[dict]) -> bool:
+        return bool(result and "Result" in result and "Files" in result["Result"] and result["Result"]["Files"])
+
+    def search_candidate(self, candidate_type: str, query: str) -> dict:
+        """
+        Search a single query candidate, recording its latency and whether it returned files under its type.
+        Only the answers of the webserver are timed and recorded: cache hits would understate the latency
+        of the type, and failed requests say nothing about its hit rate. They are counted apart.
+        """
+        start = time.perf_counter()
+        result, outcome = self._search(query)
+        latency = time.perf_counter() - start
+        if outcome != ANSWERED:
+            if outcome == CACHED:
+                self.metrics.increment(f"search.candidate.{candidate_type}.cache_hits")
+            elif outcome == REJECTED:
+                self.metrics.increment(f"search.candidate.{candidate_type}.breaker_rejections")
+            elif outcome == FAILED:
+                self.metrics.increment(f"search.candidate.{candidate_type}.failures")
+            return result
+        hit = self._has_files(result)
+        self.metrics.increment(f"search.candidate.{candidate_type}.requests")
+        self.metrics.record(f"search.candidate.{candidate_type}", latency)
+        if hit:
+            self.metrics.increment(f"search.candidate.{candidate_type}.hits")
+        self.candidate_statistics.record(candidate_type, hit, latency)
+        return result
+
+    def order_candidates(self, query_point: QueryPoint) -> Dict[str, str]:
+        """
+        Candidates of a query point in the order they are searched: as generated, or by decreasing hit rate
+        of their type with adaptive ordering.
+        """
+        if self.config.candidate_ordering == ADAPTIVE:
+            return self.candidate_statistics.order(query_point.candidates)
+        return query_point.candidates
 
+    @timed("search")
     def zoekt_search_on_query_point(
             self,
             query_point: QueryPoint):
-        candidates = query_point.candidates
+        if self.config.speculative_candidates > 1:
+            return self.speculative_search_on_query_point(query_point)
+        candidates = self.order_candidates(query_point)
         count = 0
-        for _, query in candidates.items():
-            result = self.zoekt_search_request(query)
+        for candidate_type, query in candidates.items():
+            result = self.search_candidate(candidate_type, query)
             if result and "Result" in result and "Files" in result["Result"]:
                 files = result["Result"]["Files"]
                 if files:
                     logger.info(f"Found {len(files)} files for query: {query}")
-                    self.num_successful_searches += 1
+                    with self._stats_lock:
+                        self.num_successful_searches += 1
+                    self.metrics.increment(f"search.found_at_candidate.{count}")
                     return result
             # stop when reached max candidates used
             if count >= self.config.max_candidates_used:
                 logger.info(f"Reached max candidates used: {self.config.max_candidates_used}")
                 break
             count += 1
-        self.num_failed_searches += 1
-        return {"Result": {"Files": [], "FileCount": 0}}
-    
+        with self._stats_lock:
+            self.num_failed_searches += 1
+        self.metrics.increment("search.not_found")
+        return empty_search_result()
+
+    def speculative_search_on_query_point(self, query_point: QueryPoint) -> dict:
+        """
+        Search the candidates of a query point with up to `speculative_candidates` requests in flight.
+
+        Candidates are consumed in priority order, so the result is the one of the highest-priority
+        candidate returning files, exactly as in the sequential walk. Lower-priority candidates still
+        queued when it is found are cancelled, and the results of those already in flight are ignored.
+        """
+        # same budget as the sequential walk, which stops after max_candidates_used + 1 requests
+        candidates: List[Tuple[str, str]] = list(self.order_candidates(query_point).items())[:self.config.max_candidates_used + 1]
+        executor = self._get_speculative_executor()
+        next_candidate = 0
+        in_flight: Deque[Tuple[int, str, Future]] = deque()
+        try:
+            while next_candidate < len(candidates) or in_flight:
+                while next_candidate < len(candidates) and len(in_flight) < self.config.speculative_candidates:
+                    candidate_type, query = candidates[next_candidate]
+                    in_flight.append((next_candidate, query, executor.submit(self.search_candidate, candidate_type, query)))
+                    next_candidate += 1
+                position, query, future = in_flight.popleft()
+                result = future.result()
+                if self._has_files(result):
+                    logger.info(f"Found {len(result['Result']['Files'])} files for query: {query}")
+                    with self._stats_lock:
+                        self.num_successful_searches += 1
+                    self.metrics.increment(f"search.found_at_candidate.{position}")
+                    return result
+        finally:
+            for _, _, future in in_flight:
+                future.cancel()
+        with self._stats_lock:
+            self.num_failed_searches += 1
+        self.metrics.increment("search.not_found")
+        return empty_search_result()
+
     def zoekt_search_request(
                         self,
                         query: str,
                        ) -> dict:
         """
         Make a request to the zoekt search API with error handling and retry logic.
-        
+
         Args:
             query: Search query string
-            num_context_lines: Number of context lines to include
-            max_results: Maximum number of results to return
-            max_retries: Maximum number of retry attempts
-            retry_delay: Delay between retries in seconds
-        
+
         Returns:
             Dict containing search results or empty result on failure
         """
+        return self._search(query)[0]
+
+    def _search(self, query: str) -> Tuple[dict, str]:
+        """
+        Search results of a query, from the cache or the webserver, and how they were served.
+        """
         if query is None or query.strip() == "":
             print("Empty query provided. Returning empty result.")
-            return {"Result": {"Files": [], "FileCount": 0}}
-        
+            return empty_search_result(), EMPTY
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(query, self.config.num_context_lines, self.config.max_results)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached, CACHED
+        result, outcome = self._request_with_retries(query)
+        if result is None:
+            # failed searches are not cached, they are retried on the next occurrence
+            return empty_search_result(), outcome
+        if self.cache is not None:
+            self.cache.put(cache_key, result)
+        return result, ANSWERED
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """
+        Exponential backoff with jitter: half of the capped delay is fixed, the other half is random.
+        """
+        delay = min(self.config.max_retry_delay, self.config.retry_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _request_with_retries(self, query: str) -> Tuple[Optional[dict], str]:
+        """
+        Send the query to the webserver, retrying on transient failures.
+
+        Returns:
+            The decoded response, or None if the search failed, and whether it was answered, rejected by
+            the circuit breaker before anything was sent, or failed
+        """
         url = self.config.zoekt_url
-        payload = json.dumps({
-            "Q": query,
-            "Opts": {
-                "NumContextLines": self.config.num_context_lines,
-                "MaxResults": self.config.max_results,
-            }
-        })
-        headers = {
-            'Content-Type': 'application/json'
-        }
+        payload = '{"Q": ' + json.dumps(query) + ', "Opts": ' + self._serialized_opts + '}'
 
         for attempt in range(self.config.max_retries + 1):
+            if not self.circuit_breaker.allow_request():
+                logger.debug(f"Circuit breaker is open, skipping query: {query}")
+                return None, REJECTED if attempt == 0 else FAILED
+            retry_delay = self._backoff_delay(attempt)
             try:
-                response = requests.request("POST", url, headers=headers, data=payload, timeout=30)
-                
+                response = self.session.post(url, data=payload, timeout=self.config.request_timeout)
+
                 # Check if response is successful
                 if response.status_code == 200:
-                    # print(response.json())
-                    return response.json()
+                    result = response.json()
+                    self.circuit_breaker.record_success()
+                    return result, ANSWERED
                 else:
                     logger.error(f"HTTP {response.status_code} error: {response.text}")
+                    # the webserver answered: only server errors count against it
+                    if response.status_code >= 500:
+                        self.circuit_breaker.record_failure()
+                    else:
+                        self.circuit_breaker.record_success()
                     if attempt < self.config.max_retries:
-                        logger.info(f"Retrying in {self.config.retry_delay} seconds... (attempt {attempt + 1}/{self.config.max_retries})")
-                        time.sleep(self.config.retry_delay)
+                        logger.info(f"Retrying in {retry_delay:.2f} seconds... (attempt {attempt + 1}/{self.config.max_retries})")
+                        time.sleep(retry_delay)
                         continue
                     else:
                         logger.info("Max retries reached. Returning empty result.")
-                        return {"Result": {"Files": [], "FileCount": 0}}
-                        
+                        return None, FAILED
+
             except (ConnectionError, NewConnectionError) as e:
                 logger.error(f"Connection error on attempt {attempt + 1}: {e}")
+                self.circuit_breaker.record_failure()
                 if attempt < self.config.max_retries:
-                    logger.info(f"Zoekt service might be down. Retrying in {self.config.retry_delay} seconds...")
-                    time.sleep(self.config.retry_delay)
+                    logger.info(f"Zoekt service might be down. Retrying in {retry_delay:.2f} seconds...")
+                    time.sleep(retry_delay)
                 else:
                     logger.info("Failed to connect to Zoekt service after all retries.")
-                    print("Please check if Zoekt is running on http://localhost:6070")
-                    return {"Result": {"Files": [], "FileCount": 0}}
-                    
+                    logger.error(f"Please check if Zoekt is running on {url}")
+                    return None, FAILED
+
             except Timeout as e:
                 logger.error(f"Request timeout on attempt {attempt + 1}: {e}")
+                self.circuit_breaker.record_failure()
                 if attempt < self.config.max_retries:
-                    logger.info(f"Retrying in {self.config.retry_delay} seconds...")
-                    time.sleep(self.config.retry_delay)
+                    logger.info(f"Retrying in {retry_delay:.2f} seconds...")
+                    time.sleep(retry_delay)
                 else:
                     logger.info("Request timed out after all retries.")
-                    return {"Result": {"Files": [], "FileCount": 0}}
-                    
+                    return None, FAILED
+
+            except json.JSONDecodeError as e:
+                # requests' JSONDecodeError is also a RequestException, so it is caught first
+                logger.error(f"JSON decode error: {e}")
+                logger.error(f"Response content: {response.text if 'response' in locals() else 'No response'}")
+                self.circuit_breaker.record_failure()
+                return None, FAILED
+
             except RequestException as e:
                 logger.error(f"Request error on attempt {attempt + 1}: {e}")
+                self.circuit_breaker.record_failure()
                 if attempt < self.config.max_retries:
-                    logger.info(f"Retrying in {self.config.retry_delay} seconds...")
-                    time.sleep(self.config.retry_delay)
+                    logger.info(f"Retrying in {retry_delay:.2f} seconds...")
+                    time.sleep(retry_delay)
                 else:
                     logger.error("Request failed after all retries.")
-                    return {"Result": {"Files": [], "FileCount": 0}}
-                    
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
-                logger.error(f"Response content: {response.text if 'response' in locals() else 'No response'}")
-                return {"Result": {"Files": [], "FileCount": 0}}
-                
+                    return None, FAILED
+
             except Exception as e:
                 logger.error(f"Unexpected error: {e}")
-                return {"Result": {"Files": [], "FileCount": 0}}
-        
-        # This should never be reached, but just in case
-        return {"Result": {"Files": [], "FileCount": 0}}
+                # a half-open breaker must not wait forever for the outcome of its trial request
+                self.circuit_breaker.record_failure()
+                return None, FAILED
 
-
-    
\ No newline at end of file
+        # This should never be reached, but just in case
+        return None, FAILED
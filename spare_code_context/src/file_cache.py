@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from logging import getLogger
+
+from repository_access import DIRECTORY, RepositorySource, create_repository_source
+
+logger = getLogger(__name__)
+
+
+class FileContentCache:
+    """
+    Process-wide cache of repository file contents keyed by (repository-revision, path).
+
+    Contents are evicted in least-recently-used order once their total size exceeds `max_bytes`.
+    Misses are read from `source`, extracted directories by default (see repository_access.py).
+    """
+
+    def __init__(self, max_bytes: int, mmap_threshold_bytes: int = 0, source: Optional[RepositorySource] = None) -> None:
+        self.max_bytes = max_bytes
+        self.mmap_threshold_bytes = mmap_threshold_bytes
+        self.source: RepositorySource = source or create_repository_source(DIRECTORY, mmap_threshold_bytes)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._contents: OrderedDict[Tuple[str, str], Tuple[str, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, repositories_root: str, repository: str, path: str, archive: Optional[str] = None) -> str:
+        """
+        Read a file of a repository revision stored under repositories_root, extracted to its repository
+        folder or in its archive.
+        """
+        key = (repository, path)
+        with self._lock:
+            entry = self._contents.get(key)
+            if entry is not None:
+                self._contents.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        content, size = self.source.read(repositories_root, repository, path, archive)
+        self._put(key, content, size)
+        return content
+
+    def _put(self, key: Tuple[str, str], content: str, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._contents:
+                return
+            self._contents[key] = (content, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._contents.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def statistics(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "file_cache_hits": self.hits,
+            "file_cache_misses": self.misses,
+            "file_cache_hit_rate": self.hits / lookups if lookups else 0.0,
+            "file_cache_bytes": self.current_bytes,
+            **self.source.statistics(),
+        }
+
+
+_file_content_cache: Optional[FileContentCache] = None
+_file_content_cache_lock = threading.Lock()
+
+
+def get_file_content_cache(max_bytes: int,
+                           mmap_threshold_bytes: int = 0,
+                           repository_source: str = DIRECTORY,
+                           max_open_archives: int = 32) -> FileContentCache:
+    """
+    Get the file content cache shared by every stage of this process, creating it on first use.
+    """
+    global _file_content_cache
+    with _file_content_cache_lock:
+        if _file_content_cache is None:
+            source = create_repository_source(repository_source, mmap_threshold_bytes, max_open_archives)
+            _file_content_cache = FileContentCache(max_bytes, mmap_threshold_bytes, source)
+        return _file_content_cache
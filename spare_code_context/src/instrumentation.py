@@ -0,0 +1,282 @@
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# 2**SUB_BUCKET_BITS sub-buckets per power of two, i.e. at most ~3% relative error on recorded values
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+REPORTED_PERCENTILES = (50, 90, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of latencies in microseconds.
+
+    Values below 2 * SUB_BUCKET_COUNT are counted exactly, larger ones in logarithmic buckets split into
+    SUB_BUCKET_COUNT linear sub-buckets, so that memory does not grow with the number of recorded values
+    and histograms of several processes merge exactly.
+    """
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+        self.buckets: Dict[int, int] = {}
+
+    @staticmethod
+    def bucket_of(value: int) -> int:
+        if value < 2 * SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return shift * SUB_BUCKET_COUNT + (value >> shift)
+
+    @staticmethod
+    def highest_value_of(bucket: int) -> int:
+        if bucket < 2 * SUB_BUCKET_COUNT:
+            return bucket
+        shift = bucket // SUB_BUCKET_COUNT - 1
+        return ((bucket - shift * SUB_BUCKET_COUNT + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        value = max(0, int(value))
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+        bucket = self.bucket_of(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, q: float) -> int:
+        """
+        Highest value equivalent to the q-th percentile, capped by the largest recorded value.
+        """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * q // 100))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.highest_value_of(bucket), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max, "buckets": dict(self.buckets)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls()
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        # JSON turns the bucket indices into strings
+        histogram.buckets = {int(bucket): count for bucket, count in data["buckets"].items()}
+        return histogram
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Count, total seconds and latency percentiles in milliseconds.
+        """
+        summary = {
+            "count": self.count,
+            "total_s": round(self.total / 1e6, 3),
+            "mean_ms": round(self.total / self.count / 1e3, 3) if self.count else 0.0,
+        }
+        for q in REPORTED_PERCENTILES:
+            summary[f"p{q}_ms"] = round(self.percentile(q) / 1e3, 3)
+        summary["max_ms"] = round(self.max / 1e3, 3)
+        return summary
+
+
+class Metrics:
+    """
+    Process-wide stage timers and counters.
+
+    Timers are named after the stage they measure, sub-stages being dotted (`preprocess.diff`),
+    and search candidates by their type (`search.candidate.functions_classes_naive`).
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.timers: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = LatencyHistogram()
+            histogram.record(seconds * 1e6)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def _timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timer(self, name: str):
+        """
+        Context manager recording the time spent in its block under `name`.
+        """
+        return self._timer(name) if self.enabled else nullcontext()
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        """
+        Serializable copy of the timers and counters, e.g. to be sent by a worker process to its parent.
+        With reset, the metrics start over, so that successive snapshots are deltas.
+        """
+        with self._lock:
+            snapshot = {
+                "timers": {name: histogram.to_dict() for name, histogram in self.timers.items()},
+                "counters": dict(self.counters),
+            }
+            if reset:
+                self.timers = {}
+                self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        with self._lock:
+            for name, data in snapshot["timers"].items():
+                histogram = self.timers.get(name)
+                if histogram is None:
+                    histogram = self.timers[name] = LatencyHistogram()
+                histogram.merge(LatencyHistogram.from_dict(data))
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "timers": {name: self.timers[name].summary() for name in sorted(self.timers)},
+                "counters": {name: self.counters[name] for name in sorted(self.counters)},
+            }
+
+    def write_report(self, path: str, extra: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Write the report as JSON, along with extra statistics of the run.
+        """
+        report = self.report()
+        if extra:
+            report.update(extra)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    def format_report(self) -> List[str]:
+        """
+        One line per timer, for the logs.
+        """
+        return [f"{name}: {summary['count']} calls, {summary['total_s']}s, p50 {summary['p50_ms']}ms, "
+                f"p95 {summary['p95_ms']}ms, p99 {summary['p99_ms']}ms"
+                for name, summary in self.report()["timers"].items()]
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """
+    Get the metrics of this process.
+    """
+    return _metrics
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorator recording the duration of each call under `name` in the metrics of the process.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _metrics.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _metrics.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class DatapointProfiler:
+    """
+    Opt-in cProfile and tracemalloc profiling of selected datapoints.
+
+    For each selected datapoint id, the sections of the pipeline run under `profile` accumulate in
+    {output_dir}/{id}.prof (load it with pstats or snakeviz), and the peak memory and top allocations
+    of each section are appended to {output_dir}/{id}.tracemalloc.txt.
+    """
+
+    def __init__(self, datapoint_ids: Iterable[str], output_dir: str, top_allocations: int = 25) -> None:
+        self.datapoint_ids = {datapoint_id for datapoint_id in datapoint_ids if datapoint_id}
+        self.output_dir = output_dir
+        self.top_allocations = top_allocations
+        self._profiles: Dict[str, cProfile.Profile] = {}
+
+    def profile(self, datapoint_id: str, section: str):
+        """
+        Context manager profiling its block if the datapoint is selected.
+        """
+        if datapoint_id not in self.datapoint_ids:
+            return nullcontext()
+        return self._profile(datapoint_id, section)
+
+    @contextmanager
+    def _profile(self, datapoint_id: str, section: str) -> Iterator[None]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        profile = self._profiles.setdefault(datapoint_id, cProfile.Profile())
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            output_file = os.path.join(self.output_dir, datapoint_id)
+            profile.dump_stats(output_file + ".prof")
+            with open(output_file + ".tracemalloc.txt", "a") as f:
+                f.write(f"== {section}: peak {peak / 1024:.1f} KiB\n")
+                for statistic in snapshot.statistics("lineno")[:self.top_allocations]:
+                    f.write(f"{statistic}\n")
+            logger.info(f"Profiled {section} of datapoint {datapoint_id} into {output_file}.prof")
@@ -1,8 +1,12 @@
 from configs.base import PostProcessorConfig
 from configs.constants import SEPARATOR_COMMENT
 import os
+from typing import List, Tuple
+import numpy as np
 from preprocessor import DataPoint, Preprocessor
-from utils import get_merged_snippets_from_file
+from utils import merge_overlapping_ranges
+from file_cache import get_file_content_cache
+from instrumentation import get_metrics, timed
 
 import logging
 # logging.basicConfig(level=logging.ERROR)
@@ -12,6 +16,10 @@ class PostProcessor:
     def __init__(self, config: PostProcessorConfig, preprocessor: Preprocessor) -> None:
         self.config = config
         self.preprocessor = preprocessor
+        self.repositories_root = os.path.join(self.config.data_root, f'repositories-{self.config.language}-{self.config.stage}')
+        self.file_cache = get_file_content_cache(config.file_cache_max_bytes, config.file_mmap_threshold_bytes,
+                                                 config.repository_source, config.max_open_archives)
+        self.metrics = get_metrics()
 
     def compose_context(self, file_name, content):
         return self.config.file_separator + file_name + "\n" + content
@@ -32,6 +40,7 @@ class PostProcessor:
         """
         return self.preprocessor.count_tokens(code)
  
+    @timed("postprocess.pack")
     def postprocess_search_results(
         self,
         search_results: dict,
@@ -50,40 +59,48 @@ class PostProcessor:
         processed_contexts = []
 
         for file in files[:self.config.top_k_file]:
-            file_path = os.path.join(self.config.data_root,f'repositories-{self.config.language}-{self.config.stage}',file['Repository'], file['FileName'])
-            with open(file_path, 'r') as f:
-                file_content = f.read()
-            context_str = self.compose_context(file['FileName'], file_content)
-            file_num_tokens = self.count_tokens(context_str)
+            with self.metrics.timer("postprocess.read_file"):
+                file_content = self.file_cache.read(self.repositories_root, file['Repository'], file['FileName'])
+            header = self.compose_context(file['FileName'], "")
+            # tokenize the file once, snippet costs are then looked up by line range
+            with self.metrics.timer("postprocess.tokenize"):
+                token_index = self.preprocessor.index_tokens_by_line(header, file_content)
+                if token_index is not None:
+                    file_num_tokens = token_index.total_tokens
+                else:
+                    file_num_tokens = self.count_tokens(header + file_content)
 
             if file_num_tokens <= max_context_tokens and remaining_context_tokens - file_num_tokens >= 0:
                 remaining_context_tokens -= file_num_tokens
-                processed_contexts.append({"context": context_str})
+                processed_contexts.append({"context": header + file_content})
                 continue
 
             line_infos = self.get_line_infos(file['LineMatches'])
             lines = file_content.splitlines()
 
             if not self.config.merge_overlapping:
-                for info in line_infos:
-                    snippet = "\n".join(lines[info['start_line']-1:info['end_line']-1])
-                    context_str = self.compose_context(file['FileName'], snippet)
-                    num_tokens = self.count_tokens(context_str)
-                    if num_tokens <= max_context_tokens and remaining_context_tokens - num_tokens >= 0:
-                        remaining_context_tokens -= num_tokens
-                        processed_contexts.append({"context": context_str})
+                line_ranges = [(info['start_line'] - 1, info['end_line'] - 1) for info in line_infos]
             else:
-                merged_snippets = get_merged_snippets_from_file(line_infos, lines)
-                for snippet in merged_snippets:
-                    context_str = self.compose_context(file['FileName'], snippet)
-                    num_tokens = self.count_tokens(context_str)
-                    if num_tokens <= max_context_tokens and remaining_context_tokens - num_tokens >= 0:
-                        remaining_context_tokens -= num_tokens
-                        processed_contexts.append({"context": context_str})
+                line_ranges = [(start_line - 1, end_line) for start_line, end_line in merge_overlapping_ranges(line_infos)]
+
+            snippet_contexts = [header + "\n".join(lines[start:stop]) for start, stop in line_ranges]
+            with self.metrics.timer("postprocess.tokenize"):
+                if token_index is not None:
+                    snippet_num_tokens = [token_index.count_lines(start, stop) for start, stop in line_ranges]
+                else:
+                    snippet_num_tokens = self.preprocessor.count_tokens_batch(snippet_contexts)
+
+            for context_str, num_tokens in zip(snippet_contexts, snippet_num_tokens):
+                if num_tokens <= max_context_tokens and remaining_context_tokens - num_tokens >= 0:
+                    remaining_context_tokens -= num_tokens
+                    processed_contexts.append({"context": context_str})
 
         return {"context": "\n".join([c['context'] for c in processed_contexts])}
 
-    def postprocess(self, datapoint: DataPoint,  search_results: dict) -> list[dict]:
+    def select_prefix_and_suffix(self, datapoint: DataPoint | dict) -> Tuple[str, str]:
+        """
+        Select the prefix and suffix given to the model, from the whole file or from the diff.
+        """
         prefix = ""
         suffix = ""
         datapoint = datapoint.dict() if isinstance(datapoint, DataPoint) else datapoint
@@ -96,10 +113,57 @@ class PostProcessor:
             if not prefix.strip() or not suffix.strip(): # gracefully handle empty prefixes/suffixes in diff
                 prefix = datapoint['prefix']
                 suffix = datapoint['suffix']
+        return prefix, suffix
+
+    def count_prefix_and_suffix_tokens(self, datapoints: List[DataPoint | dict]) -> List[int]:
+        """
+        Count the prefix and suffix tokens of many preprocessed datapoints in one batch,
+        so that postprocess finds them in the token count cache.
+        """
+        return self.preprocessor.count_tokens_batch([prefix + suffix for prefix, suffix in map(self.select_prefix_and_suffix, datapoints)])
+
+    def context_budget(self, prefix: str, suffix: str) -> int:
+        """
+        Tokens left for the context once the prefix, the suffix and the tokens reserved for generation are counted.
+        """
+        with self.metrics.timer("postprocess.prefix_suffix_tokens"):
+            num_token_from_prefix_and_suffix = self.count_tokens(prefix + suffix)
+        return self.config.max_tokens - num_token_from_prefix_and_suffix - self.config.max_reserved_tokens # reserved tokens for the model to generate
+
+    def fit_file_context(self, file_name: str, content: str, max_context_tokens: int) -> str:
+        """
+        Context of a whole file, cut to its leading lines that fit in max_context_tokens,
+        empty if not even its first line does.
+        """
+        header = self.compose_context(file_name, "")
+        lines = content.splitlines(keepends=True)
+        token_index = self.preprocessor.index_tokens_by_line(header, content)
+        if token_index is not None:
+            if token_index.total_tokens <= max_context_tokens:
+                return header + content
+            # cumulative_tokens[n] is the count of the first n lines
+            num_lines = int(np.searchsorted(token_index.cumulative_tokens, max_context_tokens - token_index.header_tokens, side="right")) - 1
+        else:
+            if self.count_tokens(header + content) <= max_context_tokens:
+                return header + content
+            # the largest number of leading lines that fits, they fit less and less as lines are added
+            low, high = 0, len(lines)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self.count_tokens(header + "".join(lines[:middle])) <= max_context_tokens:
+                    low = middle
+                else:
+                    high = middle - 1
+            num_lines = low
+        if num_lines <= 0:
+            return ""
+        return header + "".join(lines[:num_lines])
+
+    @timed("postprocess")
+    def postprocess(self, datapoint: DataPoint,  search_results: dict) -> list[dict]:
+        prefix, suffix = self.select_prefix_and_suffix(datapoint)
+        possible_context_tokens = self.context_budget(prefix, suffix)
 
-        num_token_from_prefix_and_suffix = self.count_tokens(prefix + suffix)
-        possible_context_tokens = self.config.max_tokens - num_token_from_prefix_and_suffix - self.config.max_reserved_tokens # reserved tokens for the model to generate
-        
         postprocessed_results = {"context": ""}
         postprocessed_results = self.postprocess_search_results(
             search_results, 
@@ -107,4 +171,4 @@ class PostProcessor:
         )
         postprocessed_results['prefix'] = prefix
         postprocessed_results['suffix'] = suffix
-        return postprocessed_results
\ No newline at end of file
+        return postprocessed_results
@@ -1,10 +1,12 @@
 
-from transformers import AutoTokenizer
-from utils import extract_diff, get_parser, code_to_tree, code_to_tokens, get_tokenizer_name_from_model
+from utils import extract_diff, get_parser, code_to_tree, get_tokenizer_name_from_model, TokenLineIndex, TokenCountCache, count_tokens_in_batch
 from configs.constants import SEPARATOR_COMMENT
 from configs.base import PreprocessorConfig
 from datapoint import DataPoint
-from typing import Dict, Tuple
+from file_cache import get_file_content_cache
+from token_estimator import create_token_estimator
+from tokenizer_loader import load_tokenizer
+from typing import Dict, List, Optional, Tuple
 import os
 
 from logging import getLogger
@@ -15,24 +17,37 @@ class Preprocessor:
     def __init__(self, config: PreprocessorConfig)-> None:
         self.parser = get_parser(config.language)
         self.tokenizer_name = get_tokenizer_name_from_model(config.model_name, config.language)
-        self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name) if config.use_tokenizer else None
+        self.tokenizer = load_tokenizer(self.tokenizer_name, config.tokenizer_path) if config.use_tokenizer else None
+        # token counts are estimated when running without the tokenizer
+        self.token_estimator = None if self.tokenizer else create_token_estimator(config.token_estimator, config.language, config.token_estimator_path)
         self.config = config
+        self.repositories_root = os.path.join(self.config.data_root, f"repositories-{self.config.language}-{self.config.stage}")
+        self.file_cache = get_file_content_cache(config.file_cache_max_bytes, config.file_mmap_threshold_bytes,
+                                                 config.repository_source, config.max_open_archives)
+        self.token_counts = TokenCountCache(config.token_count_cache_size)
+
+    @staticmethod
+    def get_repository_revision(datapoint: DataPoint | Dict) -> str:
+        """
+        Get the name of the repository revision folder, {owner}__{repository}-{revision}.
+        """
+        return "-".join([datapoint["repo"].replace("/", "__"), datapoint['revision']])
 
     def get_original_file_path(self, datapoint: DataPoint | Dict) -> str:
         """
         Get the original file path from the datapoint.
         """
-        repo_path = os.path.join(self.config.data_root, f"repositories-{self.config.language}-{self.config.stage}", "-".join([datapoint["repo"].replace("/", "__"), datapoint['revision']]))
+        repo_path = os.path.join(self.repositories_root, self.get_repository_revision(datapoint))
         file_path = repo_path + "/" + datapoint['path']
         logger.debug(f"Original file path: {file_path}")
         return file_path
 
     def get_original_code(self, datapoint: DataPoint | Dict) -> str:
-
-        file_path = self.get_original_file_path(datapoint)
-        with open(file_path, 'r') as file:
-            content = file.read()
-        return content
+        """
+        Read the original file of the datapoint through the shared file content cache.
+        """
+        return self.file_cache.read(self.repositories_root, self.get_repository_revision(datapoint), datapoint['path'],
+                                    datapoint.get('archive'))
 
     @staticmethod
     def generate_incomplete_code(datapoint: DataPoint | Dict) -> str:
@@ -43,8 +58,8 @@ class Preprocessor:
         incomplete_code = SEPARATOR_COMMENT.join([datapoint['prefix'], datapoint['suffix']])
         return incomplete_code
 
-    def generate_diff(self, datapoint: DataPoint | Dict) -> str:
-        original_code = self.get_original_code(datapoint)
+    def generate_diff(self, datapoint: DataPoint | Dict, original_code: str | None = None) -> str:
+        original_code = self.get_original_code(datapoint) if original_code is None else original_code
         incomplete_code = self.generate_incomplete_code(datapoint)
         diff = extract_diff(incomplete_code, original_code) # SEPARATOR_COMMENT should be inside the diff also
         return diff
@@ -53,6 +68,7 @@ class Preprocessor:
         """
         Detect the completion point by taking the end point of the prefix.
         """
+        # the whole prefix is parsed by no other stage, caching its tree would only pin it in memory
         tree = self.parser.parse(bytes(datapoint["prefix"], "utf8"))
         # Find the end point of the prefix
         if not tree.root_node.children:
@@ -80,9 +96,41 @@ class Preprocessor:
         Count the number of tokens in the code.
         """
         if self.tokenizer:
-            tokens = code_to_tokens(code, self.tokenizer)
-            return len(tokens)
-        return 0
+            if isinstance(code, list):
+                return sum(self.count_tokens_batch(code))
+            return self.count_tokens_batch([code])[0]
+        if isinstance(code, list):
+            return sum(self.token_estimator.estimate_batch(code))
+        return self.token_estimator.estimate(code)
+
+    def count_tokens_batch(self, codes: List[str]) -> List[int]:
+        """
+        Count the tokens of each string, encoding the ones missing from the token count cache in a single batch.
+        """
+        if not self.tokenizer:
+            return self.token_estimator.estimate_batch(codes)
+        keys = [self.token_counts.key(code) for code in codes]
+        counts = [self.token_counts.get(key) for key in keys]
+        missing: Dict[bytes, str] = {key: code for key, code, count in zip(keys, codes, counts) if count is None}
+        if missing:
+            for key, count in zip(missing, count_tokens_in_batch(list(missing.values()), self.tokenizer)):
+                self.token_counts.put(key, count)
+                missing[key] = count
+            counts = [missing[key] if count is None else count for key, count in zip(keys, counts)]
+        return counts
+
+    def index_tokens_by_line(self, header: str, content: str) -> Optional[TokenLineIndex]:
+        """
+        Tokenize header + content once and index its tokens by content line, or estimate them without tokenizer.
+        Returns None when there is no fast tokenizer to provide token offsets.
+        """
+        if not self.tokenizer:
+            return TokenLineIndex.from_line_counts(*self.token_estimator.estimate_lines(header, content.splitlines(keepends=True)))
+        if not self.tokenizer.is_fast:
+            return None
+        encoding = self.tokenizer(header + content, return_offsets_mapping=True)
+        token_starts = [start for start, _ in encoding["offset_mapping"]]
+        return TokenLineIndex.from_token_starts(token_starts, len(header), content.splitlines(keepends=True))
 
     @staticmethod
     def extract_diff_prefix_and_suffix(diff: str) -> tuple[str, str]:
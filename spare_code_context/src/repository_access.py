@@ -0,0 +1,259 @@
+import bz2
+import mmap
+import os
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DIRECTORY = "directory"
+ZIP = "zip"
+
+# local file header of a zip member, up to its variable-length name and extra field
+LOCAL_FILE_HEADER = struct.Struct("<4s2B4HL2L2H")
+LOCAL_FILE_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+def decode_text(data) -> str:
+    """
+    Decode file bytes the way open(path, 'r') does: UTF-8 with universal newlines.
+    """
+    text = str(data, "utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+class FileInfo(NamedTuple):
+    path: str  # relative to the repository revision
+    size: int  # bytes
+    mtime: float
+
+
+class RepositorySource:
+    """
+    Where the files of the repository revisions are read from.
+    """
+
+    def list_files(self, repositories_root: str, repository: str, archive: Optional[str] = None) -> List[FileInfo]:
+        """
+        Files of a repository revision. Raises FileNotFoundError if the revision is missing, rather than
+        listing no files.
+        """
+        raise NotImplementedError
+
+    def read(self, repositories_root: str, repository: str, path: str, archive: Optional[str] = None) -> Tuple[str, int]:
+        """
+        Text of a file of a repository revision and its size in bytes.
+        """
+        raise NotImplementedError
+
+    def statistics(self) -> Dict[str, float]:
+        return {}
+
+
+class DirectorySource(RepositorySource):
+    """
+    Repositories extracted to repositories_root/{owner}__{repository}-{revision}.
+    Files of at least `mmap_threshold_bytes` are decoded straight from a memory map of the file
+    instead of being read into an intermediate buffer first.
+    """
+
+    def __init__(self, mmap_threshold_bytes: int = 0) -> None:
+        self.mmap_threshold_bytes = mmap_threshold_bytes
+
+    def list_files(self, repositories_root: str, repository: str, archive: Optional[str] = None) -> List[FileInfo]:
+        root_dir = os.path.join(repositories_root, repository)
+        if not os.path.isdir(root_dir):
+            raise FileNotFoundError(f"Repository directory {root_dir} does not exist")
+        files = []
+        for dirpath, dirnames, filenames in os.walk(root_dir):
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                files.append(FileInfo(os.path.relpath(file_path, root_dir), stat.st_size, stat.st_mtime))
+        return files
+
+    def read(self, repositories_root: str, repository: str, path: str, archive: Optional[str] = None) -> Tuple[str, int]:
+        with open(os.path.join(repositories_root, repository, path), 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if self.mmap_threshold_bytes > 0 and size >= self.mmap_threshold_bytes:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return decode_text(mapped), size
+            return decode_text(file.read()), size
+
+
+class ArchiveMember(NamedTuple):
+    header_offset: int
+    compress_type: int
+    compress_size: int
+    file_size: int
+    crc: int
+    flag_bits: int
+    mtime: float
+
+
+class OpenArchive:
+    """
+    Index of the members of an open archive and its file handle, closed once evicted and no longer read.
+    """
+    __slots__ = ("index", "handle", "readers", "evicted")
+
+    def __init__(self, index: Dict[str, ArchiveMember], handle: BinaryIO) -> None:
+        self.index = index
+        self.handle = handle
+        self.readers = 0
+        self.evicted = False
+
+
+class ZipArchiveSource(RepositorySource):
+    """
+    Repositories read straight from their zip archive, repositories_root/{owner}__{repository}-{revision}.zip
+    or the `archive` named by their datapoint, without extracting them.
+
+    The central directory of an archive is parsed once into an index of its members when the archive is
+    opened. Open archives, their handle and index, are kept in an LRU of `max_open_archives`; a member is
+    read with a positioned read at the offset its index entry records, and only that member is decompressed.
+    """
+
+    def __init__(self, max_open_archives: int = 32) -> None:
+        self.max_open_archives = max_open_archives
+        self._open_archives: OrderedDict[str, OpenArchive] = OrderedDict()
+        # archives being opened, the threads missing on them wait for the first one instead of opening them again
+        self._opening: Dict[str, threading.Event] = {}
+        # repository -> archive file name, registered from the datapoints
+        self._archives: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.archive_opens = 0
+        self.members_read = 0
+
+    def archive_path(self, repositories_root: str, repository: str, archive: Optional[str] = None) -> str:
+        if archive:
+            self._archives[repository] = archive
+        return os.path.join(repositories_root, self._archives.get(repository) or f"{repository}.zip")
+
+    @staticmethod
+    def _load(archive_path: str) -> OpenArchive:
+        handle = open(archive_path, 'rb')
+        try:
+            # ZipFile only parses the central directory here, and leaves the file it was given open
+            with zipfile.ZipFile(handle) as archive:
+                index = {
+                    info.filename: ArchiveMember(info.header_offset, info.compress_type, info.compress_size,
+                                                 info.file_size, info.CRC, info.flag_bits,
+                                                 time.mktime(info.date_time + (0, 0, -1)))
+                    for info in archive.infolist() if not info.is_dir()
+                }
+        except BaseException:
+            handle.close()
+            raise
+        return OpenArchive(index, handle)
+
+    def _acquire(self, archive_path: str) -> OpenArchive:
+        """
+        Open archive, opened on a miss, to be released once read.
+        """
+        while True:
+            with self._lock:
+                entry = self._open_archives.get(archive_path)
+                if entry is not None:
+                    self._open_archives.move_to_end(archive_path)
+                    entry.readers += 1
+                    return entry
+                opening = self._opening.get(archive_path)
+                if opening is None:
+                    opening = self._opening[archive_path] = threading.Event()
+                    break
+            # another thread opens it, retry once it is done, or open it here if it failed
+            opening.wait()
+        try:
+            entry = self._load(archive_path)
+            with self._lock:
+                self.archive_opens += 1
+                entry.readers += 1
+                self._open_archives[archive_path] = entry
+                while len(self._open_archives) > max(1, self.max_open_archives):
+                    _, evicted = self._open_archives.popitem(last=False)
+                    evicted.evicted = True
+                    if evicted.readers == 0:
+                        evicted.handle.close()
+            return entry
+        finally:
+            with self._lock:
+                del self._opening[archive_path]
+            opening.set()
+
+    def _release(self, entry: OpenArchive) -> None:
+        with self._lock:
+            entry.readers -= 1
+            if entry.evicted and entry.readers == 0:
+                entry.handle.close()
+
+    def read_bytes(self, archive_path: str, path: str) -> bytes:
+        entry = self._acquire(archive_path)
+        try:
+            return self._read_member(archive_path, entry, path)
+        finally:
+            self._release(entry)
+
+    def _read_member(self, archive_path: str, entry: OpenArchive, path: str) -> bytes:
+        member = entry.index.get(path)
+        if member is None:
+            raise FileNotFoundError(f"{path} is not in {archive_path}")
+        header = os.pread(entry.handle.fileno(), LOCAL_FILE_HEADER.size, member.header_offset)
+        fields = LOCAL_FILE_HEADER.unpack(header)
+        if fields[0] != LOCAL_FILE_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local file header of {path} in {archive_path}")
+        data_offset = member.header_offset + LOCAL_FILE_HEADER.size + fields[10] + fields[11]
+        if member.flag_bits & 0x1 or member.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2):
+            # encrypted or LZMA members go through zipfile
+            with zipfile.ZipFile(archive_path) as archive:
+                data = archive.read(path)
+        else:
+            raw = os.pread(entry.handle.fileno(), member.compress_size, data_offset)
+            if member.compress_type == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(raw, -zlib.MAX_WBITS)
+            elif member.compress_type == zipfile.ZIP_BZIP2:
+                data = bz2.decompress(raw)
+            else:
+                data = raw
+            if zlib.crc32(data) != member.crc:
+                raise zipfile.BadZipFile(f"Bad CRC-32 of {path} in {archive_path}")
+        with self._lock:
+            self.members_read += 1
+        return data
+
+    def list_files(self, repositories_root: str, repository: str, archive: Optional[str] = None) -> List[FileInfo]:
+        entry = self._acquire(self.archive_path(repositories_root, repository, archive))
+        try:
+            return [FileInfo(path, member.file_size, member.mtime) for path, member in entry.index.items()]
+        finally:
+            self._release(entry)
+
+    def read(self, repositories_root: str, repository: str, path: str, archive: Optional[str] = None) -> Tuple[str, int]:
+        data = self.read_bytes(self.archive_path(repositories_root, repository, archive), path)
+        return decode_text(data), len(data)
+
+    def statistics(self) -> Dict[str, float]:
+        return {
+            "archive_opens": self.archive_opens,
+            "archive_members_read": self.members_read,
+            "archives_open": len(self._open_archives),
+        }
+
+
+def create_repository_source(kind: str, mmap_threshold_bytes: int = 0, max_open_archives: int = 32) -> RepositorySource:
+    if kind == DIRECTORY:
+        return DirectorySource(mmap_threshold_bytes)
+    if kind == ZIP:
+        return ZipArchiveSource(max_open_archives)
+    raise ValueError(f"Unknown repository source {kind}, expected {DIRECTORY} or {ZIP}")
@@ -1,19 +1,33 @@
 from preprocessor import Preprocessor
-from configs.base import PreprocessorConfig, PostProcessorConfig
+from configs.base import PreprocessorConfig, PostProcessorConfig, RunnerConfig
 from configs.zoekt import QueryGeneratorConfig
 from datapoint import DataPoint, Prediction
 from zoekt_query_generator.query_generator import ZoektQueryGenerator
 from post_processor import PostProcessor
 from logging import getLogger
 import os
+import argparse
+import json
+import multiprocessing
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import AsyncResult
 import jsonlines
-from typing import List, Tuple, Dict, Any, Optional
+from typing import Deque, Iterable, Iterator, List, Tuple, Dict, Any, Optional
 from tqdm import tqdm
 from context_searcher import QueryPoint, ZoektSearchRequester
+from async_pipeline import AsyncPipeline
+from writer import PredictionWriter
+from shards import ids_file, shard_file, shard_of
+from instrumentation import DatapointProfiler, get_metrics, timed
+from baseline_strategies import BaselineEngine, STRATEGIES
 from configs.zoekt import SearchConfig
 
 logger = getLogger(__name__)
 
+# Runner owned by a pool worker process, built once by _init_worker
+_worker_runner: Optional["Runner"] = None
+
 
 class Runner:
     """
@@ -24,8 +38,14 @@ class Runner:
                  preprocessor_config: PreprocessorConfig,
                  query_generator_config: QueryGeneratorConfig,
                  search_config: SearchConfig,
-                 postprocessor_config: PostProcessorConfig) -> None:
+                 postprocessor_config: PostProcessorConfig,
+                 runner_config: Optional[RunnerConfig] = None,
+                 preload: bool = False) -> None:
         self.config: PreprocessorConfig = preprocessor_config
+        self.query_generator_config: QueryGeneratorConfig = query_generator_config
+        self.search_config: SearchConfig = search_config
+        self.postprocessor_config: PostProcessorConfig = postprocessor_config
+        self.runner_config: RunnerConfig = runner_config or RunnerConfig()
         self.preprocessor: Preprocessor = Preprocessor(preprocessor_config)
         self.query_generator: ZoektQueryGenerator = ZoektQueryGenerator(query_generator_config)
         self.search_requester: ZoektSearchRequester = ZoektSearchRequester(search_config)
@@ -38,17 +58,67 @@ class Runner:
             query_generator_config.queries_root, 
             f"{preprocessor_config.language}-{preprocessor_config.stage}-queries.jsonl"
         )
-        self.completion_points: List[DataPoint] = self.load_completion_points()
+        self.predictions_file: str = os.path.join(
+            preprocessor_config.predictions_root,
+            f"{preprocessor_config.language}-{preprocessor_config.stage}-predictions.jsonl"
+        )
+        self.writer: Optional[PredictionWriter] = None
+        self.num_shards: int = self.runner_config.num_shards
+        self.shard_index: int = self.runner_config.shard_index
+        if not 0 <= self.shard_index < self.num_shards:
+            raise ValueError(f"Shard index {self.shard_index} is out of range for {self.num_shards} shards")
+        if self.num_shards > 1:
+            # each shard writes its own outputs, merged afterwards by shards.py
+            self.predictions_file = shard_file(self.predictions_file, self.shard_index, self.num_shards)
+            self.query_saved_file = shard_file(self.query_saved_file, self.shard_index, self.num_shards)
+        self.metrics_file: str = os.path.splitext(self.predictions_file)[0] + ".metrics.json"
+        self.metrics = get_metrics()
+        # statistics of the pool workers, summed by the parent, and those a worker already sent to it
+        self.worker_statistics: Optional[Dict[str, float]] = None
+        self._sent_statistics: Dict[str, float] = {}
+        self.metrics.enabled = self.runner_config.metrics_enabled
+        self.profiler: DatapointProfiler = DatapointProfiler(
+            self.runner_config.profile_ids.split(","),
+            self.runner_config.profile_dir or os.path.join(preprocessor_config.predictions_root, "profiles"),
+        )
+        self.baseline_engine: Optional[BaselineEngine] = None
+        if self.runner_config.fallback_strategy:
+            if self.runner_config.fallback_strategy not in STRATEGIES:
+                raise ValueError(f"Unknown fallback strategy {self.runner_config.fallback_strategy}, expected one of {sorted(STRATEGIES)}")
+            # seeded so that the fallback contexts do not depend on the execution mode
+            # reads through the file content cache of the pipeline, from its repository source
+            self.baseline_engine = BaselineEngine(preprocessor_config.language, self.preprocessor.repositories_root,
+                                                  file_separator=postprocessor_config.file_separator, seed=0,
+                                                  repository_source=preprocessor_config.repository_source,
+                                                  file_cache_max_bytes=preprocessor_config.file_cache_max_bytes,
+                                                  max_open_archives=preprocessor_config.max_open_archives)
+        self.completion_points: List[DataPoint] = self.load_completion_points() if preload else []
     
-    def load_completion_points(self) -> List[DataPoint]:
+    def iter_completion_points(self) -> Iterator[DataPoint]:
         """
-        Load completion points from the JSONL file.
+        Parse and validate the completion points one at a time, as the JSONL file is read.
+        Only the completion points of this runner's shard are kept.
         """
-        completion_points: List[DataPoint] = []
         with jsonlines.open(self.completion_points_file, 'r') as reader:
             for datapoint_dict in reader:
-                completion_points.append(DataPoint(**datapoint_dict))
-        return completion_points
+                if self.num_shards > 1 and shard_of(datapoint_dict['id'], self.num_shards) != self.shard_index:
+                    continue
+                yield DataPoint(**datapoint_dict)
+
+    def load_completion_points(self) -> List[DataPoint]:
+        """
+        Load completion points from the JSONL file.
+        """
+        return list(self.iter_completion_points())
+
+    def count_completion_points(self) -> int:
+        """
+        Count the completion points without parsing them, for progress reporting.
+        """
+        with open(self.completion_points_file, 'rb') as f:
+            if self.num_shards > 1:
+                return sum(1 for line in f if line.strip() and shard_of(json.loads(line)['id'], self.num_shards) == self.shard_index)
+            return sum(1 for line in f if line.strip())
     
     def write_predictions(self, predictions: List[Prediction], output_file: str = "predictions.jsonl") -> None:
         """
@@ -59,18 +129,31 @@ class Runner:
                 writer.write(prediction.dict()) if isinstance(prediction, Prediction) else writer.write(prediction)
         logger.info(f"Predictions written to {output_file}")
 
-    def write_prediction_and_query_online(self, prediction: Prediction | dict, query: QueryPoint | dict) -> None:
+    def write_prediction_and_query_online(self, prediction: Prediction | dict, query: QueryPoint | dict, datapoint_id: Optional[str] = None) -> None:
         """
-        Write predictions and queries to a JSONL file.
+        Write predictions and queries to a JSONL file, through the open writer during run_all.
         """
-        predictions_output_file: str = os.path.join(
-            self.config.predictions_root, 
-            f"{self.config.language}-{self.config.stage}-predictions.jsonl"
-        )
-        with jsonlines.open(predictions_output_file, 'a') as writer:
+        if self.writer is not None:
+            self.writer.write(prediction, query, datapoint_id)
+            return
+        with jsonlines.open(self.predictions_file, 'a') as writer:
             writer.write(prediction.dict()) if isinstance(prediction, Prediction) else writer.write(prediction)
         with jsonlines.open(self.query_saved_file, 'a') as writer:
             writer.write(query.dict()) if isinstance(query, QueryPoint) else writer.write(query)
+
+    def open_writer(self, resume: bool = False) -> PredictionWriter:
+        """
+        Open the buffered writer of the predictions and queries files, resuming from its checkpoint if asked to.
+        """
+        self.writer = PredictionWriter(
+            self.predictions_file,
+            self.query_saved_file,
+            flush_every=self.runner_config.writer_flush_every,
+            flush_interval=self.runner_config.writer_flush_interval,
+            resume=resume,
+            ids_file=ids_file(self.predictions_file) if self.num_shards > 1 else None,
+        )
+        return self.writer
             
     def save_queries(self, queries: List[QueryPoint]) -> None:
         """
@@ -81,20 +164,25 @@ class Runner:
                 writer.write(query.dict())
         logger.info(f"Queries saved to {self.query_saved_file}")
 
+    @timed("preprocess")
     def preprocess(self, datapoint: DataPoint) -> DataPoint:
         """
         Run the preprocessor on the given datapoint.
         """
-        original_code: str = self.preprocessor.get_original_code(datapoint.dict())
-        incomplete_code: str = self.preprocessor.generate_incomplete_code(datapoint.dict())
-        diff: str = self.preprocessor.generate_diff(datapoint.dict())
-        completion_point: Tuple[int, int] = self.preprocessor.detect_completion_point(datapoint.dict())
+        datapoint_dict: Dict[str, Any] = datapoint.dict()
+        with self.metrics.timer("preprocess.read_file"):
+            original_code: str = self.preprocessor.get_original_code(datapoint_dict)
+        with self.metrics.timer("preprocess.diff"):
+            diff: str = self.preprocessor.generate_diff(datapoint_dict, original_code)
+        with self.metrics.timer("preprocess.completion_point"):
+            completion_point: Tuple[int, int] = self.preprocessor.detect_completion_point(datapoint_dict)
         
         # Update datapoint with computed values
         datapoint.completion_point = completion_point
         datapoint.diff = diff
         return datapoint
 
+    @timed("query_generation")
     def generate_queries(self, datapoint: DataPoint) -> Dict[str, str]:
         """
         Generate query candidates from the given datapoint.
@@ -102,64 +190,240 @@ class Runner:
         queries: Dict[str, str] = self.query_generator.construct_query_candidates_from_datapoint(datapoint)
         return queries
 
-    def run(self, datapoint: DataPoint) -> Tuple[QueryPoint, Prediction]:
+    def generate_query_point(self, processed_datapoint: DataPoint) -> QueryPoint:
         """
-        Run the complete pipeline on a single datapoint.
-        
-        Returns:
-            Tuple containing the generated query point and the prediction result
+        Generate the query point of a preprocessed datapoint.
         """
-        # Preprocess the datapoint
-        processed_datapoint: DataPoint = self.preprocess(datapoint)
-        
-        # Generate queries
         query_candidates: Dict[str, str] = self.generate_queries(processed_datapoint)
         # print(f"Generated queries: {query_candidates}")
         
         # Create query point
         query_point: QueryPoint = QueryPoint(candidates=query_candidates) if query_candidates else QueryPoint(candidates={})
         logger.debug(f"Generated query point: {query_point}")
+        return query_point
+
+    def prepare_query_point(self, datapoint: DataPoint) -> Tuple[DataPoint, QueryPoint]:
+        """
+        Run the CPU-bound stages (preprocessing and query generation) on a single datapoint.
+        """
+        # Preprocess the datapoint
+        processed_datapoint: DataPoint = self.preprocess(datapoint)
         
+        # Generate queries
+        query_point: QueryPoint = self.generate_query_point(processed_datapoint)
+        return processed_datapoint, query_point
+
+    def complete_query_point(self, processed_datapoint: DataPoint, query_point: QueryPoint) -> Tuple[QueryPoint, Prediction]:
+        """
+        Search the context of a prepared query point and post-process the results into a prediction.
+        """
         # Search for context
         search_results: Dict[str, Any] = self.search_requester.zoekt_search_on_query_point(query_point)
         
         # Post-process search results
-        prediction: Prediction = self.post_processor.postprocess(processed_datapoint, search_results)
+        prediction: Prediction = self.postprocess(processed_datapoint, search_results)
 
         return query_point, prediction
 
-    def run_all(self) -> None:
+    def postprocess(self, processed_datapoint: DataPoint, search_results: Dict[str, Any]) -> Prediction | dict:
         """
-        Run the complete pipeline on all completion points.
+        Post-process search results into a prediction, whose context falls back to the baseline strategy if empty.
         """
-        completion_points: List[DataPoint] = self.load_completion_points()
-        all_queries: List[QueryPoint] = []
-        all_predictions: List[Prediction] = []
-        
-        logger.info(f"Running pipeline on {len(completion_points)} completion points.")
+        prediction = self.post_processor.postprocess(processed_datapoint, search_results)
+        return self.with_fallback_context(processed_datapoint, prediction)
+
+    def with_fallback_context(self, datapoint: DataPoint, prediction: Prediction | dict) -> Prediction | dict:
+        """
+        Fill an empty context with the file picked by FALLBACK_STRATEGY, if set, cut to the context budget
+        left by the prefix and suffix of the prediction.
+        """
+        if self.baseline_engine is None:
+            return prediction
+        context = prediction.context if isinstance(prediction, Prediction) else prediction.get("context")
+        if context:
+            return prediction
+        strategy = self.runner_config.fallback_strategy
+        try:
+            with self.metrics.timer("fallback"):
+                selected = self.baseline_engine.read_selected_file(datapoint, strategy)
+                if selected is not None:
+                    if isinstance(prediction, Prediction):
+                        prefix, suffix = prediction.prefix, prediction.suffix
+                    else:
+                        prefix, suffix = prediction.get("prefix", ""), prediction.get("suffix", "")
+                    context = self.post_processor.fit_file_context(*selected, self.post_processor.context_budget(prefix, suffix))
+        except Exception as e:
+            logger.error(f"Error running the {strategy} fallback on datapoint {datapoint.id}: {e}")
+            return prediction
+        if context:
+            self.metrics.increment(f"fallback.{strategy}")
+            if isinstance(prediction, Prediction):
+                prediction.context = context
+            else:
+                prediction["context"] = context
+        return prediction
+
+    def run(self, datapoint: DataPoint) -> Tuple[QueryPoint, Prediction]:
+        """
+        Run the complete pipeline on a single datapoint.
         
-        for datapoint in tqdm(completion_points, desc="Processing datapoints"):
-            logger.info(f"Processing datapoint {datapoint.id} ")
+        Returns:
+            Tuple containing the generated query point and the prediction result
+        """
+        processed_datapoint, query_point = self.prepare_query_point(datapoint)
+        return self.complete_query_point(processed_datapoint, query_point)
+
+    def run_safely(self, datapoint: DataPoint) -> Tuple[QueryPoint, Prediction | dict]:
+        """
+        Run the pipeline on a single datapoint, falling back to an empty context on failure
+        so that the outputs stay aligned with the completion points.
+        """
+        processed_datapoint, query_point = self.prepare_query_point_safely(datapoint)
+        return self.complete_safely(datapoint, processed_datapoint, query_point)
+
+    def prepare_query_point_safely(self, datapoint: DataPoint) -> Tuple[DataPoint, Optional[QueryPoint]]:
+        """
+        Prepare the query point of a datapoint, or None if preprocessing failed.
+        """
+        logger.info(f"Processing datapoint {datapoint.id} ")
+        try:
+            with self.profiler.profile(datapoint.id, "prepare"):
+                return self.prepare_query_point(datapoint)
+        except Exception as e:
+            logger.error(f"Error processing datapoint {datapoint.id}: {e}")
+            return datapoint, None
+
+    def complete_safely(self,
+                        datapoint: DataPoint,
+                        processed_datapoint: DataPoint,
+                        query_point: Optional[QueryPoint]) -> Tuple[QueryPoint, Prediction | dict]:
+        """
+        Complete a prepared query point, falling back to an empty context if it failed at any stage.
+        """
+        if query_point is None:
+            return self.fallback_result(datapoint)
+        try:
+            with self.profiler.profile(datapoint.id, "complete"):
+                return self.complete_query_point(processed_datapoint, query_point)
+        except Exception as e:
+            logger.error(f"Error processing datapoint {datapoint.id}: {e}")
+            return self.fallback_result(datapoint)
+
+    def fallback_result(self, datapoint: DataPoint) -> Tuple[QueryPoint, Prediction]:
+        """
+        Results written for a failed datapoint to maintain alignment, with the context of FALLBACK_STRATEGY if set.
+        """
+        prediction = Prediction(context="", prefix=datapoint.prefix, suffix=datapoint.suffix)
+        return QueryPoint(candidates={}), self.with_fallback_context(datapoint, prediction)
+
+    def run_all(self, resume: bool = False) -> None:
+        """
+        Run the complete pipeline on all completion points, streamed from the JSONL file
+        so that memory does not grow with the size of the dataset.
+        With resume, the datapoints completed by an interrupted run are skipped and its outputs are kept.
+        """
+        num_completion_points: int = self.count_completion_points()
+        completion_points: Iterator[DataPoint] = self.iter_completion_points()
+
+        with self.open_writer(resume) as writer:
+            if writer.completed:
+                completion_points = self.skip_completed(completion_points, writer.completed, writer.last_id)
+            num_remaining: int = num_completion_points - writer.completed
+
+            logger.info(f"Running pipeline on {num_remaining} of {num_completion_points} completion points.")
+
             try:
-                query_point, prediction = self.run(datapoint)
-                all_queries.append(query_point)
-                all_predictions.append(prediction)
-                self.write_prediction_and_query_online(prediction, query_point)
-                
-            except Exception as e:
-                logger.error(f"Error processing datapoint {datapoint.id}: {e}")
-                # Add empty results for failed datapoints to maintain alignment
-                all_queries.append(QueryPoint(candidates={}))
-                all_predictions.append(Prediction())
-                self.write_prediction_and_query_online(Prediction(context="", prefix=datapoint.prefix, suffix=datapoint.suffix), QueryPoint(candidates={}))
-        
-        # # Save results
-        # self.save_queries(all_queries)
-        # predictions_output_file: str = os.path.join(
-        #     self.config.predictions_root, 
-        #     f"{self.config.language}-{self.config.stage}-predictions.jsonl"
-        # )
-        # self.write_predictions(all_predictions, output_file=predictions_output_file)
+                if self.runner_config.use_async_pipeline:
+                    pipeline: AsyncPipeline = AsyncPipeline(
+                        self,
+                        search_concurrency=self.runner_config.search_concurrency,
+                        queue_size=self.runner_config.pipeline_queue_size,
+                    )
+                    pipeline.run(tqdm(completion_points, total=num_remaining, desc="Processing datapoints"),
+                                 self.write_prediction_and_query_online)
+                    self.log_statistics()
+                    return
+
+                if self.runner_config.num_workers > 1:
+                    self.run_all_in_pool(completion_points, num_remaining)
+                    self.log_statistics()
+                    return
+
+                self.run_all_in_batches(completion_points, num_remaining)
+                self.log_statistics()
+            finally:
+                self.writer = None
+                self.write_metrics_report()
+                self.search_requester.candidate_statistics.save()
+
+    @staticmethod
+    def skip_completed(completion_points: Iterator[DataPoint], num_completed: int, last_id: Optional[str]) -> Iterator[DataPoint]:
+        """
+        Skip the datapoints completed by a previous run, checking that the last of them is the one its checkpoint recorded.
+        """
+        skipped: Optional[DataPoint] = None
+        for skipped in islice(completion_points, num_completed):
+            pass
+        if skipped is None or skipped.id != last_id:
+            raise ValueError(f"The completion points do not match the checkpoint: datapoint {num_completed} is "
+                             f"{skipped.id if skipped else 'missing'}, expected {last_id}")
+        return completion_points
+
+    def run_all_in_batches(self, completion_points: Iterable[DataPoint], total: Optional[int] = None) -> None:
+        """
+        Run the pipeline in-process, batch by batch: once a batch is preprocessed, the prefixes and suffixes
+        of all its datapoints are tokenized in a single call before they are searched and post-processed.
+        """
+        batch_size: int = max(1, self.runner_config.token_batch_size)
+        with tqdm(total=total, desc="Processing datapoints") as progress:
+            for batch in _batched(completion_points, batch_size):
+                prepared = [self.prepare_query_point_safely(datapoint) for datapoint in batch]
+                try:
+                    self.post_processor.count_prefix_and_suffix_tokens(
+                        [processed_datapoint for processed_datapoint, query_point in prepared if query_point is not None]
+                    )
+                except Exception as e:
+                    # counts are only cached ahead, postprocess still counts whatever is missing
+                    logger.warning(f"Could not count the prefix and suffix tokens of the batch: {e}")
+                for datapoint, (processed_datapoint, query_point) in zip(batch, prepared):
+                    query_point, prediction = self.complete_safely(datapoint, processed_datapoint, query_point)
+                    self.write_prediction_and_query_online(prediction, query_point, datapoint.id)
+                    progress.update()
+
+    def run_all_in_pool(self, completion_points: Iterable[DataPoint], total: Optional[int] = None) -> None:
+        """
+        Run the pipeline on a pool of worker processes, each holding its own warm Runner.
+        Chunks of datapoints are submitted within a bounded window, so that neither the datapoints read ahead
+        nor the results waiting to be written grow with the dataset. Results are written in input order
+        so that predictions stay aligned with the completion points.
+        """
+        num_workers: int = self.runner_config.num_workers
+        chunk_size: int = max(1, self.runner_config.worker_chunk_size)
+        max_pending_chunks: int = 2 * num_workers
+        logger.info(f"Starting pool of {num_workers} workers.")
+        self.worker_statistics = {}
+        initargs = (self.config, self.query_generator_config, self.search_config, self.postprocessor_config, self.runner_config)
+        with multiprocessing.Pool(processes=num_workers, initializer=_init_worker, initargs=initargs) as pool, \
+                tqdm(total=total, desc="Processing datapoints") as progress:
+            pending: Deque[Tuple[List[str], AsyncResult]] = deque()
+
+            def write_oldest_chunk() -> None:
+                datapoint_ids, chunk_result = pending.popleft()
+                results, metrics_delta, candidate_statistics_delta, statistics_delta = chunk_result.get()
+                self.metrics.merge(metrics_delta)
+                self.search_requester.candidate_statistics.merge(candidate_statistics_delta)
+                for name, value in statistics_delta.items():
+                    self.worker_statistics[name] = self.worker_statistics.get(name, 0) + value
+                for datapoint_id, (query_point, prediction) in zip(datapoint_ids, results):
+                    self.write_prediction_and_query_online(prediction, query_point, datapoint_id)
+                    progress.update()
+
+            for chunk in _batched(completion_points, chunk_size):
+                pending.append(([datapoint.id for datapoint in chunk], pool.apply_async(_run_chunk_in_worker, (chunk,))))
+                if len(pending) >= max_pending_chunks:
+                    write_oldest_chunk()
+            while pending:
+                write_oldest_chunk()
 
     def search_from_saved_queries(self) -> None:
         """
@@ -190,8 +454,106 @@ class Runner:
             except Exception as e:
                 logger.error(f"Error searching query point: {e}")
         
-        logger.info(f"Total successful searches: {self.search_requester.num_successful_searches}")
-        logger.info(f"Total failed searches: {self.search_requester.num_failed_searches}")
+        self.log_statistics()
+
+    def log_statistics(self) -> None:
+        """
+        Log the search counters and cache hit rates of the run.
+        """
+        statistics: Dict[str, float] = self.statistics()
+        logger.info(f"Total successful searches: {statistics['num_successful_searches']}")
+        logger.info(f"Total failed searches: {statistics['num_failed_searches']}")
+        if "cache_hit_rate" in statistics:
+            logger.info(f"Search cache: {statistics['cache_hits']} hits ({statistics['cache_disk_hits']} from disk), "
+                        f"{statistics['cache_misses']} misses, hit rate {statistics['cache_hit_rate']:.2%}")
+        logger.info(f"File cache: {statistics['file_cache_hits']} hits, {statistics['file_cache_misses']} misses, "
+                    f"hit rate {statistics['file_cache_hit_rate']:.2%}")
+        logger.info(f"Token count cache: {statistics['token_count_cache_hits']} hits, "
+                    f"{statistics['token_count_cache_misses']} misses, hit rate {statistics['token_count_cache_hit_rate']:.2%}")
+        for line in self.metrics.format_report():
+            logger.info(line)
+
+    def statistics(self) -> Dict[str, float]:
+        """
+        Search, file cache and token count cache statistics of the run: those of this process,
+        or the sum of those of the pool workers when it ran on a pool.
+        """
+        if self.worker_statistics is not None:
+            return _with_hit_rates(self.worker_statistics)
+        return {
+            **self.search_requester.search_statistics(),
+            **self.preprocessor.file_cache.statistics(),
+            **self.preprocessor.token_counts.statistics(),
+        }
+
+    def statistics_delta(self) -> Dict[str, float]:
+        """
+        Change of the statistics since the previous call, sent by pool workers to their parent.
+        Hit rates are left out, the parent computes them from the summed hits and misses.
+        """
+        statistics = self.statistics()
+        delta = {name: value - self._sent_statistics.get(name, 0) for name, value in statistics.items()
+                 if not name.endswith("_hit_rate")}
+        self._sent_statistics = statistics
+        return delta
+
+    def write_metrics_report(self) -> None:
+        """
+        Write the stage timers and counters of the run, with the cache statistics, next to the predictions.
+        """
+        if not self.metrics.enabled:
+            return
+        self.metrics.write_report(self.metrics_file, {
+            "statistics": self.statistics(),
+            "candidate_types": self.search_requester.candidate_statistics.summary(),
+        })
+        logger.info(f"Metrics report written to {self.metrics_file}")
+
+
+def _init_worker(preprocessor_config: PreprocessorConfig,
+                 query_generator_config: QueryGeneratorConfig,
+                 search_config: SearchConfig,
+                 postprocessor_config: PostProcessorConfig,
+                 runner_config: RunnerConfig) -> None:
+    """
+    Build the tokenizer, parsers and symbol extractors once per worker process.
+    """
+    global _worker_runner
+    _worker_runner = Runner(preprocessor_config, query_generator_config, search_config, postprocessor_config, runner_config, preload=False)
+
+
+def _run_chunk_in_worker(datapoints: List[DataPoint]) -> Tuple[List[Tuple[QueryPoint, Prediction | dict]], Dict[str, Any], Dict[str, Any], Dict[str, float]]:
+    """
+    Run the pipeline on a chunk of datapoints inside a pool worker.
+    Returns the results along with the metrics, candidate statistics and search and cache statistics recorded
+    since the previous chunk, merged by the parent.
+    """
+    results = [_worker_runner.run_safely(datapoint) for datapoint in datapoints]
+    return (results, _worker_runner.metrics.snapshot(reset=True), _worker_runner.search_requester.candidate_statistics.drain(),
+            _worker_runner.statistics_delta())
+
+
+def _with_hit_rates(statistics: Dict[str, float]) -> Dict[str, float]:
+    """
+    Statistics with the hit rate of every {name}_hits and {name}_misses pair.
+    """
+    with_rates: Dict[str, float] = {}
+    for name, value in statistics.items():
+        with_rates[name] = value
+        prefix = name[:-len("_misses")]
+        if name.endswith("_misses") and f"{prefix}_hits" in statistics:
+            lookups = statistics[f"{prefix}_hits"] + value
+            with_rates[f"{prefix}_hit_rate"] = statistics[f"{prefix}_hits"] / lookups if lookups else 0.0
+    return with_rates
+
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Split an iterable into lists of `size` items, the last one possibly shorter.
+    """
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 
 if __name__ == "__main__":
@@ -199,13 +561,31 @@ if __name__ == "__main__":
     from logging import basicConfig, INFO
     basicConfig(level=INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     logger = getLogger(__name__)
+    argparser = argparse.ArgumentParser(description="Run the Spare Code Context pipeline on all completion points.")
+    argparser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to NUM_WORKERS)")
+    argparser.add_argument("--async-pipeline", action="store_true", default=None, help="Overlap preprocessing and query generation with Zoekt searches")
+    argparser.add_argument("--search-concurrency", type=int, default=None, help="Number of concurrent searches in the async pipeline")
+    argparser.add_argument("--resume", action="store_true", help="Skip the datapoints completed by an interrupted run and append to its outputs")
+    argparser.add_argument("--num-shards", type=int, default=None, help="Split the completion points into this many shards, run separately then merged with shards.py")
+    argparser.add_argument("--shard-index", type=int, default=None, help="Shard processed by this run, from 0 to --num-shards - 1")
+    argparser.add_argument("--fallback-strategy", type=str, default=None, choices=sorted(STRATEGIES), help="Baseline strategy filling the contexts the search left empty")
+    args = argparser.parse_args()
     # Load the configuration
     config: PreprocessorConfig = PreprocessorConfig()
     query_generator_config: QueryGeneratorConfig = QueryGeneratorConfig()
     search_config: SearchConfig = SearchConfig()
     post_processor_config: PostProcessorConfig = PostProcessorConfig()
+    runner_overrides: Dict[str, Any] = {
+        "num_workers": args.workers,
+        "use_async_pipeline": args.async_pipeline,
+        "search_concurrency": args.search_concurrency,
+        "num_shards": args.num_shards,
+        "shard_index": args.shard_index,
+        "fallback_strategy": args.fallback_strategy,
+    }
+    runner_config: RunnerConfig = RunnerConfig(**{k: v for k, v in runner_overrides.items() if v is not None})
     
     # Create a runner instance and run it
-    runner: Runner = Runner(config, query_generator_config, search_config, post_processor_config)
-    runner.run_all()
+    runner: Runner = Runner(config, query_generator_config, search_config, post_processor_config, runner_config)
+    runner.run_all(resume=args.resume)
     # Alternative: runner.search_from_saved_queries()
\ No newline at end of file
@@ -0,0 +1,150 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+CACHE_FILE_NAME = "zoekt-search-cache.sqlite"
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a Zoekt query so that equivalent spellings share a cache entry.
+    Whitespace is collapsed, except in queries containing quoted strings where it is significant.
+    """
+    if '"' in query:
+        return query.strip()
+    return " ".join(query.split())
+
+
+def index_fingerprint(index_dir: str) -> str:
+    """
+    Identify the set of Zoekt shards in the index directory by their names, sizes and modification times.
+    """
+    shards = []
+    for shard_path in sorted(glob.glob(os.path.join(index_dir, "*.zoekt"))):
+        stat = os.stat(shard_path)
+        shards.append(f"{os.path.basename(shard_path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1("\n".join(shards).encode("utf-8")).hexdigest()
+
+
+class SearchResultCache:
+    """
+    Two-tier cache of Zoekt search results: an in-memory LRU backed by an optional on-disk SQLite store.
+
+    Entries are keyed by the normalized query and the search options, within a namespace identifying
+    the index (shard fingerprint or explicit version) so that re-indexing invalidates them. The on-disk
+    store is shared by the runs on every index: entries of other namespaces are left alone, and entries
+    are evicted once unused for `max_age_seconds` or, least recently used first, beyond `max_disk_entries`.
+    """
+
+    def __init__(self,
+                 max_entries: int,
+                 cache_dir: Optional[str] = None,
+                 namespace: str = "",
+                 max_age_seconds: float = 0.0,
+                 max_disk_entries: int = 0) -> None:
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.max_age_seconds = max_age_seconds
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        if cache_dir:
+            self._connection = self._open_disk_store(cache_dir)
+
+    def _open_disk_store(self, cache_dir: str) -> sqlite3.Connection:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_file = os.path.join(cache_dir, CACHE_FILE_NAME)
+        connection = sqlite3.connect(cache_file, timeout=30, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, namespace TEXT, result TEXT, accessed_at REAL NOT NULL DEFAULT 0)")
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(results)")]
+        if "accessed_at" not in columns:
+            # store written before entries were aged, its entries are the first evicted
+            connection.execute("ALTER TABLE results ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+        self._evict(connection)
+        logger.info(f"Using on-disk search cache {cache_file}")
+        return connection
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        """
+        Delete the entries unused for max_age_seconds, then the least recently used ones beyond max_disk_entries.
+        """
+        deleted = 0
+        if self.max_age_seconds > 0:
+            deleted += connection.execute("DELETE FROM results WHERE accessed_at < ?",
+                                          (time.time() - self.max_age_seconds,)).rowcount
+        if self.max_disk_entries > 0:
+            deleted += connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)).rowcount
+        if deleted:
+            logger.info(f"Evicted {deleted} cached search results.")
+
+    def key(self, query: str, num_context_lines: int, max_results: int) -> str:
+        raw = json.dumps([self.namespace, normalize_query(query), num_context_lines, max_results])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return result
+            if self._connection is not None:
+                row = self._connection.execute("SELECT result FROM results WHERE key = ? AND namespace = ?",
+                                               (key, self.namespace)).fetchone()
+                if row is not None:
+                    self._connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    result = json.loads(row[0])
+                    self._put_in_memory(key, result)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: dict) -> None:
+        with self._lock:
+            self._put_in_memory(key, result)
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO results (key, namespace, result, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, self.namespace, json.dumps(result), time.time()),
+                )
+
+    def _put_in_memory(self, key: str, result: dict) -> None:
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def statistics(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "cache_hits": self.hits,
+            "cache_disk_hits": self.disk_hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple
+from logging import getLogger
+
+from pydantic import ValidationError
+
+from configs.base import PreprocessorConfig, PostProcessorConfig, ServiceConfig
+from configs.zoekt import QueryGeneratorConfig, SearchConfig
+from datapoint import DataPoint, Prediction, QueryPoint
+from runner import Runner
+
+logger = getLogger(__name__)
+
+
+class ContextService:
+    """
+    Resident context retrieval service.
+
+    Keeps a Runner (tokenizer, parsers, symbol extractors, Zoekt session and caches) warm between requests.
+    Preprocessing, query generation and post-processing share parsers and tokenizer, so they run one request
+    at a time; the Zoekt searches of concurrent requests overlap.
+    """
+
+    def __init__(self, runner: Runner) -> None:
+        self.runner = runner
+        self._cpu_lock = threading.Lock()
+
+    def complete(self, datapoint: DataPoint) -> Tuple[QueryPoint, Prediction | dict, Dict[str, float]]:
+        """
+        Run the pipeline on a single datapoint, timing each stage in milliseconds.
+        """
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        with self._cpu_lock:
+            locked = time.perf_counter()
+            processed_datapoint = self.runner.preprocess(datapoint)
+            preprocessed = time.perf_counter()
+            query_point = self.runner.generate_query_point(processed_datapoint)
+        generated = time.perf_counter()
+        search_results = self.runner.search_requester.zoekt_search_on_query_point(query_point)
+        searched = time.perf_counter()
+        with self._cpu_lock:
+            relocked = time.perf_counter()
+            prediction = self.runner.postprocess(processed_datapoint, search_results)
+        end = time.perf_counter()
+        timings["queue"] = (locked - start + relocked - searched) * 1000
+        timings["preprocess"] = (preprocessed - locked) * 1000
+        timings["query_generation"] = (generated - preprocessed) * 1000
+        timings["search"] = (searched - generated) * 1000
+        timings["postprocess"] = (end - relocked) * 1000
+        timings["total"] = (end - start) * 1000
+        return query_point, prediction, timings
+
+    def complete_safely(self, datapoint: DataPoint) -> Dict[str, Any]:
+        """
+        Response body of a datapoint, with an empty context and the error if the pipeline failed.
+        """
+        try:
+            query_point, prediction, timings = self.complete(datapoint)
+        except Exception as e:
+            logger.error(f"Error processing datapoint {datapoint.id}: {e}")
+            query_point, prediction = self.runner.fallback_result(datapoint)
+            return {"prediction": prediction.dict(), "queries": query_point.dict(), "error": str(e)}
+        if isinstance(prediction, Prediction):
+            prediction = prediction.dict()
+        return {"prediction": prediction, "queries": query_point.dict(),
+                "timings_ms": {name: round(value, 3) for name, value in timings.items()}}
+
+
+class ContextRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /complete with a DataPoint JSON body returns its prediction, queries and per-stage timings.
+    GET /health returns the search statistics once the service is up.
+    """
+    # keep-alive connections, every response has a Content-Length
+    protocol_version = "HTTP/1.1"
+    server_version = "SpareCodeContext"
+
+    def setup(self) -> None:
+        # headers and body are written separately, Nagle's algorithm would delay the body until the client's ACK
+        self.disable_nagle_algorithm = isinstance(self.server, ContextHTTPServer)
+        super().setup()
+
+    @property
+    def service(self) -> ContextService:
+        return self.server.service
+
+    def address_string(self) -> str:
+        # Unix socket clients have no host
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def send_json(self, status: int, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self.send_json(200, {"status": "ok", **self.service.runner.search_requester.search_statistics()})
+
+    def do_POST(self) -> None:
+        if self.path != "/complete":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.server.max_request_bytes:
+            self.close_connection = True
+            self.send_json(413, {"error": f"Request body of {length} bytes exceeds {self.server.max_request_bytes} bytes"})
+            return
+        try:
+            datapoint = DataPoint(**json.loads(self.rfile.read(length)))
+        except (ValueError, TypeError, ValidationError) as e:
+            self.send_json(400, {"error": f"Invalid datapoint: {e}"})
+            return
+        self.send_json(200, self.service.complete_safely(datapoint))
+
+
+class ContextHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: ContextService, max_request_bytes: int) -> None:
+        self.service = service
+        self.max_request_bytes = max_request_bytes
+        super().__init__(address, ContextRequestHandler)
+
+
+class ContextUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, service: ContextService, max_request_bytes: int) -> None:
+        self.service = service
+        self.max_request_bytes = max_request_bytes
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, ContextRequestHandler)
+
+
+def create_server(runner: Runner, config: ServiceConfig) -> socketserver.BaseServer:
+    """
+    Server of the context service, on config.unix_socket if set, otherwise on config.host and config.port.
+    """
+    service = ContextService(runner)
+    if config.unix_socket:
+        return ContextUnixServer(config.unix_socket, service, config.max_request_bytes)
+    return ContextHTTPServer((config.host, config.port), service, config.max_request_bytes)
+
+
+def main() -> None:
+    config: ServiceConfig = ServiceConfig()
+    argparser = argparse.ArgumentParser(description="Serve context retrieval for single datapoints over HTTP, keeping the pipeline warm.")
+    argparser.add_argument("--host", type=str, default=config.host)
+    argparser.add_argument("--port", type=int, default=config.port)
+    argparser.add_argument("--unix-socket", type=str, default=config.unix_socket, help="Listen on this Unix socket instead of --host and --port")
+    args = argparser.parse_args()
+    config = ServiceConfig(host=args.host, port=args.port, unix_socket=args.unix_socket)
+
+    runner: Runner = Runner(PreprocessorConfig(), QueryGeneratorConfig(), SearchConfig(), PostProcessorConfig())
+    server = create_server(runner, config)
+    logger.info(f"Serving context on {config.unix_socket or f'http://{config.host}:{config.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        runner.search_requester.close()
+        if config.unix_socket and os.path.exists(config.unix_socket):
+            os.remove(config.unix_socket)
+
+
+if __name__ == "__main__":
+    from logging import basicConfig, INFO
+    basicConfig(level=INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import hashlib
+import json
+import os
+from typing import Dict, Iterator, List
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+def shard_of(datapoint_id: str, num_shards: int) -> int:
+    """
+    Stable shard assignment of a datapoint, independent of the machine and of the order of the dataset.
+    """
+    return int(hashlib.sha1(datapoint_id.encode("utf-8")).hexdigest(), 16) % num_shards
+
+
+def shard_file(path: str, shard_index: int, num_shards: int) -> str:
+    """
+    Output file of a shard: {name}.shard-{index}-of-{num_shards}{extension}.
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.shard-{shard_index}-of-{num_shards}{extension}"
+
+
+def ids_file(predictions_file: str) -> str:
+    """
+    Sidecar file listing the ids of the datapoints of a shard's predictions file, line by line.
+    """
+    return os.path.splitext(predictions_file)[0] + ".ids"
+
+
+def iter_datapoint_ids(completion_points_file: str) -> Iterator[str]:
+    with open(completion_points_file, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)["id"]
+
+
+def _count_lines(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def merge_shards(completion_points_file: str,
+                 predictions_file: str,
+                 queries_file: str,
+                 num_shards: int) -> int:
+    """
+    Reassemble the predictions and queries files of all shards in the order of the completion points.
+
+    Raises a ValueError, without writing anything, if a datapoint is missing, duplicated, unknown or
+    in the wrong shard, or if the outputs of a shard are not aligned with its ids.
+    Returns the number of merged datapoints.
+    """
+    shard_ids: List[List[str]] = []
+    location: Dict[str, int] = {}
+    errors: List[str] = []
+    for shard_index in range(num_shards):
+        shard_predictions_file = shard_file(predictions_file, shard_index, num_shards)
+        shard_queries_file = shard_file(queries_file, shard_index, num_shards)
+        with open(ids_file(shard_predictions_file), "r") as f:
+            ids = [line.rstrip("\n") for line in f]
+        shard_ids.append(ids)
+        for datapoint_id in ids:
+            if datapoint_id in location:
+                errors.append(f"datapoint {datapoint_id} is duplicated (shards {location[datapoint_id]} and {shard_index})")
+                continue
+            if shard_of(datapoint_id, num_shards) != shard_index:
+                errors.append(f"datapoint {datapoint_id} found in shard {shard_index}, "
+                              f"but assigned to shard {shard_of(datapoint_id, num_shards)}")
+            location[datapoint_id] = shard_index
+        for path in (shard_predictions_file, shard_queries_file):
+            num_lines = _count_lines(path)
+            if num_lines != len(ids):
+                errors.append(f"{path} has {num_lines} lines for {len(ids)} ids")
+
+    seen = set()
+    missing = 0
+    for datapoint_id in iter_datapoint_ids(completion_points_file):
+        if datapoint_id in seen:
+            errors.append(f"datapoint {datapoint_id} appears twice in {completion_points_file}")
+        seen.add(datapoint_id)
+        if datapoint_id not in location:
+            missing += 1
+            if missing <= 10:
+                errors.append(f"datapoint {datapoint_id} is missing from the shards")
+    if missing > 10:
+        errors.append(f"... {missing} datapoints missing in total")
+    unknown = [datapoint_id for datapoint_id in location if datapoint_id not in seen]
+    if unknown:
+        errors.append(f"{len(unknown)} datapoints of the shards are not in {completion_points_file}: {unknown[:10]}")
+    if errors:
+        raise ValueError("Cannot merge the shards:\n" + "\n".join(errors))
+
+    # the shards keep the order of the completion points, so the merge is a single streaming pass
+    predictions_fps = [open(shard_file(predictions_file, index, num_shards), "rb") for index in range(num_shards)]
+    queries_fps = [open(shard_file(queries_file, index, num_shards), "rb") for index in range(num_shards)]
+    positions = [0] * num_shards
+    merged = 0
+    try:
+        with open(predictions_file + ".tmp", "wb") as predictions_out, open(queries_file + ".tmp", "wb") as queries_out:
+            for datapoint_id in iter_datapoint_ids(completion_points_file):
+                shard_index = location[datapoint_id]
+                if shard_ids[shard_index][positions[shard_index]] != datapoint_id:
+                    raise ValueError(f"Shard {shard_index} is not in the order of the completion points at datapoint {datapoint_id}")
+                positions[shard_index] += 1
+                predictions_out.write(next(predictions_fps[shard_index]))
+                queries_out.write(next(queries_fps[shard_index]))
+                merged += 1
+    except BaseException:
+        for path in (predictions_file + ".tmp", queries_file + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        for fp in predictions_fps + queries_fps:
+            fp.close()
+    os.replace(predictions_file + ".tmp", predictions_file)
+    os.replace(queries_file + ".tmp", queries_file)
+    return merged
+
+
+def main() -> None:
+    from configs.base import PreprocessorConfig
+    from configs.zoekt import QueryGeneratorConfig
+
+    config = PreprocessorConfig()
+    argparser = argparse.ArgumentParser(description="Merge the outputs of runner.py --num-shards into the predictions and queries files of the stage.")
+    argparser.add_argument("--num-shards", type=int, required=True)
+    argparser.add_argument("--language", type=str, default=config.language)
+    argparser.add_argument("--stage", type=str, default=config.stage)
+    argparser.add_argument("--data-root", type=str, default=config.data_root)
+    argparser.add_argument("--predictions-root", type=str, default=config.predictions_root)
+    argparser.add_argument("--queries-root", type=str, default=QueryGeneratorConfig().queries_root)
+    args = argparser.parse_args()
+
+    merged = merge_shards(
+        os.path.join(args.data_root, f"{args.language}-{args.stage}.jsonl"),
+        os.path.join(args.predictions_root, f"{args.language}-{args.stage}-predictions.jsonl"),
+        os.path.join(args.queries_root, f"{args.language}-{args.stage}-queries.jsonl"),
+        args.num_shards,
+    )
+    logger.info(f"Merged {merged} datapoints from {args.num_shards} shards.")
+
+
+if __name__ == "__main__":
+    from logging import basicConfig, INFO
+    basicConfig(level=INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
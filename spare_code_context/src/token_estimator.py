@@ -0,0 +1,303 @@
+import argparse
+import json
+import math
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Type
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger(__name__)
+
+# Byte classes of the byte-class estimator
+LOWER, UPPER, DIGIT, SPACE, NEWLINE, PUNCTUATION, NON_ASCII = range(7)
+NUM_BYTE_CLASSES = 7
+
+
+def _build_byte_class_table() -> np.ndarray:
+    table = np.full(256, PUNCTUATION, dtype=np.int64)
+    table[ord("a"):ord("z") + 1] = LOWER
+    table[ord("_")] = LOWER
+    table[ord("A"):ord("Z") + 1] = UPPER
+    table[ord("0"):ord("9") + 1] = DIGIT
+    for char in " \t\x0b\x0c":
+        table[ord(char)] = SPACE
+    for char in "\n\r":
+        table[ord(char)] = NEWLINE
+    table[0x80:] = NON_ASCII
+    return table
+
+
+BYTE_CLASS_TABLE = _build_byte_class_table()
+
+# Uncalibrated coefficients, deliberately on the high side for code BPE vocabularies:
+# per byte of each class, then per run of consecutive bytes of the same class
+DEFAULT_BYTE_CLASS_MODEL = {
+    "byte_coefficients": [0.12, 0.2, 0.34, 0.0, 0.0, 0.9, 0.5],
+    "run_coefficients": [0.8, 0.5, 0.6, 0.5, 0.6, 0.1, 0.3],
+    "intercept": 1.0,
+    "scale": 1.0,
+}
+
+
+class TokenEstimator:
+    """
+    Base class of the token count estimators used in place of a tokenizer.
+    """
+    name = ""
+
+    def __init__(self, language: str) -> None:
+        self.language = language
+
+    def estimate(self, text: str) -> int:
+        raise NotImplementedError
+
+    def estimate_batch(self, texts: List[str]) -> List[int]:
+        return [self.estimate(text) for text in texts]
+
+    def estimate_lines(self, header: str, content_lines: List[str]) -> Tuple[int, np.ndarray]:
+        """
+        Estimate the tokens of the header and of each content line of header + content.
+        """
+        return self.estimate(header), np.array([self.estimate(line) for line in content_lines], dtype=np.int64)
+
+
+_token_estimators: Dict[str, Type[TokenEstimator]] = {}
+
+
+def register_token_estimator(name: str) -> Callable[[Type[TokenEstimator]], Type[TokenEstimator]]:
+    """
+    Register a token estimator class under the given name.
+    """
+    def register(estimator_class: Type[TokenEstimator]) -> Type[TokenEstimator]:
+        estimator_class.name = name
+        _token_estimators[name] = estimator_class
+        return estimator_class
+    return register
+
+
+def create_token_estimator(name: str, language: str, model_path: Optional[str] = None) -> TokenEstimator:
+    """
+    Create the token estimator registered under the given name.
+    """
+    if name not in _token_estimators:
+        raise ValueError(f"Unknown token estimator {name}, available: {sorted(_token_estimators)}")
+    if name == ByteClassTokenEstimator.name:
+        return ByteClassTokenEstimator.from_model_file(language, model_path)
+    return _token_estimators[name](language)
+
+
+@register_token_estimator("none")
+class ZeroTokenEstimator(TokenEstimator):
+    """
+    Counts every text as 0 tokens, which disables the token budget.
+    """
+    def estimate(self, text: str) -> int:
+        return 0
+
+
+@register_token_estimator("byte_class")
+class ByteClassTokenEstimator(TokenEstimator):
+    """
+    Linear model of the token count on the UTF-8 bytes of a text: a coefficient per byte of each class
+    (letters, digits, whitespace, punctuation...) and per run of consecutive bytes of the same class,
+    multiplied by a safety scale calibrated against the real tokenizer.
+    """
+
+    def __init__(self,
+                 language: str,
+                 byte_coefficients: List[float] = DEFAULT_BYTE_CLASS_MODEL["byte_coefficients"],
+                 run_coefficients: List[float] = DEFAULT_BYTE_CLASS_MODEL["run_coefficients"],
+                 intercept: float = DEFAULT_BYTE_CLASS_MODEL["intercept"],
+                 scale: float = DEFAULT_BYTE_CLASS_MODEL["scale"],
+                 **_) -> None:
+        super().__init__(language)
+        self.coefficients = np.array(list(byte_coefficients) + list(run_coefficients), dtype=np.float64) * scale
+        self.intercept = intercept * scale
+        self.scale = scale
+
+    @classmethod
+    def from_model_file(cls, language: str, model_path: Optional[str] = None) -> "ByteClassTokenEstimator":
+        """
+        Load the calibrated model of the language, or the default one if there is none.
+        """
+        if model_path and os.path.exists(model_path):
+            with open(model_path, "r") as f:
+                models = json.load(f)
+            if language in models:
+                return cls(language, **models[language])
+            logger.warning(f"No calibrated token estimator for {language} in {model_path}, using the default one.")
+        elif model_path:
+            logger.warning(f"Token estimator model {model_path} not found, using the default one.")
+        return cls(language)
+
+    @staticmethod
+    def features(data: bytes) -> np.ndarray:
+        """
+        Number of bytes and of runs of each byte class.
+        """
+        if not data:
+            return np.zeros(2 * NUM_BYTE_CLASSES, dtype=np.float64)
+        classes = BYTE_CLASS_TABLE[np.frombuffer(data, dtype=np.uint8)]
+        run_starts = np.empty(len(classes), dtype=bool)
+        run_starts[0] = True
+        np.not_equal(classes[1:], classes[:-1], out=run_starts[1:])
+        return np.concatenate([
+            np.bincount(classes, minlength=NUM_BYTE_CLASSES),
+            np.bincount(classes[run_starts], minlength=NUM_BYTE_CLASSES),
+        ]).astype(np.float64)
+
+    def raw_estimate(self, features: np.ndarray) -> float:
+        return max(0.0, float(features @ self.coefficients) + self.intercept)
+
+    def estimate(self, text: str) -> int:
+        return math.ceil(self.raw_estimate(self.features(text.encode("utf-8", "surrogatepass"))))
+
+    def estimate_lines(self, header: str, content_lines: List[str]) -> Tuple[int, np.ndarray]:
+        """
+        Estimate each content line in a single pass over the content, runs being attributed to the line they start on.
+        """
+        num_lines = len(content_lines)
+        if not num_lines:
+            return self.estimate(header), np.zeros(0, dtype=np.int64)
+        encoded_lines = [line.encode("utf-8", "surrogatepass") for line in content_lines]
+        line_lengths = np.fromiter(map(len, encoded_lines), dtype=np.int64, count=num_lines)
+        classes = BYTE_CLASS_TABLE[np.frombuffer(b"".join(encoded_lines), dtype=np.uint8)]
+        run_starts = np.empty(len(classes), dtype=bool)
+        run_starts[0] = True
+        np.not_equal(classes[1:], classes[:-1], out=run_starts[1:])
+        line_of_byte = np.repeat(np.arange(num_lines), line_lengths)
+        bins = line_of_byte * NUM_BYTE_CLASSES + classes
+        byte_counts = np.bincount(bins, minlength=num_lines * NUM_BYTE_CLASSES).reshape(num_lines, NUM_BYTE_CLASSES)
+        run_counts = np.bincount(bins[run_starts], minlength=num_lines * NUM_BYTE_CLASSES).reshape(num_lines, NUM_BYTE_CLASSES)
+        line_estimates = byte_counts @ self.coefficients[:NUM_BYTE_CLASSES] + run_counts @ self.coefficients[NUM_BYTE_CLASSES:]
+        return self.estimate(header), np.ceil(np.maximum(line_estimates, 0.0)).astype(np.int64)
+
+
+def sample_calibration_texts(data_root: str, language: str, stage: str, limit: Optional[int], seed: int = 0) -> List[str]:
+    """
+    Texts shaped like the ones counted by the pipeline: prefix + suffix of the completion points,
+    whole repository files and windows of consecutive lines of those files.
+    """
+    import jsonlines
+    from preprocessor import Preprocessor
+
+    rng = random.Random(seed)
+    repositories_root = os.path.join(data_root, f"repositories-{language}-{stage}")
+    texts = []
+    with jsonlines.open(os.path.join(data_root, f"{language}-{stage}.jsonl"), "r") as reader:
+        for index, datapoint in enumerate(reader):
+            if limit is not None and index >= limit:
+                break
+            texts.append(datapoint["prefix"] + datapoint["suffix"])
+            try:
+                with open(os.path.join(repositories_root, Preprocessor.get_repository_revision(datapoint), datapoint["path"]), "r") as f:
+                    lines = f.read().splitlines()
+            except (OSError, UnicodeDecodeError):
+                continue
+            texts.append("\n".join(lines))
+            for window in (10, 50, 200):
+                start = rng.randrange(max(1, len(lines) - window + 1))
+                texts.append("\n".join(lines[start:start + window]))
+    return [text for text in texts if text]
+
+
+def calibrate(texts: List[str], true_counts: np.ndarray, max_underestimate: float) -> Dict[str, float]:
+    """
+    Fit the byte-class coefficients by weighted least squares, then the scale making every calibration
+    estimate at least (1 - max_underestimate) times the true count.
+    """
+    features = np.stack([ByteClassTokenEstimator.features(text.encode("utf-8", "surrogatepass")) for text in texts])
+    design = np.hstack([features, np.ones((len(texts), 1))])
+    # weighted by the inverse of the true count, so that the relative errors are minimized
+    weights = 1.0 / np.maximum(true_counts, 1.0)
+    solution, *_ = np.linalg.lstsq(design * weights[:, None], true_counts * weights, rcond=None)
+    raw_estimates = np.maximum(design @ solution, 1e-9)
+    scale = float(np.max((1.0 - max_underestimate) * true_counts / raw_estimates))
+    return {
+        "byte_coefficients": solution[:NUM_BYTE_CLASSES].tolist(),
+        "run_coefficients": solution[NUM_BYTE_CLASSES:2 * NUM_BYTE_CLASSES].tolist(),
+        "intercept": float(solution[-1]),
+        "scale": scale,
+        "max_underestimate": max_underestimate,
+        "num_samples": len(texts),
+    }
+
+
+def describe_errors(estimator: TokenEstimator, texts: List[str], true_counts: np.ndarray) -> str:
+    """
+    Distribution of the relative error (estimate - true) / true of the estimator on the texts.
+    """
+    estimates = np.array(estimator.estimate_batch(texts), dtype=np.float64)
+    relative_errors = (estimates - true_counts) / np.maximum(true_counts, 1)
+    percentiles = np.percentile(relative_errors, [0, 1, 5, 50, 95, 99, 100])
+    underestimated = relative_errors < 0
+    return (f"relative error min {percentiles[0]:+.3f}  p1 {percentiles[1]:+.3f}  p5 {percentiles[2]:+.3f}  "
+            f"p50 {percentiles[3]:+.3f}  p95 {percentiles[4]:+.3f}  p99 {percentiles[5]:+.3f}  max {percentiles[6]:+.3f}\n"
+            f"underestimated {underestimated.sum()}/{len(texts)} texts, by at most {-min(0.0, percentiles[0]):.3%}; "
+            f"total tokens estimated {estimates.sum():.0f} for {true_counts.sum():.0f}")
+
+
+def main() -> None:
+    from configs.base import PreprocessorConfig
+    from tokenizer_loader import load_tokenizer
+    from utils import count_tokens_in_batch, get_tokenizer_name_from_model
+
+    config = PreprocessorConfig()
+    argparser = argparse.ArgumentParser(description="Calibrate the byte-class token estimator against a tokenizer and report its error distribution.")
+    argparser.add_argument("--data-root", type=str, default=config.data_root)
+    argparser.add_argument("--language", type=str, default=config.language)
+    argparser.add_argument("--stage", type=str, default=config.stage)
+    argparser.add_argument("--tokenizer", type=str, default=None, help="Tokenizer name, defaults to the one of EVAL_MODEL_NAME")
+    argparser.add_argument("--tokenizer-path", type=str, default=config.tokenizer_path, help="Exported tokenizer directory, loaded instead of the tokenizer name")
+    argparser.add_argument("--max-underestimate", type=float, default=0.0, help="Largest relative underestimation allowed on the calibration texts")
+    argparser.add_argument("--limit", type=int, default=None, help="Number of completion points to sample texts from")
+    argparser.add_argument("--output", type=str, default=config.token_estimator_path, help="Model file in which the language entry is written")
+    argparser.add_argument("--evaluate-only", action="store_true", help="Only report the errors of the model currently in --output")
+    args = argparser.parse_args()
+
+    tokenizer = load_tokenizer(args.tokenizer or get_tokenizer_name_from_model(config.model_name, args.language), args.tokenizer_path)
+    texts = sample_calibration_texts(args.data_root, args.language, args.stage, args.limit)
+    start = time.perf_counter()
+    true_counts = np.array(count_tokens_in_batch(texts, tokenizer), dtype=np.float64)
+    tokenizer_seconds = time.perf_counter() - start
+    print(f"{len(texts)} calibration texts, {true_counts.sum():.0f} tokens")
+
+    if args.evaluate_only:
+        estimator = ByteClassTokenEstimator.from_model_file(args.language, args.output)
+    else:
+        # fit on a part of the texts and report the errors on the held-out ones as well
+        indices = list(range(len(texts)))
+        random.Random(0).shuffle(indices)
+        held_out = set(indices[:len(indices) // 5])
+        fit_indices = [index for index in range(len(texts)) if index not in held_out]
+        held_out_indices = sorted(held_out)
+        model = calibrate([texts[i] for i in fit_indices], true_counts[fit_indices], args.max_underestimate)
+        if held_out_indices:
+            print("held-out texts:")
+            print(describe_errors(ByteClassTokenEstimator(args.language, **model),
+                                  [texts[i] for i in held_out_indices], true_counts[held_out_indices]))
+        model = calibrate(texts, true_counts, args.max_underestimate)
+        estimator = ByteClassTokenEstimator(args.language, **model)
+        if args.output:
+            models = {}
+            if os.path.exists(args.output):
+                with open(args.output, "r") as f:
+                    models = json.load(f)
+            models[args.language] = model
+            with open(args.output, "w") as f:
+                json.dump(models, f, indent=2)
+            print(f"Model of {args.language} written to {args.output}")
+
+    print("all texts:")
+    print(describe_errors(estimator, texts, true_counts))
+    start = time.perf_counter()
+    estimator.estimate_batch(texts)
+    estimator_seconds = time.perf_counter() - start
+    print(f"tokenizer {tokenizer_seconds:.3f}s, estimator {estimator_seconds:.3f}s ({tokenizer_seconds / max(estimator_seconds, 1e-9):.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import os
+import time
+from typing import Any, Dict, List, Optional
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+TOKENIZER_FILE_NAME = "tokenizer.json"
+
+
+class LocalFastTokenizer:
+    """
+    Fast tokenizer loaded straight from an exported tokenizer.json with the `tokenizers` library,
+    without importing transformers nor resolving anything on the hub.
+
+    Implements the part of the transformers tokenizer interface used by the pipeline.
+    """
+    is_fast = True
+
+    def __init__(self, tokenizer_file: str) -> None:
+        from tokenizers import Tokenizer
+
+        self._tokenizer = Tokenizer.from_file(tokenizer_file)
+        # transformers encodes without truncation nor padding unless asked to
+        self._tokenizer.no_truncation()
+        self._tokenizer.no_padding()
+
+    def encode(self, text: str) -> List[int]:
+        return self._tokenizer.encode(text).ids
+
+    def __call__(self, text: str | List[str], return_offsets_mapping: bool = False) -> Dict[str, Any]:
+        if isinstance(text, str):
+            encoding = self._tokenizer.encode(text)
+            output = {"input_ids": encoding.ids}
+            if return_offsets_mapping:
+                output["offset_mapping"] = encoding.offsets
+            return output
+        encodings = self._tokenizer.encode_batch(text)
+        output = {"input_ids": [encoding.ids for encoding in encodings]}
+        if return_offsets_mapping:
+            output["offset_mapping"] = [encoding.offsets for encoding in encodings]
+        return output
+
+
+def load_tokenizer(tokenizer_name: str, tokenizer_path: Optional[str] = None):
+    """
+    Load the tokenizer from an exported local artifact when tokenizer_path is given, otherwise by name.
+    """
+    if tokenizer_path:
+        tokenizer_file = os.path.join(tokenizer_path, TOKENIZER_FILE_NAME)
+        if os.path.exists(tokenizer_file):
+            return LocalFastTokenizer(tokenizer_file)
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(tokenizer_path, local_files_only=True)
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def export_tokenizer(tokenizer_name: str, output_dir: str) -> None:
+    """
+    Resolve the tokenizer by name and save it to output_dir, then check that the exported
+    artifact encodes a few samples exactly like the original tokenizer.
+    """
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    tokenizer.save_pretrained(output_dir)
+    exported = load_tokenizer(tokenizer_name, output_dir)
+    samples = ["", "def main():\n    return 0\n", "fun main() {\n\tprintln(\"héllo\")\n}", "<|file_sep|>a.py\nx = 1"]
+    for sample in samples:
+        if exported.encode(sample) != tokenizer.encode(sample):
+            raise ValueError(f"Exported tokenizer of {tokenizer_name} does not encode {sample!r} like the original one")
+    logger.info(f"Tokenizer {tokenizer_name} exported to {output_dir} ({type(exported).__name__})")
+
+
+def main() -> None:
+    from configs.base import PreprocessorConfig
+    from utils import get_tokenizer_name_from_model
+
+    config = PreprocessorConfig()
+    argparser = argparse.ArgumentParser(description="Export the tokenizer of the evaluated model to a local directory, to be loaded with TOKENIZER_PATH.")
+    argparser.add_argument("--language", type=str, default=config.language)
+    argparser.add_argument("--model-name", type=str, default=config.model_name)
+    argparser.add_argument("--output", type=str, required=True, help="Directory the tokenizer is saved to")
+    args = argparser.parse_args()
+
+    tokenizer_name = get_tokenizer_name_from_model(args.model_name, args.language)
+    export_tokenizer(tokenizer_name, args.output)
+    start = time.perf_counter()
+    load_tokenizer(tokenizer_name, args.output)
+    print(f"Exported {tokenizer_name} to {args.output}, loads in {time.perf_counter() - start:.3f}s with TOKENIZER_PATH={args.output}")
+
+
+if __name__ == "__main__":
+    from logging import basicConfig, INFO
+    basicConfig(level=INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
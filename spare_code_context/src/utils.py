@@ -2,18 +2,86 @@ import diff_match_patch
 from tree_sitter import Parser, Node
 import tree_sitter
 from tree_sitter_languages import get_language, get_parser
-from transformers import AutoTokenizer
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+import numpy as np
+from collections import OrderedDict
+import hashlib
 import os
-from configs.constants import MELLUM
+import time
+import threading
+from configs.constants import MELLUM, DIFF_DEADLINE_SECONDS
 
-def extract_diff(incomplete_code, original_code) -> str:
+if TYPE_CHECKING:
+    from transformers import AutoTokenizer
+
+def _count_lines(text: str) -> int:
+    return text.count("\n") + (1 if text and not text.endswith("\n") else 0)
+
+
+def anchor_diff_window(original_code: str, incomplete_code: str, dmp: diff_match_patch.diff_match_patch) -> Tuple[str, str]:
+    """
+    Strip the lines shared by both texts at their start and end, keeping only the window around the changes.
+
+    Enough shared context is kept on both sides of the window for diff_match_patch to clean up the diff
+    exactly as it would on the whole texts: its cleanups only move edits into neighbouring equalities
+    when those are not longer than the edits themselves.
+    """
+    if original_code == incomplete_code:
+        return "", ""
+    # Common prefix in whole lines: every line whose newline lies in the common characters
+    common_chars = dmp.diff_commonPrefix(original_code, incomplete_code)
+    prefix_end = original_code.rfind("\n", 0, common_chars) + 1
+
+    # Common suffix in whole lines, which must start on a line boundary in both texts
+    common_chars = dmp.diff_commonSuffix(original_code[prefix_end:], incomplete_code[prefix_end:])
+    original_suffix_start = len(original_code) - common_chars
+    incomplete_suffix_start = len(incomplete_code) - common_chars
+    if not ((original_suffix_start == 0 or original_code[original_suffix_start - 1] == "\n")
+            and (incomplete_suffix_start == 0 or incomplete_code[incomplete_suffix_start - 1] == "\n")):
+        newline = original_code.find("\n", original_suffix_start)
+        skipped = (newline + 1 if newline != -1 else len(original_code)) - original_suffix_start
+        original_suffix_start += skipped
+        incomplete_suffix_start += skipped
+
+    changed_original = original_code[prefix_end:original_suffix_start]
+    changed_incomplete = incomplete_code[prefix_end:incomplete_suffix_start]
+    max_changed_lines = max(_count_lines(changed_original), _count_lines(changed_incomplete))
+    # a few characters more for the blank-line boundary scoring of the semantic cleanup
+    max_changed_chars = max(len(changed_original), len(changed_incomplete)) + 4
+
+    # Walk back over the common prefix lines until the margin is long enough
+    window_start, num_lines = prefix_end, 0
+    while window_start > 0 and (num_lines <= max_changed_lines or prefix_end - window_start <= max_changed_chars):
+        window_start = original_code.rfind("\n", 0, window_start - 1) + 1
+        num_lines += 1
+    # Walk forward over the common suffix lines until the margin is long enough
+    window_end, num_lines = original_suffix_start, 0
+    while window_end < len(original_code) and (num_lines <= max_changed_lines or window_end - original_suffix_start <= max_changed_chars):
+        newline = original_code.find("\n", window_end)
+        window_end = newline + 1 if newline != -1 else len(original_code)
+        num_lines += 1
+    suffix_margin = window_end - original_suffix_start
+
+    return (original_code[window_start:window_end],
+            incomplete_code[window_start:incomplete_suffix_start + suffix_margin])
+
+
+def extract_diff(incomplete_code, original_code, anchored: bool = True, deadline_seconds: float = DIFF_DEADLINE_SECONDS) -> str:
     """
     Extract the diff from the original code.
+
+    The anchored diff only runs diff_match_patch on the window of lines that differ, within a deadline
+    shared by the whole computation, past which diff_match_patch falls back to a coarser diff. It gives the
+    same output as the plain line-mode diff of the whole texts (anchored=False), which is kept as reference.
     """
     dmp = diff_match_patch.diff_match_patch()
+    if anchored:
+        original_code, incomplete_code = anchor_diff_window(original_code, incomplete_code, dmp)
+        deadline = time.time() + deadline_seconds
+    else:
+        deadline = None
     # Create a diff between the original code and the incomplete code
-    diffs = dmp.diff_lineMode(original_code, incomplete_code, deadline=None)
+    diffs = dmp.diff_lineMode(original_code, incomplete_code, deadline=deadline)
     # Convert the diffs to a single diff string
     diffs = "\n".join([diff[1] for diff in diffs if diff[0] != 0])
     return diffs
@@ -36,7 +104,42 @@ def code_to_tree(code: str, parser: Parser) -> tree_sitter.Tree:
     tree = parser.parse(bytes(code, 'utf-8'))
     return tree
 
-def code_to_tokens(code: str | list[str], tokenizer: AutoTokenizer) -> list[int]:
+class SyntaxTreeCache:
+    """
+    Parse each code snippet once and share the resulting tree between all its consumers.
+    Keeps the trees of the most recently parsed snippets.
+    """
+    def __init__(self, language: str, max_entries: int = 8):
+        self.parser = get_parser(language)
+        self.max_entries = max_entries
+        self._trees: OrderedDict[str, tree_sitter.Tree] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse(self, code: str) -> tree_sitter.Tree:
+        with self._lock:
+            tree = self._trees.get(code)
+            if tree is not None:
+                self._trees.move_to_end(code)
+                return tree
+            tree = code_to_tree(code, self.parser)
+            self._trees[code] = tree
+            if len(self._trees) > self.max_entries:
+                self._trees.popitem(last=False)
+            return tree
+
+
+_syntax_tree_caches: Dict[str, SyntaxTreeCache] = {}
+
+
+def get_syntax_tree_cache(language: str) -> SyntaxTreeCache:
+    """
+    Get the process-wide syntax tree cache of the given language.
+    """
+    if language not in _syntax_tree_caches:
+        _syntax_tree_caches[language] = SyntaxTreeCache(language)
+    return _syntax_tree_caches[language]
+
+def code_to_tokens(code: str | list[str], tokenizer: "AutoTokenizer") -> list[int]:
     """
     Convert code to tokens using the tokenizer
     """
@@ -44,6 +147,110 @@ def code_to_tokens(code: str | list[str], tokenizer: AutoTokenizer) -> list[int]
         return [token for snippet in code for token in tokenizer.encode(snippet)]
     return tokenizer.encode(code)
 
+class TokenLineIndex:
+    """
+    Token counts of a composed file context, tokenized once: the tokens of its header line and a
+    cumulative count of the tokens starting on each content line.
+
+    A token is attributed to the line it starts on, so the count of a range of lines can differ by a
+    few tokens from the count of the same lines tokenized on their own.
+    """
+    __slots__ = ("total_tokens", "header_tokens", "cumulative_tokens")
+
+    def __init__(self, total_tokens: int, header_tokens: int, cumulative_tokens: np.ndarray):
+        self.total_tokens = total_tokens
+        self.header_tokens = header_tokens
+        self.cumulative_tokens = cumulative_tokens
+
+    @classmethod
+    def from_token_starts(cls, token_starts: Sequence[int], header_length: int, content_lines: List[str]) -> "TokenLineIndex":
+        """
+        Build the index from the character offsets at which tokens start in header + content,
+        where content_lines are the content split with splitlines(keepends=True).
+        """
+        num_lines = len(content_lines)
+        line_lengths = np.fromiter(map(len, content_lines), dtype=np.int64, count=num_lines)
+        # bucket 0 is the header line, special tokens included, bucket k + 1 is content line k
+        line_starts = np.zeros(num_lines + 1, dtype=np.int64)
+        line_starts[1:] = header_length + np.cumsum(line_lengths) - line_lengths
+        buckets = np.searchsorted(line_starts, np.asarray(token_starts, dtype=np.int64), side="right") - 1
+        counts = np.bincount(buckets, minlength=len(line_starts))
+        cumulative_tokens = np.zeros(num_lines + 1, dtype=np.int64)
+        np.cumsum(counts[1:], out=cumulative_tokens[1:])
+        return cls(len(token_starts), int(counts[0]), cumulative_tokens)
+
+    @classmethod
+    def from_line_counts(cls, header_tokens: int, line_tokens: np.ndarray) -> "TokenLineIndex":
+        """
+        Build the index from the number of tokens of the header and of each content line.
+        """
+        cumulative_tokens = np.zeros(len(line_tokens) + 1, dtype=np.int64)
+        np.cumsum(line_tokens, out=cumulative_tokens[1:])
+        return cls(header_tokens + int(cumulative_tokens[-1]), header_tokens, cumulative_tokens)
+
+    @property
+    def num_lines(self) -> int:
+        return len(self.cumulative_tokens) - 1
+
+    def count_lines(self, start: int, stop: int) -> int:
+        """
+        Number of tokens of the header followed by content lines[start:stop], with Python slice semantics.
+        """
+        lines = range(self.num_lines)[start:stop]
+        if not lines:
+            return self.header_tokens
+        return self.header_tokens + int(self.cumulative_tokens[lines.stop] - self.cumulative_tokens[lines.start])
+
+def count_tokens_in_batch(codes: List[str], tokenizer: "AutoTokenizer") -> List[int]:
+    """
+    Count the tokens of many strings with a single batch encoding call.
+    """
+    if not codes:
+        return []
+    return [len(input_ids) for input_ids in tokenizer(codes)["input_ids"]]
+
+class TokenCountCache:
+    """
+    LRU cache of token counts keyed by a hash of the counted content.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._counts: OrderedDict[bytes, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(code: str) -> bytes:
+        return hashlib.blake2b(code.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def get(self, key: bytes) -> int | None:
+        with self._lock:
+            count = self._counts.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._counts.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def put(self, key: bytes, count: int) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+
+    def statistics(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "token_count_cache_hits": self.hits,
+            "token_count_cache_misses": self.misses,
+            "token_count_cache_hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
 def get_tokenizer_name_from_model(model_name: str, language: str) -> str:
     """
     Get the tokenizer name from the model name and language.
@@ -54,87 +261,83 @@ def get_tokenizer_name_from_model(model_name: str, language: str) -> str:
     return f"{model_name}"
 
 
-def rank_nodes_by_distance(nodes: List[Node], completion_line: int) -> List[Node]:
+class SymbolRecord:
+    """
+    Compact record of an extracted symbol: its decoded text, capture name and position.
+    Records do not reference the parse tree, which can be released right after extraction.
+    """
+    __slots__ = ("text", "kind", "start_row", "start_col", "end_row", "end_col")
+
+    def __init__(self, text: str, kind: str, start_row: int, start_col: int, end_row: int, end_col: int):
+        self.text = text
+        self.kind = kind
+        self.start_row = start_row
+        self.start_col = start_col
+        self.end_row = end_row
+        self.end_col = end_col
+
+    @classmethod
+    def from_node(cls, node: Node, kind: str) -> "SymbolRecord":
+        start_row, start_col = node.start_point
+        end_row, end_col = node.end_point
+        return cls(node.text.decode(), kind, start_row, start_col, end_row, end_col)
+
+    def shifted(self, offset: Tuple[int, int]) -> "SymbolRecord":
+        """
+        Copy of the record with its position moved by the given (row, column) offset.
+        """
+        return SymbolRecord(self.text, self.kind,
+                            self.start_row + offset[0], self.start_col + offset[1],
+                            self.end_row + offset[0], self.end_col + offset[1])
+
+    @property
+    def start_point(self) -> Tuple[int, int]:
+        return (self.start_row, self.start_col)
+
+    @property
+    def end_point(self) -> Tuple[int, int]:
+        return (self.end_row, self.end_col)
+
+    def __repr__(self):
+        return f"SymbolRecord(text={self.text!r}, kind={self.kind}, start_point={self.start_point}, end_point={self.end_point})"
+
+
+def rank_nodes_by_distance(nodes: List[SymbolRecord], completion_line: int) -> List[SymbolRecord]:
     """
     Rank nodes based on their distance to the completion line.
     """
-    return sorted(nodes, key=lambda node: abs(node.start_point[0] - completion_line))
+    return sorted(nodes, key=lambda node: abs(node.start_row - completion_line))
 
 
-def deduplicate_nodes(nodes: List[Node]) -> List[Node]:
+def deduplicate_nodes(nodes: List[SymbolRecord]) -> List[SymbolRecord]:
     """
     Deduplicate nodes based on their text content.
     """
     seen = set()
     deduplicated = []
     for node in nodes:
-        if node.text.decode() not in seen:
-            seen.add(node.text.decode())
+        if node.text not in seen:
+            seen.add(node.text)
             deduplicated.append(node)
     return deduplicated
 
 
-# def handle_nodes_in_suffix(nodes: List[Node], completion_point: Tuple[int, int]) -> List[Node]:
-#     """
-#     Incrementing the start and end points of nodes in the suffix by the completion point.
-#     """
-#     for node in nodes:
-#         new_start_line, new_start_column = node.start_point[0], node.start_point[1]
-#         new_start_line += completion_point[0]
-#         new_start_column += completion_point[1]
-#         new_end_line, new_end_column = node.end_point[0], node.end_point[1]
-#         new_end_line += completion_point[0]
-#         new_end_column += completion_point[1]
-#         node.start_point = (new_start_line, new_start_column)
-#         node.end_point = (new_end_line, new_end_column)
-#     return nodes
-
-def find_first_and_last_nodes(nodes: List[Node]) -> Tuple[Node, Node]:
+def find_first_and_last_nodes(nodes: List[SymbolRecord]) -> Tuple[SymbolRecord, SymbolRecord]:
     """
     Find the first and last nodes in the list.
     """
     if not nodes:
         return None, None
-    first_node = min(nodes, key=lambda node: node.start_point)
-    last_node = max(nodes, key=lambda node: node.end_point)
+    first_node = min(nodes, key=lambda node: (node.start_row, node.start_col))
+    last_node = max(nodes, key=lambda node: (node.end_row, node.end_col))
     return first_node, last_node
 
 
-class AdjustedNode:
-    """
-    Wrapper class for tree_sitter.Node with adjusted position information.
-    """
-    def __init__(self, original_node: Node, start_offset: Tuple[int, int] = (0, 0)):
-        self.original_node = original_node
-        self.start_offset = start_offset
-    
-    @property
-    def start_point(self) -> Tuple[int, int]:
-        return (
-            self.original_node.start_point[0] + self.start_offset[0],
-            self.original_node.start_point[1] + self.start_offset[1]
-        )
-    
-    @property
-    def end_point(self) -> Tuple[int, int]:
-        return (
-            self.original_node.end_point[0] + self.start_offset[0],
-            self.original_node.end_point[1] + self.start_offset[1]
-        )
-    
-    @property
-    def text(self):
-        return self.original_node.text
-    
-    def __getattr__(self, name):
-        # Delegate other attributes to the original node
-        return getattr(self.original_node, name)
-
-def handle_nodes_in_suffix(nodes: List[Node], completion_point: Tuple[int, int]) -> List[AdjustedNode]:
+def handle_nodes_in_suffix(nodes: List[SymbolRecord], completion_point: Tuple[int, int]) -> List[SymbolRecord]:
     """
-    Create adjusted node wrappers for nodes in the suffix with completion point offset.
+    Create copies of the nodes in the suffix, offset by the completion point.
     """
-    return [AdjustedNode(node, completion_point) for node in nodes]
+    return [node.shifted(completion_point) for node in nodes]
 
 def merge_overlapping_ranges(snippets):
     """
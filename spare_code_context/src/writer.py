@@ -0,0 +1,137 @@
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+from logging import getLogger
+
+import jsonlines
+
+from datapoint import Prediction, QueryPoint
+
+logger = getLogger(__name__)
+
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+class PredictionWriter:
+    """
+    Long-lived writer of the predictions and queries JSONL files.
+
+    Lines are buffered and flushed every `flush_every` datapoints or `flush_interval` seconds. After each flush,
+    a checkpoint next to the predictions file records the number of completed datapoints, the id of the last one
+    and the size of both files, so that an interrupted run can be resumed from the last flush.
+    """
+
+    def __init__(self,
+                 predictions_file: str,
+                 queries_file: str,
+                 flush_every: int = 64,
+                 flush_interval: float = 5.0,
+                 resume: bool = False,
+                 ids_file: Optional[str] = None) -> None:
+        self.predictions_file = predictions_file
+        self.queries_file = queries_file
+        self.ids_file = ids_file
+        self.checkpoint_file = predictions_file + CHECKPOINT_SUFFIX
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.completed = 0
+        self.last_id: Optional[str] = None
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+        checkpoint = self.load_checkpoint() if resume else None
+        if checkpoint is not None:
+            # drop whatever was written after the last checkpoint
+            self._truncate(predictions_file, checkpoint["predictions_size"])
+            self._truncate(queries_file, checkpoint["queries_size"])
+            if ids_file:
+                self._truncate(ids_file, checkpoint.get("ids_size", 0))
+            self.completed = checkpoint["completed"]
+            self.last_id = checkpoint["last_id"]
+            logger.info(f"Resuming after {self.completed} completed datapoints, the last one being {self.last_id}")
+            mode = 'ab'
+        else:
+            if resume:
+                logger.warning(f"No checkpoint found at {self.checkpoint_file}, starting from scratch.")
+            if os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+            mode = 'wb'
+        for path in (predictions_file, queries_file, ids_file):
+            if path:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._predictions_fp = open(predictions_file, mode)
+        self._queries_fp = open(queries_file, mode)
+        # ids of the written datapoints, line by line, for outputs merged later on
+        self._ids_fp = open(ids_file, mode) if ids_file else None
+        self._predictions_writer = jsonlines.Writer(self._predictions_fp)
+        self._queries_writer = jsonlines.Writer(self._queries_fp)
+
+    def load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.checkpoint_file):
+            return None
+        with open(self.checkpoint_file, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _truncate(path: str, size: int) -> None:
+        if not os.path.exists(path):
+            if size:
+                raise ValueError(f"{path} is missing, although its checkpoint records {size} bytes")
+            return
+        if os.path.getsize(path) < size:
+            raise ValueError(f"{path} is shorter than its checkpoint records ({size} bytes)")
+        os.truncate(path, size)
+
+    def write(self, prediction: Prediction | dict, query: QueryPoint | dict, datapoint_id: Optional[str] = None) -> None:
+        """
+        Write the prediction and the queries of the next completed datapoint.
+        """
+        self._predictions_writer.write(prediction.dict() if isinstance(prediction, Prediction) else prediction)
+        self._queries_writer.write(query.dict() if isinstance(query, QueryPoint) else query)
+        if self._ids_fp is not None:
+            self._ids_fp.write(f"{datapoint_id}\n".encode("utf-8"))
+        self.completed += 1
+        self.last_id = datapoint_id
+        self._pending += 1
+        if self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered lines to disk, then record the checkpoint.
+        """
+        for fp in (self._predictions_fp, self._queries_fp, self._ids_fp):
+            if fp is not None:
+                fp.flush()
+                os.fsync(fp.fileno())
+        checkpoint = {
+            "completed": self.completed,
+            "last_id": self.last_id,
+            "predictions_size": self._predictions_fp.tell(),
+            "queries_size": self._queries_fp.tell(),
+        }
+        if self._ids_fp is not None:
+            checkpoint["ids_size"] = self._ids_fp.tell()
+        temporary_file = self.checkpoint_file + ".tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(temporary_file, self.checkpoint_file)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        if self._predictions_fp.closed:
+            return
+        self.flush()
+        self._predictions_fp.close()
+        self._queries_fp.close()
+        if self._ids_fp is not None:
+            self._ids_fp.close()
+
+    def __enter__(self) -> "PredictionWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # the buffered datapoints are complete, keep them even if the run is interrupted
+        self.close()
@@ -1,10 +1,10 @@
 from configs.zoekt import QueryGeneratorConfig, QueryReference
 from typing import List, Tuple, Dict
-from tree_sitter import Node
 from datapoint import DataPoint
 from configs.constants import SEPARATOR_COMMENT
-from utils import code_to_tree, handle_nodes_in_suffix, find_first_and_last_nodes, deduplicate_nodes, rank_nodes_by_distance, AdjustedNode
+from utils import code_to_tree, handle_nodes_in_suffix, find_first_and_last_nodes, deduplicate_nodes, rank_nodes_by_distance, get_syntax_tree_cache, SymbolRecord
 
+from instrumentation import get_metrics
 from zoekt_query_generator.symbols_extractor import FunctionAndClassExtractor, NavigationExpressionExtractor, WildIdentifierExtractor
 
 class ZoektQueryGenerator:
@@ -17,6 +17,9 @@ class ZoektQueryGenerator:
         self.function_and_class_extractor = FunctionAndClassExtractor(config.language)
         self.navigation_expression_extractor = NavigationExpressionExtractor(config.language)
         self.wild_identifier_extractor = WildIdentifierExtractor(config.language)
+        # each snippet is parsed once and shared by the three extractors
+        self.syntax_trees = get_syntax_tree_cache(config.language)
+        self.metrics = get_metrics()
         
     @staticmethod
     def extract_diff_prefix_and_suffix(diff: str) -> tuple[str, str]:
@@ -29,7 +32,7 @@ class ZoektQueryGenerator:
         return splitted[0], splitted[1]
 
 
-    def find_all_nodes(self, datapoint: DataPoint) -> List[Node | AdjustedNode]:
+    def find_all_nodes(self, datapoint: DataPoint) -> Dict[str, List[SymbolRecord]]:
         """
         Find all relevant nodes in the given datapoint.
         """
@@ -38,9 +41,14 @@ class ZoektQueryGenerator:
         diff = datapoint.diff.replace(SEPARATOR_COMMENT, "")
         
         for code in [diff, diff_prefix]:
-            function_and_class_nodes.extend(self.function_and_class_extractor.extract_symbols(code))
-            navigation_expression_nodes.extend(self.navigation_expression_extractor.extract_symbols(code))
-            wild_identifier_nodes.extend(self.wild_identifier_extractor.extract_symbols(code))
+            if not code:
+                continue
+            with self.metrics.timer("query_generation.parse"):
+                tree = self.syntax_trees.parse(code)
+            with self.metrics.timer("query_generation.symbol_extraction"):
+                function_and_class_nodes.extend(self.function_and_class_extractor.extract_symbols_from_tree(tree))
+                navigation_expression_nodes.extend(self.navigation_expression_extractor.extract_symbols_from_tree(tree))
+                wild_identifier_nodes.extend(self.wild_identifier_extractor.extract_symbols_from_tree(tree))
             
         # Handle suffix nodes
         function_and_class_nodes.extend(handle_nodes_in_suffix(function_and_class_nodes, datapoint.completion_point))
@@ -58,7 +66,7 @@ class ZoektQueryGenerator:
             "wild_identifier_nodes": wild_identifier_nodes
         }
 
-    def process_function_and_class_nodes(self, function_and_class_nodes: List[Node | AdjustedNode], repo_name: str, completion_point: Tuple[int, int]) -> List[Tuple[str, str]]:
+    def process_function_and_class_nodes(self, function_and_class_nodes: List[SymbolRecord], repo_name: str, completion_point: Tuple[int, int]) -> List[Tuple[str, str]]:
         candidates = []
         # rank nodes by distance to completion line
         if not function_and_class_nodes:
@@ -69,28 +77,28 @@ class ZoektQueryGenerator:
         function_and_class_nodes = function_and_class_nodes[:self.config.max_terms]
         
         # 1. Naive query with all functions/classes (ranked by distance)
-        naive_query = " ".join(node.text.decode() for node in function_and_class_nodes)
+        naive_query = " ".join(node.text for node in function_and_class_nodes)
         candidates.append((f"{naive_query} r:{repo_name}", "functions_classes_naive"))
 
         # 2. OR logic version
-        or_query = " or ".join(node.text.decode() for node in function_and_class_nodes)
+        or_query = " or ".join(node.text for node in function_and_class_nodes)
         candidates.append((f"{or_query} r:{repo_name}", "functions_classes_or"))
 
         # 3. Reduced terms variants
         for max_terms in [5, 4, 3]:
             if len(function_and_class_nodes) > max_terms:
-                reduced_query = " ".join(node.text.decode() for node in function_and_class_nodes[:max_terms])
+                reduced_query = " ".join(node.text for node in function_and_class_nodes[:max_terms])
                 candidates.append((f"{reduced_query} r:{repo_name}", f"functions_classes_top{max_terms}"))
 
         # 4. Regex query (first to last)
         if len(function_and_class_nodes) >= 2:
             first_func, last_func = find_first_and_last_nodes(function_and_class_nodes)
-            regex_query = f"{first_func.text.decode()}.*{last_func.text.decode()}"
+            regex_query = f"{first_func.text}.*{last_func.text}"
             candidates.append((f"{regex_query} r:{repo_name}", "functions_classes_regex"))
 
         return candidates
 
-    def process_navigation_expressions_nodes(self, navigation_expressions: List[Node | AdjustedNode], repo_name: str, completion_point: Tuple[int, int]) -> List[Tuple[str, str]]:
+    def process_navigation_expressions_nodes(self, navigation_expressions: List[SymbolRecord], repo_name: str, completion_point: Tuple[int, int]) -> List[Tuple[str, str]]:
 
         # rank nodes by distance to completion line
         if not navigation_expressions:
@@ -100,7 +108,7 @@ class ZoektQueryGenerator:
         first_expr, last_expr = find_first_and_last_nodes(navigation_expressions)
         # filter to max terms
         navigation_expressions = navigation_expressions[:self.config.max_terms]
-        navigation_expressions_text = [node.text.decode() for node in navigation_expressions]
+        navigation_expressions_text = [node.text for node in navigation_expressions]
         # Process navigation expressions
         def handle_navigation_expression(expr: str) -> str:
             s = "".join(c if c.isalnum() else " " for c in expr)
@@ -136,20 +144,20 @@ class ZoektQueryGenerator:
         
         # 5. Regex query for navigation
         if first_expr and last_expr:
-            first_id = first_expr.text.decode().split(".")[0]
-            last_id = last_expr.text.decode().split(".")[-1]
+            first_id = first_expr.text.split(".")[0]
+            last_id = last_expr.text.split(".")[-1]
             nav_regex_query = f"{first_id}.*{last_id}"
             candidates.append((f"{nav_regex_query} r:{repo_name}", "navigation_regex"))
         return candidates
 
-    def process_wild_identifiers(self, wild_identifiers: List[Node | AdjustedNode], 
+    def process_wild_identifiers(self, wild_identifiers: List[SymbolRecord], 
                                  repo_name: str,
                                  completion_point: Tuple[int, int]) -> List[Tuple[str, str]]:
         candidates = []
         if not wild_identifiers:
             return []
         first_id, last_id = find_first_and_last_nodes(wild_identifiers)
-        wild_identifiers = [node.text.decode() for node in wild_identifiers]
+        wild_identifiers = [node.text for node in wild_identifiers]
         # rank by occurrence
         wild_identifiers = sorted(set(wild_identifiers), key=wild_identifiers.count, reverse=True)
         ranked_identifiers = wild_identifiers[:self.config.max_terms]
@@ -171,7 +179,7 @@ class ZoektQueryGenerator:
             
             # 4. Regex query
             if first_id and last_id:
-                id_regex_query = f"{first_id.text.decode()}.*{last_id.text.decode()}"
+                id_regex_query = f"{first_id.text}.*{last_id.text}"
                 candidates.append((f"{id_regex_query} r:{repo_name}", "identifiers_regex"))
                 
         return candidates
@@ -0,0 +1,111 @@
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from configs.zoekt import SearchConfig
+from context_searcher import CircuitBreaker, ZoektSearchRequester
+
+
+def make_response(status_code: int, content: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    return response
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_half_open_trial_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # a single trial request at a time
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.consecutive_failures == 0
+
+
+def test_half_open_trial_reopens_on_failure():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker(failure_threshold=0, reset_timeout=60)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+class FakeSession:
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.requests = 0
+
+    def post(self, url, data=None, timeout=None):
+        self.requests += 1
+        if isinstance(self.outcome, BaseException):
+            raise self.outcome
+        return self.outcome
+
+    def close(self):
+        pass
+
+
+def half_open_requester(outcome) -> ZoektSearchRequester:
+    config = SearchConfig(max_retries=0, retry_delay=0.0, cache_max_entries=0, cache_dir=None,
+                          circuit_breaker_threshold=1, circuit_breaker_reset_timeout=0.0, candidate_stats_path=None)
+    requester = ZoektSearchRequester(config)
+    requester.session = FakeSession(outcome)
+    requester.circuit_breaker.record_failure()
+    assert requester.circuit_breaker.state == CircuitBreaker.OPEN
+    return requester
+
+
+@pytest.mark.parametrize("outcome, state", [
+    (make_response(200, b'{"Result": {"Files": [], "FileCount": 0}}'), CircuitBreaker.CLOSED),
+    (make_response(400, b"bad query"), CircuitBreaker.CLOSED),
+    (make_response(404, b"not found"), CircuitBreaker.CLOSED),
+    (make_response(503, b"unavailable"), CircuitBreaker.OPEN),
+    (make_response(200, b"not json"), CircuitBreaker.OPEN),
+    (requests.exceptions.ConnectionError("refused"), CircuitBreaker.OPEN),
+    (requests.exceptions.Timeout("timed out"), CircuitBreaker.OPEN),
+    (requests.exceptions.TooManyRedirects("redirects"), CircuitBreaker.OPEN),
+    (RuntimeError("unexpected"), CircuitBreaker.OPEN),
+])
+def test_trial_request_resolves_half_open_state(outcome, state):
+    requester = half_open_requester(outcome)
+    try:
+        requester._request_with_retries("foo")
+        assert requester.session.requests == 1
+        assert requester.circuit_breaker.state == state
+    finally:
+        requester.close()